@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+import importlib
+import math
+
+import app.config as app_config
+
+
+@dataclass
+class AutoscaleStats:
+    workers: int            # current number of workers
+    busy_workers: int       # workers running a submission
+    queue_length: int       # length of the (global) work queue
+    cpu_count: int
+    cpu_percent: float      # host cpu usage, 0-100
+    memory_percent: float   # host memory usage, 0-100
+
+    @property
+    def busy_ratio(self) -> float:
+        return self.busy_workers / self.workers if self.workers else 1.0
+
+    @property
+    def foreign_cpus(self) -> float:
+        """cpus used by other processes on the host, assuming each busy worker uses at most one cpu"""
+        return max(0.0, self.cpu_count * self.cpu_percent / 100 - self.busy_workers)
+
+
+class AutoscalePolicy:
+    """
+    Scale up when there is a backlog, most workers are busy and the host has idle cpus
+    (for example when the workers are waiting for compiling I/O).
+    Scale down when the host is under cpu/memory pressure (for example shared with other jobs),
+    or when most workers have been idle without backlog for `scale_down_delay` seconds.
+    After every change, nothing is changed for `cooldown` seconds.
+    """
+    def __init__(
+        self,
+        min_workers: int,
+        max_workers: int,
+        *,
+        scale_up_busy_ratio: float = app_config.AUTOSCALE_UP_BUSY_RATIO,
+        scale_down_busy_ratio: float = app_config.AUTOSCALE_DOWN_BUSY_RATIO,
+        max_cpu_percent: float = app_config.AUTOSCALE_MAX_CPU_PERCENT,
+        max_memory_percent: float = app_config.AUTOSCALE_MAX_MEMORY_PERCENT,
+        cooldown: float = app_config.AUTOSCALE_COOLDOWN,
+        scale_down_delay: float = app_config.AUTOSCALE_DOWN_DELAY,
+    ):
+        if scale_down_busy_ratio >= scale_up_busy_ratio:
+            raise ValueError('scale_down_busy_ratio must be smaller than scale_up_busy_ratio')
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_up_busy_ratio = scale_up_busy_ratio
+        self.scale_down_busy_ratio = scale_down_busy_ratio
+        self.max_cpu_percent = max_cpu_percent
+        self.max_memory_percent = max_memory_percent
+        self.cooldown = cooldown
+        self.scale_down_delay = scale_down_delay
+        self._last_change_time = 0.0
+        self._idle_since = None
+
+    def _clamp(self, workers: int) -> int:
+        return max(self.min_workers, min(self.max_workers, workers))
+
+    def decide(self, stats: AutoscaleStats, now: float) -> tuple[int, str]:
+        """Returns the desired number of workers and the reason of the change"""
+        desired, reason = self._decide(stats, now)
+        desired = self._clamp(desired)
+        if desired != stats.workers:
+            self._last_change_time = now
+            self._idle_since = None
+        return desired, reason
+
+    def _decide(self, stats: AutoscaleStats, now: float) -> tuple[int, str]:
+        current = stats.workers
+        if current != self._clamp(current):
+            return current, 'bounds'
+
+        idle = stats.queue_length == 0 and stats.busy_ratio <= self.scale_down_busy_ratio
+        if not idle:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+
+        if now - self._last_change_time < self.cooldown:
+            return current, ''
+
+        step = max(1, math.ceil(current * 0.25))
+        if stats.memory_percent >= self.max_memory_percent:
+            return current - step, 'memory_pressure'
+        if stats.cpu_percent >= self.max_cpu_percent:
+            # leave the cpus used by other processes to them
+            available = math.floor(stats.cpu_count * self.max_cpu_percent / 100 - stats.foreign_cpus)
+            if available < current:
+                return max(available, current - step), 'cpu_pressure'
+            return current, ''
+        if stats.queue_length > 0 and stats.busy_ratio >= self.scale_up_busy_ratio:
+            idle_cpus = round(stats.cpu_count * (100 - stats.cpu_percent) / 100)
+            if idle_cpus > 0:
+                return current + min(idle_cpus, stats.queue_length, max(step, current)), 'backlog'
+            return current, ''
+        if idle and now - self._idle_since >= self.scale_down_delay:
+            return max(stats.busy_workers + 1, current - step), 'idle'
+        return current, ''
+
+
+def load_policy(min_workers: int, max_workers: int) -> AutoscalePolicy:
+    """AUTOSCALE_POLICY can be `module.path:ClassName` to use a custom policy"""
+    if not app_config.AUTOSCALE_POLICY:
+        return AutoscalePolicy(min_workers, max_workers)
+    module_name, _, class_name = app_config.AUTOSCALE_POLICY.partition(':')
+    policy_class = getattr(importlib.import_module(module_name), class_name)
+    return policy_class(min_workers, max_workers)
@@ -0,0 +1,67 @@
+import logging
+from time import process_time, time
+
+import app.config as app_config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Workers run on different cpus, so the same time limit is a different amount of work on every node.
+# Every worker runs a fixed cpu bound benchmark at startup and every SPEED_CALIBRATION_INTERVAL seconds
+# (between work items), and its speed factor is SPEED_CALIBRATION_REFERENCE / its cpu time of the benchmark:
+# 2 means twice as fast as the reference node. Time limits are in seconds of the reference node,
+# so a submission gets time_limit / speed_factor seconds, and its normalized cost is cost * speed_factor.
+# Workers calibrate themselves (not once per node), so pinned workers measure their own cpus.
+
+BENCHMARK_ROUNDS = 5
+# a broken measurement (for example a throttled vm at startup) can't make limits absurd
+MAX_SPEED_FACTOR = 4.0
+# The stretched MAX_EXECUTION_TIME must end within MAX_QUEUE_WAIT_TIME (keeping a second for starting and reporting),
+# or the api gives up on it (its deadline cuts it) and the worker manager kills it as hung.
+_WAIT_MARGIN = 1
+MIN_SPEED_FACTOR = max(0.25, app_config.MAX_EXECUTION_TIME / max(app_config.MAX_QUEUE_WAIT_TIME - _WAIT_MARGIN, 1))
+
+
+def _workload() -> int:
+    # integers, dicts, lists and strings, like a typical submission
+    total = 0
+    table = {}
+    for i in range(400000):
+        total = (total * 31 + i) % 1000003
+        table[i & 1023] = total
+    words = ' '.join(map(str, sorted(table.values()))).split()
+    return total + len(words)
+
+
+def benchmark(rounds: int = BENCHMARK_ROUNDS) -> float:
+    """cpu seconds of the benchmark, the fastest of `rounds` runs (other processes only make runs slower)"""
+    costs = []
+    for _ in range(rounds):
+        start = process_time()
+        _workload()
+        costs.append(process_time() - start)
+    return min(costs)
+
+
+class SpeedCalibrator:
+    """The speed factor of this process, 1 if calibration is disabled (SPEED_CALIBRATION_REFERENCE is 0)"""
+    def __init__(self):
+        self.speed_factor = 1.0
+        self.calibrated_at: float | None = None
+
+    def calibrate_if_due(self) -> bool:
+        """Returns whether it is calibrated"""
+        if not app_config.SPEED_CALIBRATION_REFERENCE:
+            return False
+        if self.calibrated_at is not None and time() - self.calibrated_at < app_config.SPEED_CALIBRATION_INTERVAL:
+            return False
+        cost = benchmark()
+        self.calibrated_at = time()
+        speed_factor = app_config.SPEED_CALIBRATION_REFERENCE / cost if cost > 0 else MAX_SPEED_FACTOR
+        speed_factor = min(max(speed_factor, MIN_SPEED_FACTOR), MAX_SPEED_FACTOR)
+        if abs(speed_factor - self.speed_factor) > 0.1 * self.speed_factor:
+            logger.info(f'Speed factor changed from {self.speed_factor:.3f} to {speed_factor:.3f} '
+                        f'(benchmark {cost:.4f}s, reference {app_config.SPEED_CALIBRATION_REFERENCE:.4f}s).')
+        self.speed_factor = speed_factor
+        return True
@@ -0,0 +1,122 @@
+import logging
+import threading
+from time import sleep
+
+import psutil
+
+import app.config as app_config
+from app.libs.redis_queue import RedisQueue
+from app.model import ResultReason
+
+
+logger = logging.getLogger(__name__)
+
+
+# Work is cancelled by a marker key per cancel id. Every payload has the ids it can be cancelled by
+# (its own work id or the internal id of its batch, the sub_id of the batch and of the submission),
+# and workers check them before starting it, and every CANCEL_CHECK_INTERVAL seconds while judging it.
+# A marker is the time of the cancellation, and only cancels work of requests which arrived before it,
+# so a sub_id can be reused after it is cancelled.
+# A fail-fast group of a batch has a marker too, set by the worker of the first failed member.
+
+
+def _marker_key(cancel_id: str) -> str:
+    return f'{app_config.REDIS_CANCEL_PREFIX}{cancel_id}'
+
+
+async def cancel(redis_queue: RedisQueue, *cancel_ids: str):
+    """Only for async queue."""
+    if not cancel_ids:
+        return
+    cancel_time = redis_queue.now()
+    await redis_queue.set_multi(
+        {_marker_key(cancel_id): cancel_time for cancel_id in cancel_ids},
+        app_config.REDIS_CANCEL_EXPIRE,
+    )
+
+
+def _group_marker_key(group_id: str) -> str:
+    return f'{app_config.REDIS_CANCEL_PREFIX}group:{group_id}'
+
+
+def fail_group(redis_queue: RedisQueue, group_id: str):
+    """Skip the left members of the fail-fast group. Only for sync queue."""
+    redis_queue.set(_group_marker_key(group_id), 1, app_config.REDIS_CANCEL_EXPIRE)
+
+
+def cancel_reason(
+    redis_queue: RedisQueue, cancel_ids: list[str] | None, group_id: str | None = None, request_time: float | None = None
+) -> ResultReason | None:
+    """
+    `cancelled`, `skipped` (the group failed) or None. Only for sync queue.
+    request_time: when the request of the work arrived, older cancellations are ignored
+    """
+    keys = [*map(_marker_key, cancel_ids or [])]
+    if group_id:
+        keys.append(_group_marker_key(group_id))
+    if not keys:
+        return None
+    values = redis_queue.get_multi(*keys)
+    if any(
+        value is not None and (request_time is None or float(value) >= request_time)
+        for value in values[:len(cancel_ids or [])]
+    ):
+        return ResultReason.CANCELLED
+    if group_id and values[-1] is not None:
+        return ResultReason.SKIPPED
+    return None
+
+
+class CancelWatcher:
+    """
+    Kill the child processes of the worker (the compiler or the submission) when the work being judged is cancelled
+    (or its fail-fast group failed, if watched). The executor sees a killed process,
+    and the worker replaces the result with the reason returned by `unwatch`.
+    """
+    def __init__(self, redis_queue: RedisQueue):
+        self.redis_queue = redis_queue
+        self.reason: ResultReason | None = None
+        self._watched: tuple[list[str] | None, str | None, float | None] | None = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='cancel-watcher', daemon=True)
+        self._thread.start()
+
+    def watch(self, cancel_ids: list[str] | None, group_id: str | None = None, request_time: float | None = None):
+        with self._lock:
+            self._watched = (cancel_ids, group_id, request_time) if cancel_ids or group_id else None
+            self.reason = None
+
+    def unwatch(self) -> ResultReason | None:
+        """
+        Stop watching, and return the reason if the work was killed.
+        Call it as soon as the executor returns, so a later cancellation can't touch the finished result.
+        """
+        with self._lock:
+            self._watched = None
+            return self.reason
+
+    def _run(self):
+        while True:
+            sleep(app_config.CANCEL_CHECK_INTERVAL)
+            watched = self._watched
+            if not watched:
+                continue
+            try:
+                reason = cancel_reason(self.redis_queue, *watched)
+            except Exception:
+                logger.exception('Failed to check cancellation')
+                continue
+            with self._lock:
+                if reason is None or self._watched is not watched:
+                    continue
+                self._watched = None
+                killed = False
+                for child in psutil.Process().children(recursive=True):
+                    try:
+                        child.kill()
+                        killed = True
+                    except psutil.NoSuchProcess:
+                        pass
+                # nothing was running, so the result (if any) is not affected
+                if killed:
+                    self.reason = reason
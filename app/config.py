@@ -5,6 +5,24 @@ from app.version import __version__ as version
 env = os.environ.get
 
 ERROR_CASE_SAVE_PATH = env('ERROR_CASE_SAVE_PATH', '')  # default empty, which means not save error case
+# error cases are sampled and written to rotating jsonl files in background, so they never block judging
+ERROR_CASE_SAMPLE_RATE = float(env('ERROR_CASE_SAMPLE_RATE', 1))  # default 1, which means all (within quota)
+# max error cases per reason saved by a worker in ERROR_CASE_QUOTA_WINDOW seconds. 0 means no limit
+ERROR_CASE_QUOTA = int(env('ERROR_CASE_QUOTA', 1000))
+# per reason quotas, like `wrong_answer:100,internal_error:10000`.
+# reasons (see _error_reason in worker_manager): wrong_answer, runtime_error, compile_error, worker_timeout, output_limit, internal_error
+ERROR_CASE_QUOTAS = env('ERROR_CASE_QUOTAS', '')
+ERROR_CASE_QUOTA_WINDOW = float(env('ERROR_CASE_QUOTA_WINDOW', 60*60))  # default 1 hour
+ERROR_CASE_QUEUE_SIZE = int(env('ERROR_CASE_QUEUE_SIZE', 1000))  # error cases are dropped when the queue is full
+ERROR_CASE_MAX_FILE_SIZE = int(env('ERROR_CASE_MAX_FILE_SIZE', 64))  # default 64 MB
+ERROR_CASE_MAX_TOTAL_SIZE = int(env('ERROR_CASE_MAX_TOTAL_SIZE', 1024))  # default 1 GB, all files in ERROR_CASE_SAVE_PATH
+
+# sampled requests (with arrival time and results) saved by the api, for benchmarks/replay.py
+TRAFFIC_CAPTURE_PATH = env('TRAFFIC_CAPTURE_PATH', '')  # default empty, which means disabled
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(env('TRAFFIC_CAPTURE_SAMPLE_RATE', 0.01))  # default 1% of the requests
+TRAFFIC_CAPTURE_QUEUE_SIZE = int(env('TRAFFIC_CAPTURE_QUEUE_SIZE', 1000))  # requests are dropped when the queue is full
+TRAFFIC_CAPTURE_MAX_FILE_SIZE = int(env('TRAFFIC_CAPTURE_MAX_FILE_SIZE', 64))  # default 64 MB
+TRAFFIC_CAPTURE_MAX_TOTAL_SIZE = int(env('TRAFFIC_CAPTURE_MAX_TOTAL_SIZE', 1024))  # default 1 GB, all files in TRAFFIC_CAPTURE_PATH
 
 MAX_EXECUTION_TIME = int(env('MAX_EXECUTION_TIME', 10))  # default 10 seconds
 MAX_STDOUT_ERROR_LENGTH = int(env('MAX_STDOUT_ERROR_LENGTH', 1000))
@@ -14,12 +32,41 @@ MAX_QUEUE_WAIT_TIME = int(env('MAX_QUEUE_WAIT_TIME', MAX_EXECUTION_TIME + 5))
 LONG_BATCH_MAX_QUEUE_WAIT_TIME = int(env('LONG_BATCH_MAX_QUEUE_WAIT_TIME', 60*60))  # default 1 hour
 MAX_QUEUE_WORK_LIFE_TIME = int(env('MAX_QUEUE_WORK_LIFE_TIME', 4))  # default 4s
 MAX_MEMORY = int(env('MAX_MEMORY', 256))  # default 256 MB
+MAX_OUTPUT_SIZE = int(env('MAX_OUTPUT_SIZE', 64))  # default 64 MB of stdout + stderr. 0 means no limit
+# RLIMIT_NPROC of submissions. It counts all processes of the user, so it only works when workers run as a dedicated
+# non-root user, and must be bigger than the number of processes of the user. default 0, which means no limit
+MAX_PROCESSES = int(env('MAX_PROCESSES', 0))
+# how workers start submissions and compilers: subprocess (default) or posix_spawn. See benchmarks/spawn.py
+SPAWN_METHOD = env('SPAWN_METHOD', 'subprocess')
+if SPAWN_METHOD not in ('subprocess', 'posix_spawn'):
+    raise ValueError('SPAWN_METHOD must be subprocess or posix_spawn')
 MAX_WORKERS = int(env('MAX_WORKERS', os.cpu_count())) or os.cpu_count()  # default os.cpu_count()
+# autoscaling is enabled when MIN_WORKERS < MAX_WORKERS
+MIN_WORKERS = min(int(env('MIN_WORKERS', MAX_WORKERS)), MAX_WORKERS)  # default MAX_WORKERS, which means no autoscaling
+AUTOSCALE_POLICY = env('AUTOSCALE_POLICY', '')  # default empty, which means the builtin policy. Or `module.path:ClassName`
+AUTOSCALE_INTERVAL = float(env('AUTOSCALE_INTERVAL', 5))  # default 5 seconds
+AUTOSCALE_UP_BUSY_RATIO = float(env('AUTOSCALE_UP_BUSY_RATIO', 0.8))
+AUTOSCALE_DOWN_BUSY_RATIO = float(env('AUTOSCALE_DOWN_BUSY_RATIO', 0.3))
+AUTOSCALE_MAX_CPU_PERCENT = float(env('AUTOSCALE_MAX_CPU_PERCENT', 95))
+AUTOSCALE_MAX_MEMORY_PERCENT = float(env('AUTOSCALE_MAX_MEMORY_PERCENT', 90))
+AUTOSCALE_COOLDOWN = float(env('AUTOSCALE_COOLDOWN', 10))  # default 10 seconds
+AUTOSCALE_DOWN_DELAY = float(env('AUTOSCALE_DOWN_DELAY', 60))  # default 1 minute
+
+# pin every worker (and its children) to dedicated cpus for stable timing
+CPU_PINNING = int(env('CPU_PINNING', 0))  # default 0, which means disabled
+CPU_PINNING_CPUS_PER_WORKER = int(env('CPU_PINNING_CPUS_PER_WORKER', 1))
+CPU_PINNING_SKIP_SMT = int(env('CPU_PINNING_SKIP_SMT', 1))  # default 1, which means only one cpu of every physical core is used
+# cpus for the worker manager, api and redis. They are not used by workers.
+CPU_PINNING_RESERVED_CPUS = env('CPU_PINNING_RESERVED_CPUS', '0')
+
+METRICS_PORT = int(env('METRICS_PORT', 0))  # port of the metrics exporter of workers. default 0, which means disabled
 
 RUN_WORKERS = int(env('RUN_WORKERS', 0))  # default 0, which means run workers in a separate process
 
 MAX_BATCH_CHUNK_SIZE = int(env('MAX_BATCH_CHUNK_SIZE', 2))  # 0 means no limit
 MAX_LONG_BATCH_CHUNK_SIZE = int(env('MAX_LONG_BATCH_CHUNK_SIZE', 100))
+# max size of one submission in the body of streamed long batches (/run/long-batch/stream)
+STREAM_MAX_SUBMISSION_SIZE = int(env('STREAM_MAX_SUBMISSION_SIZE', 64))  # in MB
 
 PYTHON_EXECUTOR_PATH = env('PYTHON_EXECUTOR_PATH', 'python3')
 CPP_COMPILER_PATH = env('CPP_COMPILER_PATH', 'g++')
@@ -33,13 +80,58 @@ REDIS_RESULT_PREFIX = env('REDIS_RESULT_QUEUE_PREFIX', f'{REDIS_KEY_PREFIX}:{ver
 REDIS_RESULT_EXPIRE = int(env('REDIS_RESULT_EXPIRE', 60))  # default 1 minute
 REDIS_RESULT_LONG_BATCH_EXPIRE = int(env('REDIS_RESULT_LONG_BATCH_EXPIRE', LONG_BATCH_MAX_QUEUE_WAIT_TIME))  # default 1 hour
 REDIS_WORK_QUEUE_NAME = env('WORK_QUEUE_NAME', f'{REDIS_KEY_PREFIX}:{version}:work-queue')
+# split the work queues into shards with different hash slots, so they are spread over the nodes of redis cluster.
+# shard 0 is REDIS_WORK_QUEUE_NAME. Producers push to the shards in turn, workers pop from WORK_QUEUE_SHARDS_PER_WORKER shards.
+WORK_QUEUE_SHARDS = int(env('WORK_QUEUE_SHARDS', 1))  # default 1, which means not sharded
+WORK_QUEUE_SHARDS_PER_WORKER = int(env('WORK_QUEUE_SHARDS_PER_WORKER', 0))  # default 0, which means all shards
+# with more than one shard, idle workers wait on one shard at a time, and check the others every this many seconds
+WORK_QUEUE_SHARD_BLOCK_TIMEOUT = float(env('WORK_QUEUE_SHARD_BLOCK_TIMEOUT', 0.5))
+if WORK_QUEUE_SHARDS < 1:
+    raise ValueError('WORK_QUEUE_SHARDS must be at least 1')
+
+# history of observed costs, used to enqueue long batches longest-expected-first
+COST_AWARE_SCHEDULING = int(env('COST_AWARE_SCHEDULING', 1))  # default 1, which means enabled
+REDIS_COST_HISTORY_PREFIX = env('REDIS_COST_HISTORY_PREFIX', f'{REDIS_KEY_PREFIX}:{version}:cost-history:')
+REDIS_COST_HISTORY_EXPIRE = int(env('REDIS_COST_HISTORY_EXPIRE', 6*60*60))  # default 6 hours
+# the history of a language is a hash of at most this many problems, and the previous one of the same size
+COST_HISTORY_MAX_SIZE = int(env('COST_HISTORY_MAX_SIZE', 50000))
 
 REDIS_WORK_QUEUE_BLOCK_TIMEOUT = int(env('REDIS_WORK_QUEUE_BLOCK_TIMEOUT', 30))  # default 30 seconds
-REDIS_WORKER_ID_PREFIX = env('REDIS_WORKER_ID_PREFIX', f'{REDIS_KEY_PREFIX}:{version}:work-ids:')
+
+# cancellation markers of work, set by POST /cancel, or by api when the client disconnects or the batch times out
+REDIS_CANCEL_PREFIX = env('REDIS_CANCEL_PREFIX', f'{REDIS_KEY_PREFIX}:{version}:cancel:')
+REDIS_CANCEL_EXPIRE = int(env('REDIS_CANCEL_EXPIRE', LONG_BATCH_MAX_QUEUE_WAIT_TIME))  # default 1 hour
+# workers check the markers of the work being judged, and api checks client disconnection, every CANCEL_CHECK_INTERVAL seconds
+CANCEL_CHECK_INTERVAL = float(env('CANCEL_CHECK_INTERVAL', 1))
+
+# fair share between tenants (`tenant` of submissions). Work without tenant goes to REDIS_WORK_QUEUE_NAME (tenant `default`).
+# tenant keys share the hash tag of the work queue, so they are in one slot in redis cluster
+REDIS_TENANT_KEY_PREFIX = env('REDIS_TENANT_KEY_PREFIX', f'{{{REDIS_WORK_QUEUE_NAME}}}:tenant')
+TENANT_WEIGHTS = env('TENANT_WEIGHTS', '')  # like `interactive:4,rl-job:1`. tenants not listed get TENANT_DEFAULT_WEIGHT
+TENANT_DEFAULT_WEIGHT = float(env('TENANT_DEFAULT_WEIGHT', 1))
+TENANT_MAX_WORKERS = env('TENANT_MAX_WORKERS', '')  # like `rl-job:200`, max busy workers (in all nodes) of the tenant
+# idle workers look for new tenants every TENANT_REFRESH_INTERVAL seconds
+TENANT_REFRESH_INTERVAL = int(env('TENANT_REFRESH_INTERVAL', 2))  # default 2 seconds
+# tenants without new work in TENANT_EXPIRE seconds are forgotten (with their left work, which is past its deadline)
+TENANT_EXPIRE = int(env('TENANT_EXPIRE', LONG_BATCH_MAX_QUEUE_WAIT_TIME))  # default 1 hour
+# hash of worker id -> WorkerInfo json. Entries not refreshed in REDIS_WORKER_REGISTER_EXPIRE seconds are pruned on read.
+REDIS_WORKER_REGISTRY_KEY = env('REDIS_WORKER_REGISTRY_KEY', f'{REDIS_KEY_PREFIX}:{version}:workers')
 REDIS_WORKER_REGISTER_EXPIRE = int(env('REDIS_WORKER_REGISTER_TIMEOUT', 120))  # default 2 minute
 if REDIS_WORKER_REGISTER_EXPIRE < REDIS_WORK_QUEUE_BLOCK_TIMEOUT:
     raise ValueError('REDIS_WORKER_REGISTER_EXPIRE must be bigger than REDIS_WORK_QUEUE_BLOCK_TIMEOUT')
 
+# slow log: submissions with a phase (see SubmissionTiming) slower than its threshold in seconds,
+# recorded by workers (queue_wait, setup, execution_wall, execution_cpu, compare) and the api (result_pickup, total).
+# queue_wait and total are not checked for long batches, where waiting is expected.
+SLOWLOG_THRESHOLDS = env('SLOWLOG_THRESHOLDS', 'queue_wait:10,setup:10,compare:1,result_pickup:1,total:30')  # empty means disabled
+REDIS_SLOWLOG_KEY = env('REDIS_SLOWLOG_KEY', f'{REDIS_KEY_PREFIX}:{version}:slowlog')
+SLOWLOG_MAX_LEN = int(env('SLOWLOG_MAX_LEN', 1000))  # only the newest entries are kept
+
+# speed calibration: time limits are in seconds of a reference node, and workers scale them by their speed factor
+# (reference cpu time of the benchmark / their cpu time of it, see benchmarks/calibrate.py)
+SPEED_CALIBRATION_REFERENCE = float(env('SPEED_CALIBRATION_REFERENCE', 0))  # default 0, which means disabled
+SPEED_CALIBRATION_INTERVAL = int(env('SPEED_CALIBRATION_INTERVAL', 600))  # idle workers calibrate again every 10 minutes
+
 # default 15 seconds
 # additional 5 seconds for communication between judge server and judge worker
 REDIS_SOCKET_TIMEOUT = int(env('REDIS_SOCKET_TIMEOUT', 60)) # default 1 minute
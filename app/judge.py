@@ -2,16 +2,27 @@ import logging
 from time import time
 import asyncio
 import uuid
+from typing import AsyncIterator
+
+from pydantic import ValidationError
 
 import app.config as app_config
 from app.libs.redis_queue import RedisQueue
 from app.libs.utils import chunkify
+from app.libs.json_stream import iter_json_objects
+from app.scheduler import estimate_costs, longest_first
+from app.traffic_capture import capture
+from app.tenants import push_work
+from app.cancellation import cancel
+import app.slowlog as slowlog
+import app.metrics as metrics
 from app.model import (
     Submission,
     SubmissionResult,
     WorkPayload,
     BatchSubmission,
     BatchSubmissionResult,
+    BatchTiming,
     ResultReason,
 )
 
@@ -19,48 +30,126 @@ from app.model import (
 logger = logging.getLogger(__name__)
 
 
-def _to_result(submission: Submission, start_time: float, result_json: tuple[str, bytes] | None):
+def _to_result(redis_queue: RedisQueue, submission: Submission, start_time: float, result_json: tuple[str, bytes] | None):
     if result_json is None: # timeout
         return SubmissionResult(sub_id=submission.sub_id, run_success=False, success=False, cost=time() - start_time, reason=ResultReason.QUEUE_TIMEOUT)
     else:
         result = SubmissionResult.model_validate_json(result_json[1])
-        if not result.success and result.cost >= app_config.MAX_EXECUTION_TIME:
+        cost = result.normalized_cost if result.normalized_cost is not None else result.cost
+        # runtime errors have no reason. Reasons set by the worker (cancelled, skipped, deadline...) are kept
+        if not result.success and result.reason == ResultReason.UNSPECIFIED and cost >= submission.time_limit:
             result.reason = ResultReason.WORKER_TIMEOUT
+        if result.timing is not None:
+            result.timing.pickup_time = redis_queue.now()
         return result
 
 
-async def judge(redis_queue: RedisQueue, submission: Submission):
+def _observe_result(endpoint: str, submission: Submission, start_time: float, result: SubmissionResult):
+    metrics.RESULT_WAIT_TIME.labels(endpoint, submission.type).observe(time() - start_time)
+    if result.timing is not None and result.timing.result_pickup is not None:
+        metrics.RESULT_PICKUP_TIME.labels(endpoint, submission.type).observe(result.timing.result_pickup)
+    metrics.RESULTS.labels(
+        endpoint, submission.type, metrics.reason_label(result.reason), str(result.success).lower()
+    ).inc()
+
+
+async def judge(redis_queue: RedisQueue, submission: Submission, endpoint: str = '', verdict_only: bool = False):
     start_time = time()
     try:
-        payload = WorkPayload(submission=submission)
+        # timestamps in payloads use the redis clock, so that workers on other hosts can compare them
+        enqueue_time = redis_queue.now()
+        work_id = str(uuid.uuid4())
+        payload = WorkPayload(
+            work_id=work_id, submission=submission, timestamp=enqueue_time,
+            deadline=enqueue_time + app_config.MAX_QUEUE_WAIT_TIME, verdict_only=verdict_only,
+            cancel_ids=[work_id, submission.sub_id], request_time=enqueue_time,
+        )
         payload_json = payload.model_dump_json()
-        await redis_queue.push(app_config.REDIS_WORK_QUEUE_NAME, payload_json)
+        with metrics.REDIS_TIME.labels('push_work').time():
+            await push_work(redis_queue, submission.tenant, payload_json)
         result_queue_name = f'{app_config.REDIS_RESULT_PREFIX}{payload.work_id}'
-        result_json = await redis_queue.block_pop(result_queue_name, timeout=app_config.MAX_QUEUE_WAIT_TIME)
-        await redis_queue.delete(result_queue_name)
-        return _to_result(submission, start_time, result_json)
+        try:
+            result_json = await redis_queue.block_pop(result_queue_name, timeout=app_config.MAX_QUEUE_WAIT_TIME)
+        except asyncio.CancelledError:
+            # the client is gone
+            await cancel(redis_queue, work_id)
+            raise
+        if result_json is None:
+            await cancel(redis_queue, work_id)
+        with metrics.REDIS_TIME.labels('delete_results').time():
+            await redis_queue.delete(result_queue_name)
+        result = _to_result(redis_queue, submission, start_time, result_json)
+        slowlog.record(redis_queue, work_id, submission, result)
     except Exception:
         logger.exception(f'Failed to judge submission {submission.sub_id}')
-        return SubmissionResult(sub_id=submission.sub_id, run_success=False, success=False, cost=time() - start_time, reason=ResultReason.INTERNAL_ERROR)
+        result = SubmissionResult(sub_id=submission.sub_id, run_success=False, success=False, cost=time() - start_time, reason=ResultReason.INTERNAL_ERROR)
+    _observe_result(endpoint, submission, start_time, result)
+    metrics.REQUEST_TIME.labels(endpoint).observe(time() - start_time)
+    capture(endpoint, start_time, submission, [result], time() - start_time)
+    return result
+
 
+def _strip_payload(payload: WorkPayload) -> WorkPayload:
+    """The payload without the big fields of its submission, which are not needed once it is enqueued"""
+    return payload.model_copy(update={'submission': payload.submission.model_copy(
+        update={'solution': '', 'input': None, 'expected_output': None, 'test_cases': None}
+    )})
 
-async def _judge_batch_impl(redis_queue: RedisQueue, subs: list[Submission], long_batch=False):
+
+async def _judge_batch_impl(
+    redis_queue: RedisQueue, subs: list[Submission] | AsyncIterator[list[Submission]], long_batch=False,
+    endpoint: str = '', verdict_only: bool = False, batch_sub_id: str | None = None, kill_failed_groups: bool = False,
+):
+    """
+    subs can also be chunks of submissions which are still arriving (see `judge_batch_stream`).
+    Every chunk is enqueued when it arrives, and only what is needed to wait for the results is kept from it.
+    """
     start_time = time()
     max_wait_time = app_config.LONG_BATCH_MAX_QUEUE_WAIT_TIME \
         if long_batch else app_config.MAX_QUEUE_WAIT_TIME
     batch_chunk_size = app_config.MAX_LONG_BATCH_CHUNK_SIZE \
         if long_batch else app_config.MAX_BATCH_CHUNK_SIZE
     # use a hash tag to make sure all payloads are in the same slot in redis cluster
-    hash_tag = '{' + str(uuid.uuid4()) + '}'
-    payloads = [WorkPayload(work_id=f'{hash_tag}:{idx}', submission=sub, long_running=long_batch) for idx, sub in enumerate(subs)]
-    payload_chunks = list(chunkify(payloads, batch_chunk_size))
+    batch_id = str(uuid.uuid4())
+    hash_tag = '{' + batch_id + '}'
+    enqueue_time = request_time = redis_queue.now()
+    deadline = enqueue_time + max_wait_time
+
+    def _make_payloads(subs: list[Submission], start_idx: int, enqueue_time: float) -> list[WorkPayload]:
+        return [
+            WorkPayload(
+                work_id=f'{hash_tag}:{idx}', submission=sub, timestamp=enqueue_time, long_running=long_batch, deadline=deadline,
+                verdict_only=verdict_only, cancel_ids=[batch_id, *filter(None, [batch_sub_id]), sub.sub_id],
+                request_time=request_time,
+                group_id=f'{batch_id}:{sub.group}' if sub.group is not None else None,
+                kill_on_group_failure=kill_failed_groups,
+            )
+            for idx, sub in enumerate(subs, start_idx)
+        ]
+
+    # work id -> the work queue (tenant and shard) it is pushed to
+    payload_queue_names: dict[str, str] = {}
 
     async def _submit(payloads: list[WorkPayload]):
-        payload_jsons = [payload.model_dump_json() for payload in payloads]
-        await redis_queue.push(app_config.REDIS_WORK_QUEUE_NAME, *payload_jsons)
+        tenant_payloads = {}
+        for payload in payloads:
+            tenant_payloads.setdefault(payload.submission.tenant, []).append(payload)
+        with metrics.REDIS_TIME.labels('push_work').time():
+            for tenant, tenant_chunk in tenant_payloads.items():
+                queue_name = await push_work(redis_queue, tenant, *[payload.model_dump_json() for payload in tenant_chunk])
+                payload_queue_names.update((payload.work_id, queue_name) for payload in tenant_chunk)
+
+    async def _is_started(payloads: list[WorkPayload], max_timestamp: float) -> bool:
+        """whether workers have taken all work items enqueued before max_timestamp"""
+        for queue_name in {payload_queue_names[payload.work_id] for payload in payloads}:
+            next_payload_json = await redis_queue.peak(queue_name)
+            if next_payload_json and WorkPayload.model_validate_json(next_payload_json).timestamp <= max_timestamp:
+                return False
+        return True
 
     async def _sync_pop(queue_names: list[str]):
-        step_results = await redis_queue.pop_multi(*queue_names)
+        with metrics.REDIS_TIME.labels('pop_results').time():
+            step_results = await redis_queue.pop_multi(*queue_names)
         name_results = [(k, v) for k, v in zip(queue_names, step_results) if v is not None]
         return name_results
 
@@ -96,13 +185,8 @@ async def _judge_batch_impl(redis_queue: RedisQueue, subs: list[Submission], lon
             name_results = await _pop_results(left_result_queue_names, left_time)
             if not name_results: # if no result, check if timeout
                 if start_working_time == 0:
-                    next_payload_json = await redis_queue.peak(app_config.REDIS_WORK_QUEUE_NAME)
-                    if not next_payload_json:
+                    if await _is_started(payloads, max_timestamp):
                         start_working_time = time()
-                    else:
-                        next_payload = WorkPayload.model_validate_json(next_payload_json)
-                        if next_payload.timestamp > max_timestamp:
-                            start_working_time = time()
                 else:
                     if time() - start_working_time > app_config.MAX_QUEUE_WAIT_TIME:
                         logger.warning(f'No result for {len(left_result_queue_names)} submissions. '
@@ -115,7 +199,9 @@ async def _judge_batch_impl(redis_queue: RedisQueue, subs: list[Submission], lon
             for name_result in name_results:
                 result_queue_name, _ = name_result
                 payload = result_queue_names[result_queue_name]
-                results[result_queue_name] = _to_result(payload.submission, start_time, name_result)
+                results[result_queue_name] = _to_result(redis_queue, payload.submission, start_time, name_result)
+                _observe_result(endpoint, payload.submission, start_time, results[result_queue_name])
+                slowlog.record(redis_queue, payload.work_id, payload.submission, results[result_queue_name], long_batch)
                 left_result_queue_names.remove(result_queue_name)
 
             left_time = max_chunk_wait_time - int(time() - result_start_time)
@@ -124,28 +210,69 @@ async def _judge_batch_impl(redis_queue: RedisQueue, subs: list[Submission], lon
 
         # fill non-ready work as timeout
         for result_queue_name in left_result_queue_names:
-            results[result_queue_name] = _to_result(result_queue_names[result_queue_name].submission, start_time, None)
+            submission = result_queue_names[result_queue_name].submission
+            results[result_queue_name] = _to_result(redis_queue, submission, start_time, None)
+            _observe_result(endpoint, submission, start_time, results[result_queue_name])
 
-        await redis_queue.delete(*result_queue_names)
+        with metrics.REDIS_TIME.labels('delete_results').time():
+            await redis_queue.delete(*result_queue_names)
         return [results[result_queue_name] for result_queue_name in result_queue_names]
 
-    # submit all submissions to the queue
-    for chunk in payload_chunks:
-        await _submit(chunk)
+    wait_start_time = time()
+    if isinstance(subs, list):
+        payloads = _make_payloads(subs, 0, enqueue_time)
+        order = list(range(len(payloads)))
+        if long_batch and app_config.COST_AWARE_SCHEDULING and len(payloads) > 1:
+            # enqueue the most expensive submissions first to minimize the makespan
+            order = longest_first(await estimate_costs(redis_queue, subs))
+        payload_chunks = [[payloads[i] for i in chunk] for chunk in chunkify(order, batch_chunk_size)]
+        # submit all submissions to the queue
+        for chunk in payload_chunks:
+            await _submit(chunk)
+    else:
+        order = []
+        payload_chunks = []
+        try:
+            async for chunk_subs in subs:
+                chunk = _make_payloads(chunk_subs, len(order), redis_queue.now())
+                await _submit(chunk)
+                order.extend(range(len(order), len(order) + len(chunk)))
+                payload_chunks.append([_strip_payload(payload) for payload in chunk])
+        except BaseException:
+            # the left submissions can't be read (invalid or the client is gone)
+            await cancel(redis_queue, batch_id)
+            raise
 
     results = []
-    wait_start_time = time()
-    for chunk in payload_chunks:
-        # get all results from the queue
-        left_time = max_wait_time - int(time() - wait_start_time)
-        chunk_results = await _get_result(chunk, left_time)
-        results.extend(chunk_results)
-    return results
+    try:
+        for chunk in payload_chunks:
+            # get all results from the queue
+            left_time = max_wait_time - int(time() - wait_start_time)
+            chunk_results = await _get_result(chunk, left_time)
+            results.extend(chunk_results)
+    except asyncio.CancelledError:
+        # the client is gone
+        await cancel(redis_queue, batch_id)
+        raise
+    if any(result.reason == ResultReason.QUEUE_TIMEOUT for result in results):
+        # nobody will read the results of the left work
+        await cancel(redis_queue, batch_id)
+    # restore the request order
+    ordered_results = [None] * len(results)
+    for idx, result in zip(order, results):
+        ordered_results[idx] = result
+    return ordered_results
 
 
-async def judge_batch(redis_queue: RedisQueue, batch_sub: BatchSubmission, long_batch=False):
+async def judge_batch(
+    redis_queue: RedisQueue, batch_sub: BatchSubmission, long_batch=False, endpoint: str = '', verdict_only: bool = False
+):
+    start_time = time()
     try:
-        results = await _judge_batch_impl(redis_queue, batch_sub.submissions, long_batch)
+        results = await _judge_batch_impl(
+            redis_queue, batch_sub.submissions, long_batch, endpoint, verdict_only, batch_sub.sub_id,
+            batch_sub.kill_failed_groups,
+        )
     except Exception:
         logger.exception(f'Failed to judge batch submission {batch_sub.sub_id}')
         results=[
@@ -157,7 +284,66 @@ async def judge_batch(redis_queue: RedisQueue, batch_sub: BatchSubmission, long_
                 reason=ResultReason.INTERNAL_ERROR
             ) for sub in batch_sub.submissions
         ]
+        for sub, result in zip(batch_sub.submissions, results):
+            _observe_result(endpoint, sub, start_time, result)
+    metrics.REQUEST_TIME.labels(endpoint).observe(time() - start_time)
+    capture(endpoint, start_time, batch_sub, results, time() - start_time)
     return BatchSubmissionResult(
         sub_id=batch_sub.sub_id,
-        results=results
+        results=results,
+        timing=BatchTiming.from_results(results),
+    )
+
+
+class InvalidBatchError(ValueError):
+    """status_code: 400 if the body is not a json array or ndjson of objects, 422 if a submission is invalid"""
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def _submission_chunks(
+    body: AsyncIterator[bytes], chunk_size: int, tenant: str | None
+) -> AsyncIterator[list[Submission]]:
+    """Submissions parsed from the body (json array or ndjson), at most chunk_size at a time"""
+    count = 0
+    try:
+        async for objects in iter_json_objects(body, app_config.STREAM_MAX_SUBMISSION_SIZE * 1024 * 1024):
+            for start in range(0, len(objects), chunk_size):
+                subs = []
+                for obj in objects[start:start + chunk_size]:
+                    sub = Submission.model_validate(obj)
+                    sub.tenant = sub.tenant or tenant
+                    subs.append(sub)
+                    count += 1
+                yield subs
+    except ValidationError as e:
+        raise InvalidBatchError(f'Invalid submission {count}: {e}') from None
+    except ValueError as e:
+        raise InvalidBatchError(str(e), 400) from None
+    if count == 0:
+        raise InvalidBatchError('No submissions')
+
+
+async def judge_batch_stream(
+    redis_queue: RedisQueue, body: AsyncIterator[bytes], sub_id: str | None = None, tenant: str | None = None,
+    kill_failed_groups: bool = False, endpoint: str = '', verdict_only: bool = False,
+):
+    """
+    Long batch with the submissions read from the body (a json array or ndjson of submissions) while it arrives,
+    so the first chunks are judged before the upload is finished, and the whole batch is never in memory.
+    InvalidBatchError is raised if the body is invalid (the submissions already enqueued are cancelled).
+    Streamed batches are not captured (see traffic_capture).
+    """
+    start_time = time()
+    sub_id = sub_id or str(uuid.uuid4())
+    results = await _judge_batch_impl(
+        redis_queue, _submission_chunks(body, app_config.MAX_LONG_BATCH_CHUNK_SIZE, tenant), True,
+        endpoint, verdict_only, sub_id, kill_failed_groups,
+    )
+    metrics.REQUEST_TIME.labels(endpoint).observe(time() - start_time)
+    return BatchSubmissionResult(
+        sub_id=sub_id,
+        results=results,
+        timing=BatchTiming.from_results(results),
     )
@@ -0,0 +1,87 @@
+import codecs
+
+
+# Comparison modes of the output with the expected output (option `compare` of a submission).
+# Without it, both are compared as python values (see `compare_output` in worker_manager).
+#   exact: the same text, ignoring trailing whitespace of lines and leading/trailing blank lines
+#   tokens: the same whitespace separated tokens
+COMPARE_MODES = ('exact', 'tokens')
+
+
+def _lines(output: str) -> list[str]:
+    output = output.strip()
+    return [line.rstrip() for line in output.splitlines()] if output else []
+
+
+def compare_text(actual: str, expected: str, mode: str) -> bool:
+    if mode == 'exact':
+        return _lines(actual) == _lines(expected)
+    if mode == 'tokens':
+        return actual.split() == expected.split()
+    raise ValueError(f'Unknown compare mode {mode}')
+
+
+class StreamingComparator:
+    """
+    Compare stdout with the expected output (`compare_text`) while the program is still running.
+    `feed` is called with every chunk of stdout, and returns False at the first definitive mismatch,
+    so the program can be killed without waiting for it to finish.
+    Only complete lines (exact) or tokens (tokens) are compared, the incomplete rest is kept for the next chunk.
+    Everything from `end_mark` on (written by the executor after the output of the program) is ignored.
+    A mismatch is never reported for output that `compare_text` would accept.
+    """
+    def __init__(self, expected: str, mode: str, end_mark: str | None = None):
+        if mode not in COMPARE_MODES:
+            raise ValueError(f'Unknown compare mode {mode}')
+        self.mode = mode
+        self.expected = _lines(expected) if mode == 'exact' else expected.split()
+        self.end_mark = end_mark
+        self.ended = False
+        self.matched = 0          # expected lines/tokens matched so far
+        self.started = False      # exact: a non-blank line is seen (leading blank lines are ignored)
+        self.pending_blanks = 0   # exact: blank lines after the last non-blank one
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._rest = ''
+
+    def feed(self, data: bytes) -> bool:
+        if self.ended:
+            return True
+        text = self._rest + self._decoder.decode(data)
+        if self.end_mark is not None and (pos := text.find(self.end_mark)) >= 0:
+            # the end mark has no whitespace, so it is never split between the compared part and the rest
+            text = text[:pos]
+            self.ended = True
+        if self.mode == 'exact':
+            end = len(text) if self.ended else text.rfind('\n') + 1
+            self._rest = text[end:]
+            return all(map(self._feed_line, text[:end].splitlines()))
+        end = len(text)
+        if not self.ended:
+            while end > 0 and not text[end - 1].isspace():
+                end -= 1
+        self._rest = text[end:]
+        return all(map(self._feed_token, text[:end].split()))
+
+    def _feed_line(self, line: str) -> bool:
+        line = line.rstrip()
+        if not self.started:
+            if not line.strip():
+                return True
+            line = line.lstrip()
+            self.started = True
+        if not line:
+            self.pending_blanks += 1
+            return True
+        # blank lines before a non-blank one must be in the expected output too
+        expected = self.expected[self.matched:self.matched + self.pending_blanks + 1]
+        if expected != [''] * self.pending_blanks + [line]:
+            return False
+        self.matched += self.pending_blanks + 1
+        self.pending_blanks = 0
+        return True
+
+    def _feed_token(self, token: str) -> bool:
+        if self.matched >= len(self.expected) or self.expected[self.matched] != token:
+            return False
+        self.matched += 1
+        return True
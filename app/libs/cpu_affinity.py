@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+
+
+def parse_cpu_list(cpu_list: str) -> list[int]:
+    """Parse cpu list like `0-3,8,10-11`"""
+    cpus = []
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def cpu_siblings(cpu: int) -> list[int]:
+    """SMT siblings of the cpu (including itself)"""
+    path = Path(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list')
+    try:
+        return parse_cpu_list(path.read_text())
+    except OSError:
+        return [cpu]
+
+
+def plan_cpu_sets(cpus_per_worker: int, reserved_cpus: list[int], skip_smt: bool) -> list[set[int]]:
+    """
+    Split the cpus this process is allowed to use into disjoint sets for workers.
+    Reserved cpus are left to others (for example the worker manager, the api and redis).
+    If skip_smt is True, only one cpu of every physical core is used,
+    and the cores of the reserved cpus are not used at all.
+    Otherwise SMT siblings are kept in the same set when possible.
+    """
+    reserved = set(reserved_cpus)
+    if skip_smt:
+        reserved = {sibling for cpu in reserved for sibling in cpu_siblings(cpu)}
+
+    cores: dict[int, list[int]] = {}  # the first sibling -> available cpus of the core
+    for cpu in sorted(os.sched_getaffinity(0)):
+        if cpu in reserved:
+            continue
+        cores.setdefault(min(cpu_siblings(cpu)), []).append(cpu)
+
+    if skip_smt:
+        cpus = [core_cpus[0] for core_cpus in cores.values()]
+    else:
+        cpus = [cpu for core_cpus in cores.values() for cpu in core_cpus]
+    return [
+        set(cpus[i:i + cpus_per_worker])
+        for i in range(0, len(cpus) - cpus_per_worker + 1, cpus_per_worker)
+    ]
@@ -1,11 +1,13 @@
 from contextlib import contextmanager
 import tempfile
+import time
 from typing import Any, Generator
 from app.libs.executors.executor import COMPILE_ERROR_EXIT_CODE, ProcessExecuteResult, ScriptExecutor, CompileError
 
 
 RESOURCE_LIMIT_TEMPLATE = """
 #include <sys/resource.h>
+#include <sys/time.h>
 #include <stdio.h>
 #include <unistd.h>
 #include <signal.h>
@@ -17,11 +19,12 @@ static void handler(int sig) {{
 
 class ResourceLimit {{
 public:
-    ResourceLimit(int timeout, int memory_limit) {{
+    ResourceLimit(double timeout, long memory_limit, long max_processes, int line_buffered) {{
         struct rlimit rlim;
         if (timeout > 0) {{
             getrlimit(RLIMIT_CPU, &rlim);
-            rlim.rlim_cur = timeout;
+            rlim.rlim_cur = (rlim_t)timeout;
+            if (rlim.rlim_cur < timeout) rlim.rlim_cur++;
             setrlimit(RLIMIT_CPU, &rlim);
         }}
         if (memory_limit > 0) {{
@@ -29,24 +32,48 @@ public:
             rlim.rlim_cur = memory_limit;
             setrlimit(RLIMIT_AS, &rlim);
         }}
+        if (max_processes > 0) {{
+            getrlimit(RLIMIT_NPROC, &rlim);
+            if (rlim.rlim_max == RLIM_INFINITY || (rlim_t)max_processes < rlim.rlim_max) rlim.rlim_cur = max_processes;
+            setrlimit(RLIMIT_NPROC, &rlim);
+        }}
         getrlimit(RLIMIT_CORE, &rlim);
         rlim.rlim_cur = 0;
         setrlimit(RLIMIT_CORE, &rlim);
+        if (line_buffered) {{
+            setvbuf(stdout, NULL, _IOLBF, 0);
+        }}
 
-        alarm(timeout);
         signal(SIGALRM, handler);
+        if (timeout > 0) {{
+            struct itimerval timer = {{}};
+            timer.it_value.tv_sec = (long)timeout;
+            timer.it_value.tv_usec = (long)((timeout - (long)timeout) * 1000000);
+            setitimer(ITIMER_REAL, &timer, NULL);
+        }}
     }}
 }};
 
-ResourceLimit resource_limit = ResourceLimit({timeout}, {memory_limit});
+ResourceLimit resource_limit = ResourceLimit({timeout}, {memory_limit}, {max_processes}, {line_buffered});
 """.strip()
 
 
 class CppExecutor(ScriptExecutor):
-    def __init__(self, compiler_path: str, timeout: int = None, memory_limit: int = None):
+    def __init__(
+        self, compiler_path: str, timeout: float = None, memory_limit: int = None, compile_timeout: float = None,
+        max_processes: int = None, max_output_size: int = None, spawn_method: str = 'subprocess',
+        line_buffered: bool = False,
+    ):
+        """line_buffered: flush stdio stdout at every line, for comparing it while the program runs"""
         self.compiler_path = compiler_path
         self.timeout = timeout
         self.memory_limit = memory_limit
+        # compiling doesn't count against the time limit of the submission
+        self.compile_timeout = compile_timeout or timeout
+        self.max_processes = max_processes
+        self.max_output_size = max_output_size
+        self.spawn_method = spawn_method
+        self.line_buffered = line_buffered
 
     @contextmanager
     def setup_command(self, script: str) -> Generator[list[str], Any, None]:
@@ -57,21 +84,27 @@ class CppExecutor(ScriptExecutor):
             with open(resource_limit_path, "w") as f:
                 f.write(RESOURCE_LIMIT_TEMPLATE.format(
                     timeout=self.timeout or 0,
-                    memory_limit=self.memory_limit or 0)
+                    memory_limit=self.memory_limit or 0,
+                    max_processes=self.max_processes or 0,
+                    line_buffered=int(self.line_buffered))
                 )
             with open(source_path, "w") as f:
                 f.write('#include "resource_limit.h"\n')
                 f.write(script)
             result = self.execute(
                 {'args': [self.compiler_path,  "-O2", source_path,  "-o", exec_path]},
-                timeout=self.timeout or None
+                timeout=self.compile_timeout or None
             )
             if not result.success:
                 raise CompileError(result.stderr)
             yield [exec_path]
 
-    def execute_script(self, script, stdin=None, timeout=None):
+    def execute_script(self, script, stdin=None, timeout=None, discard_stderr=False, stdout_checker=None):
+        setup_start = time.perf_counter()
         try:
-            return super().execute_script(script, stdin, timeout)
+            return super().execute_script(script, stdin, timeout, discard_stderr, stdout_checker)
         except CompileError as e:
-            return ProcessExecuteResult(stdout='', stderr=str(e), exit_code=COMPILE_ERROR_EXIT_CODE, cost=0)
+            return ProcessExecuteResult(
+                stdout='', stderr=str(e), exit_code=COMPILE_ERROR_EXIT_CODE, cost=0,
+                setup_cost=time.perf_counter() - setup_start
+            )
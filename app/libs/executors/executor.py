@@ -1,8 +1,16 @@
+import ctypes
+import os
+import select
+import selectors
+import signal
 import subprocess
 from dataclasses import dataclass, field
+import resource
 import time
 from contextlib import contextmanager
-from typing import Any, Generator, Protocol
+from typing import Any, Callable, Generator, Protocol
+
+import psutil
 
 
 class ExecuteResult(Protocol):
@@ -21,6 +29,10 @@ class ProcessExecuteResult:
     stderr: str
     exit_code: int
     cost: float # in seconds
+    setup_cost: float = 0 # in seconds, time to prepare the command (compiling for cpp)
+    wall_cost: float = 0 # in seconds, wall time of the process
+    cpu_cost: float = 0 # in seconds, user + system cpu time of the process
+    test_results: list[dict] | None = None # function-call mode of python, see PythonFunctionExecutor
     success: bool = field(init=False)
 
     def __post_init__(self):
@@ -33,34 +45,271 @@ class CompileError(Exception):
 
 TIMEOUT_EXIT_CODE = -101
 COMPILE_ERROR_EXIT_CODE = -102
+OUTPUT_LIMIT_EXIT_CODE = -103
+MISMATCH_EXIT_CODE = -104  # killed when stdout can't match the expected output any more
+
+PR_SET_CHILD_SUBREAPER = 36
+_is_subreaper = False
+
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def become_subreaper() -> bool:
+    """
+    Make the current process the reaper of its orphaned descendants (Linux only),
+    so the processes a submission leaves behind (even out of its process group) can be found by `kill_stragglers`.
+    """
+    global _is_subreaper
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        _is_subreaper = libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        _is_subreaper = False
+    return _is_subreaper
+
+
+def kill_stragglers(timeout: float = 1) -> int:
+    """
+    Kill and reap all child processes. Only for subreapers (see `become_subreaper`) with no other children.
+    Returns the number of killed processes.
+    """
+    if not _is_subreaper:
+        return 0
+    killed = 0
+    for child in psutil.Process().children():
+        try:
+            child.kill()
+            killed += 1
+        except psutil.NoSuchProcess:
+            pass
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:  # no children left
+            break
+        if pid == 0:
+            if not killed or time.perf_counter() >= deadline:
+                break
+            # killed ones are not dead yet
+            time.sleep(0.001)
+    return killed
+
+
+def _has_exited(process: 'subprocess.Popen | SpawnedProcess') -> bool:
+    # without reaping, so its process group can't be reused before it is killed
+    return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+
+
+def _communicate(
+    process: 'subprocess.Popen | SpawnedProcess', std_input: bytes | None, deadline: float | None, max_output_size: int | None,
+    stdout_checker: Callable[[bytes], bool] | None = None,
+) -> tuple[bytes, bytes, int | None]:
+    """
+    Like Popen.communicate, but stops
+    - at the deadline (perf_counter) or when stdout + stderr are bigger than max_output_size, or
+    - when stdout_checker (called with every chunk of stdout) returns False, or
+    - when the process exits, even if its pipes are still open (for example inherited by a process it leaves behind).
+    Returns stdout, stderr and TIMEOUT_EXIT_CODE/OUTPUT_LIMIT_EXIT_CODE/MISMATCH_EXIT_CODE (or None if the process exited).
+    """
+    outputs = {f: bytearray() for f in (process.stdout, process.stderr) if f is not None}
+    input_view = memoryview(std_input or b'')
+    input_offset = 0
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):  # before Linux 5.3, poll the process instead
+        pidfd = None
+
+    def _result(exit_code: int | None):
+        return bytes(outputs.get(process.stdout, b'')), bytes(outputs.get(process.stderr, b'')), exit_code
+
+    def _read(f) -> bool:
+        """Returns False at EOF"""
+        nonlocal output_size, mismatched
+        data = os.read(f.fileno(), 32768)
+        if not data:
+            return False
+        outputs[f] += data
+        output_size += len(data)
+        if f is process.stdout and stdout_checker is not None and not mismatched:
+            mismatched = not stdout_checker(data)
+        return True
+
+    def _stop_code() -> int | None:
+        if max_output_size and output_size > max_output_size:
+            return OUTPUT_LIMIT_EXIT_CODE
+        if mismatched:
+            return MISMATCH_EXIT_CODE
+        return None
+
+    output_size = 0
+    mismatched = False
+    with selectors.DefaultSelector() as selector:
+        if process.stdin is not None:
+            selector.register(process.stdin, selectors.EVENT_WRITE)
+        for f in outputs:
+            selector.register(f, selectors.EVENT_READ)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+        try:
+            exited = False
+            while not exited:
+                timeout = None if deadline is None else deadline - time.perf_counter()
+                if timeout is not None and timeout <= 0:
+                    return _result(TIMEOUT_EXIT_CODE)
+                if pidfd is None:
+                    timeout = 0.01 if timeout is None else min(timeout, 0.01)
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is pidfd:
+                        exited = True
+                    elif key.fileobj is process.stdin:
+                        try:
+                            input_offset += os.write(key.fd, input_view[input_offset:input_offset + select.PIPE_BUF])
+                        except BrokenPipeError:
+                            input_offset = len(input_view)
+                        if input_offset >= len(input_view):
+                            selector.unregister(key.fileobj)
+                            key.fileobj.close()
+                    elif not _read(key.fileobj):
+                        selector.unregister(key.fileobj)
+                    if (stop_code := _stop_code()) is not None:
+                        return _result(stop_code)
+                if pidfd is None:
+                    exited = _has_exited(process)
+                elif not exited and len(selector.get_map()) == 1:
+                    # only the pidfd is left, all pipes are closed
+                    exited = _has_exited(process)
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+        # the output written before the exit, without waiting for the processes which still hold the pipes
+        for key in list(selector.get_map().values()):
+            if key.fileobj in outputs:
+                os.set_blocking(key.fd, False)
+                try:
+                    while _read(key.fileobj):
+                        if max_output_size and output_size > max_output_size:
+                            return _result(OUTPUT_LIMIT_EXIT_CODE)
+                except BlockingIOError:
+                    pass
+    return _result(None)
+
+
+def _kill_process_group(process: 'subprocess.Popen | SpawnedProcess'):
+    """Kill the process and all its descendants in its process group, and reap the process"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    for f in (process.stdin, process.stdout, process.stderr):
+        if f is not None and not f.closed:
+            f.close()
+    process.wait()
+
+
+class SpawnedProcess:
+    """
+    A process started by os.posix_spawn, with the part of the Popen interface used by `ProcessExecutor`.
+    posix_spawn doesn't copy the page tables of the (big) worker like fork does,
+    and sets up the pipes and the session in the child without running python code.
+    """
+    def __init__(self, args: list[str], pipe_stdin: bool, discard_stderr: bool):
+        self.args = args
+        self.returncode = None
+        self.stdin = self.stdout = self.stderr = None
+        file_actions = []
+        child_fds = []
+
+        def _pipe(child_fd: int, mode: str):
+            read_fd, write_fd = os.pipe()  # not inheritable, so closed in the child after dup2
+            parent_fd, child_end = (write_fd, read_fd) if mode == 'wb' else (read_fd, write_fd)
+            file_actions.append((os.POSIX_SPAWN_DUP2, child_end, child_fd))
+            child_fds.append(child_end)
+            return open(parent_fd, mode, buffering=0)
+
+        try:
+            if pipe_stdin:
+                self.stdin = _pipe(0, 'wb')
+            else:
+                file_actions.append((os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0))
+            self.stdout = _pipe(1, 'rb')
+            if discard_stderr:
+                file_actions.append((os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0))
+            else:
+                self.stderr = _pipe(2, 'rb')
+            # setsid: its own session (and process group), like Popen(start_new_session=True)
+            self.pid = os.posix_spawnp(args[0], args, os.environ, file_actions=file_actions, setsid=True)
+        except BaseException:
+            for f in (self.stdin, self.stdout, self.stderr):
+                if f is not None:
+                    f.close()
+            raise
+        finally:
+            for fd in child_fds:
+                os.close(fd)
+
+    def wait(self) -> int:
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
 
 
 class ProcessExecutor:
+    max_output_size: int | None = None  # bytes of stdout + stderr, None means no limit
+    # 'subprocess' (Popen, which uses vfork when it can) or 'posix_spawn' (see `SpawnedProcess`)
+    spawn_method: str = 'subprocess'
+
+    def _spawn(self, args: list[str], pipe_stdin: bool, discard_stderr: bool) -> subprocess.Popen | SpawnedProcess:
+        if self.spawn_method == 'posix_spawn':
+            return SpawnedProcess(args, pipe_stdin, discard_stderr)
+        # in its own session (and process group), so that everything it starts is killed with it
+        return subprocess.Popen(
+            args, shell=False, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL if discard_stderr else subprocess.PIPE,
+            stdin=subprocess.PIPE if pipe_stdin else subprocess.DEVNULL, start_new_session=True,
+        )
+
     def execute(self, config: dict[str, Any], stdin: str | None = None, timeout: float | None = None) -> ProcessExecuteResult:
+        cpu_start = _children_cpu_time()
         time_start = time.perf_counter()
+        args = config['args']
+        std_input = stdin.encode() if stdin else None
+        # nobody reads stderr when only the verdict is needed, so don't pipe it at all
+        process = self._spawn(args, pipe_stdin=std_input is not None, discard_stderr=bool(config.get('discard_stderr')))
         try:
-            args = config['args']
-            std_input = stdin.encode() if stdin else None
-            result = subprocess.run(args, shell=False, check=False, capture_output=True, timeout=timeout, input=std_input)
-            stdout = result.stdout.decode()
-            stderr = result.stderr.decode()
-            exit_code = result.returncode
-        except subprocess.TimeoutExpired as e:
-            stdout = e.stdout.decode()
-            stderr = e.stderr.decode()
-            exit_code = TIMEOUT_EXIT_CODE
+            stdout, stderr, exit_code = _communicate(
+                process, std_input, time_start + timeout if timeout else None, config.get('max_output_size', self.max_output_size),
+                config.get('stdout_checker'),
+            )
+        finally:
+            _kill_process_group(process)
+        if exit_code is None:
+            exit_code = process.returncode
+        elif exit_code == OUTPUT_LIMIT_EXIT_CODE:
+            stderr += b'\nOutput limit exceeded'
+        elif exit_code == MISMATCH_EXIT_CODE:
+            stderr += b'\nKilled at the first mismatch with the expected output'
 
         time_end = time.perf_counter()
 
         return ProcessExecuteResult(
-            stdout=stdout,
-            stderr=stderr,
+            stdout=stdout.decode(errors='replace'),
+            stderr=stderr.decode(errors='replace'),
             exit_code=exit_code,
-            cost=time_end - time_start
+            cost=time_end - time_start,
+            wall_cost=time_end - time_start,
+            cpu_cost=_children_cpu_time() - cpu_start,
         )
 
 
 class ScriptExecutor(ProcessExecutor):
+    # written to stdout after the output of the script (see `StreamingComparator`)
+    stdout_end_mark: str | None = None
+
     @contextmanager
     def setup_command(self, script: str) -> Generator[list[str], Any, None]:
         """
@@ -71,6 +320,17 @@ class ScriptExecutor(ProcessExecutor):
     def process_result(self, result: ProcessExecuteResult) -> ProcessExecuteResult:
         return result
 
-    def execute_script(self, script: str, stdin: str | None = None, timeout: float | None = None) -> ProcessExecuteResult:
+    def execute_script(
+        self, script: str, stdin: str | None = None, timeout: float | None = None, discard_stderr: bool = False,
+        stdout_checker: Callable[[bytes], bool] | None = None,
+    ) -> ProcessExecuteResult:
+        """stdout_checker: called with every chunk of stdout, the script is killed when it returns False"""
+        setup_start = time.perf_counter()
         with self.setup_command(script) as command:
-            return self.process_result(self.execute({'args': command}, stdin=stdin, timeout=timeout))
+            setup_cost = time.perf_counter() - setup_start
+            result = self.process_result(self.execute(
+                {'args': command, 'discard_stderr': discard_stderr, 'stdout_checker': stdout_checker},
+                stdin=stdin, timeout=timeout
+            ))
+            result.setup_cost = setup_cost
+            return result
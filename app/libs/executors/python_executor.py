@@ -1,4 +1,6 @@
 from contextlib import contextmanager
+import json
+import re
 import tempfile
 import io
 
@@ -7,13 +9,18 @@ from .executor import ScriptExecutor, ProcessExecuteResult, TIMEOUT_EXIT_CODE
 
 SCRIPT_ENDING_MARK = "@@E"
 DURATION_MARK = "@@D"
+TEST_RESULT_MARK = "@@T"
+# a result line, with the newline written before it (the output of the function may not end with one)
+_TEST_RESULT_PATTERN = re.compile('\n' + re.escape(TEST_RESULT_MARK) + '(.*)\n?')
 
 
 PRE_TEMPLATE = f"""
 import signal
 import resource
 import os
+import sys
 import time
+import math
 
 # preventing multi-threading for numpy
 os.environ['OPENBLAS_NUM_THREADS'] = '1'
@@ -21,7 +28,7 @@ os.environ['OPENBLAS_NUM_THREADS'] = '1'
 
 def _exec_set_alarm_timeout(timeout):
     signal.signal(signal.SIGALRM, _exec_time_exceeded)
-    signal.alarm(timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
 
 
 # checking time limit exceed
@@ -33,7 +40,7 @@ def _exec_time_exceeded(*_):
 def _exec_set_max_runtime(seconds):
     # setting up the resource limit
     soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
-    resource.setrlimit(resource.RLIMIT_CPU, (seconds, hard))
+    resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(seconds), hard))
     # Just use its default behavior to terminate the process.
     # signal.signal(signal.SIGXCPU, _exec_time_exceeded)
 
@@ -43,6 +50,11 @@ def _exec_limit_memory(maxsize):
     resource.setrlimit(resource.RLIMIT_AS, (maxsize, hard))
 
 
+def _exec_limit_processes(n):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NPROC)
+    resource.setrlimit(resource.RLIMIT_NPROC, (n if hard == resource.RLIM_INFINITY else min(n, hard), hard))
+
+
 resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
 if {{timeout}}:
     _exec_set_alarm_timeout({{timeout}})
@@ -51,6 +63,12 @@ if {{timeout}}:
 if {{memory_limit}}:
     _exec_limit_memory({{memory_limit}})
 
+if {{max_processes}}:
+    _exec_limit_processes({{max_processes}})
+
+if {{line_buffered}}:
+    sys.stdout.reconfigure(line_buffering=True)
+
 _exec_time_start = time.perf_counter()
 
 """.strip()
@@ -64,8 +82,64 @@ print(f"{DURATION_MARK}{{_exec_duration}}", flush=True)
 
 """.strip()
 
+# calls `entry_point` (a function, or `Class.method` of a new instance) with every test case in stdin (json),
+# and compares the return value with the expected one as python values (floats with tolerance).
+# The result of every case is printed as soon as it is done, so the finished cases are kept on timeout.
+# It is printed on a new line, as the function may have printed part of a line.
+FUNCTION_CALL_TEMPLATE = """
+
+import json as _exec_json
+import sys as _exec_sys
+
+
+def _exec_compare(actual, expected):
+    if actual == expected:
+        return True
+    if isinstance(actual, (list, tuple)) and isinstance(expected, (list, tuple)):
+        return len(actual) == len(expected) and all(map(_exec_compare, actual, expected))
+    if isinstance(actual, dict) and isinstance(expected, dict):
+        return actual.keys() == expected.keys() and all(_exec_compare(actual[k], expected[k]) for k in actual)
+    if isinstance(actual, (int, float)) and isinstance(expected, (int, float)) \\
+            and not isinstance(actual, bool) and not isinstance(expected, bool):
+        return math.isclose(actual, expected, rel_tol=1e-5, abs_tol=1e-5)
+    return False
+
+
+def _exec_entry_point(name):
+    target, _, method = name.partition('.')
+    target = globals()[target]
+    return getattr(target(), method) if method else target
+
+
+_exec_cases = _exec_json.loads(_exec_sys.stdin.read())
+_exec_function = _exec_entry_point({entry_point!r})
+for _exec_case in _exec_cases:
+    _exec_error = _exec_output = None
+    _exec_case_start = time.perf_counter()
+    try:
+        _exec_actual = _exec_function(*_exec_case.get('args') or [], **_exec_case.get('kwargs') or dict())
+    except Exception as _exec_e:
+        _exec_error = f'{{type(_exec_e).__name__}}: {{_exec_e}}'
+    _exec_case_cost = time.perf_counter() - _exec_case_start
+    _exec_passed = _exec_error is None and _exec_compare(_exec_actual, _exec_case.get('expected'))
+    if _exec_error is None and not _exec_passed:
+        _exec_output = repr(_exec_actual)[:{max_output_length}]
+    print("\\n{mark}" + _exec_json.dumps(dict(
+        passed=_exec_passed, cost=_exec_case_cost, error=_exec_error and _exec_error[:{max_output_length}], output=_exec_output,
+    )), flush=True)
+
+"""
+
+
 class PythonExecutor(ScriptExecutor):
-    def __init__(self, python_path: str, timeout: int = None, memory_limit: int = None):
+    stdout_end_mark = SCRIPT_ENDING_MARK
+
+    def __init__(
+        self, python_path: str, timeout: float = None, memory_limit: int = None,
+        max_processes: int = None, max_output_size: int = None, spawn_method: str = 'subprocess',
+        line_buffered: bool = False,
+    ):
+        """line_buffered: flush stdout at every line (instead of every 8KB), for comparing it while the script runs"""
         self.timeout = timeout
         self.memory_limit = (
             memory_limit + 1024 * 1024 * 1024  # extra 1GB for python overhead
@@ -73,11 +147,18 @@ class PythonExecutor(ScriptExecutor):
             else None
         )
         self.python_path = python_path
+        self.max_processes = max_processes
+        self.max_output_size = max_output_size
+        self.spawn_method = spawn_method
+        self.line_buffered = line_buffered
 
     @contextmanager
     def setup_command(self, script: str):
         with tempfile.NamedTemporaryFile(mode='w', suffix='.py') as f:
-            f.write(PRE_TEMPLATE.format(timeout=self.timeout, memory_limit=self.memory_limit))
+            f.write(PRE_TEMPLATE.format(
+                timeout=self.timeout, memory_limit=self.memory_limit, max_processes=self.max_processes,
+                line_buffered=self.line_buffered,
+            ))
             f.write("\n")
             f.write(script)
             f.write("\n")
@@ -87,9 +168,46 @@ class PythonExecutor(ScriptExecutor):
 
     def process_result(self, result):
         if SCRIPT_ENDING_MARK in result.stdout:
-            result.stdout, meta_info = result.stdout.split(SCRIPT_ENDING_MARK, 2)
+            result.stdout, meta_info = result.stdout.split(SCRIPT_ENDING_MARK, 1)
             for line in io.StringIO(meta_info):
                 if line.startswith(DURATION_MARK):
                     result.cost = float(line[len(DURATION_MARK):])
                     break
         return result
+
+
+class PythonFunctionExecutor(PythonExecutor):
+    """
+    Function-call mode: the solution is imported once and `entry_point` is called with every test case,
+    `execute_script` takes the test cases (list of dicts with args/kwargs/expected) as stdin in json.
+    `test_results` of the result has passed/cost/error/output of the finished cases.
+    """
+    def __init__(self, python_path: str, entry_point: str, max_output_length: int = 1000, **kwargs):
+        super().__init__(python_path, **kwargs)
+        self.entry_point = entry_point
+        self.max_output_length = max_output_length
+
+    def setup_command(self, script: str):
+        return super().setup_command(script + FUNCTION_CALL_TEMPLATE.format(
+            entry_point=self.entry_point, mark=TEST_RESULT_MARK, max_output_length=self.max_output_length,
+        ))
+
+    def execute_script(self, script, stdin=None, timeout=None, discard_stderr=False, stdout_checker=None):
+        if not isinstance(stdin, str):
+            stdin = json.dumps(stdin)
+        return super().execute_script(script, stdin, timeout, discard_stderr, stdout_checker)
+
+    def process_result(self, result):
+        result = super().process_result(result)
+        test_results = []
+
+        def _take(match: re.Match) -> str:
+            try:
+                test_results.append(json.loads(match.group(1)))
+            except json.JSONDecodeError:
+                pass  # cut by a kill
+            return ''
+
+        result.stdout = _TEST_RESULT_PATTERN.sub(_take, result.stdout)
+        result.test_results = test_results
+        return result
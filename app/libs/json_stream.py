@@ -0,0 +1,169 @@
+import codecs
+import json
+import re
+from typing import AsyncIterator
+
+
+_decoder = json.JSONDecoder()
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+# the characters which change the state while scanning an object
+_OBJECT_SPECIAL = re.compile(r'[{}"]')
+# the rest of a string until its closing quote (or the end of the text)
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\[\s\S][^"\\]*)*')
+
+
+class JsonObjectParser:
+    """
+    Incremental parser of a json array of objects, or of ndjson (objects separated by whitespace).
+    `feed` takes the next part of the text and returns the objects completed by it.
+    Objects which are complete in a part are parsed directly. The end of an object continued in the next parts
+    is found by counting braces outside strings (the state is kept between parts), and only then it is parsed,
+    so every character is scanned a constant number of times.
+    Only the current object is kept, and it is an error if it is longer than `max_object_size` characters.
+    """
+    def __init__(self, max_object_size: int):
+        self.max_object_size = max_object_size
+        self.is_array: bool | None = None   # known at the first non-whitespace character
+        self.closed = False                 # `]` of the array is seen
+        self.parsed = 0
+        # between objects
+        self._expect_comma = False          # array: after an object
+        self._after_comma = False           # array: `]` is a trailing comma
+        self._separated = True              # ndjson: whitespace after the last object
+        # in an object
+        self._depth = 0
+        self._in_string = False
+        self._escape = False                # the last part ended with a backslash in a string
+        self._parts: list[str] = []
+        self._size = 0
+
+    def feed(self, text: str, final: bool = False) -> list[dict]:
+        objects = []
+        pos = 0
+        while pos < len(text):
+            if self._depth:
+                pos = self._scan_object(text, pos, objects)
+                continue
+            match = _NON_WHITESPACE.search(text, pos)
+            if match is None:
+                self._separated = True
+                break
+            if match.start() > pos:
+                self._separated = True
+            pos = match.start()
+            char = text[pos]
+            if self.closed:
+                raise ValueError('unexpected data after the end of the array')
+            if self.is_array is None:
+                self.is_array = char == '['
+                if self.is_array:
+                    pos += 1
+                    continue
+            if self.is_array:
+                if char == ']':
+                    if self._after_comma:
+                        raise ValueError(f'trailing `,` after item {self.parsed - 1}')
+                    self.closed = True
+                    pos += 1
+                    continue
+                if self._expect_comma:
+                    if char != ',':
+                        raise ValueError(f'expected `,` or `]` after item {self.parsed - 1}')
+                    self._expect_comma = False
+                    self._after_comma = True
+                    pos += 1
+                    continue
+            elif not self._separated:
+                raise ValueError(f'expected whitespace after item {self.parsed - 1}')
+            if char != '{':
+                raise ValueError(f'item {self.parsed} is not an object')
+            try:
+                obj, obj_end = _decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                pass  # continued in the next part (or invalid, which is reported at its end)
+            else:
+                if obj_end - pos > self.max_object_size:
+                    raise ValueError(f'item {self.parsed} is bigger than {self.max_object_size} characters')
+                self._add(obj, objects)
+                pos = obj_end
+                continue
+            self._depth = 1
+            self._parts = ['{']
+            self._size = 1
+            pos = self._scan_object(text, pos + 1, objects)
+        if final:
+            if self._depth:
+                raise ValueError(f'item {self.parsed} is incomplete')
+            if self.is_array and not self.closed:
+                raise ValueError('the array is not closed')
+        return objects
+
+    def _scan_object(self, text: str, pos: int, objects: list[dict]) -> int:
+        """Scan the current object from `pos`, and returns where it stops (the end of the object or of the text)"""
+        start = pos
+        end = len(text)
+        while pos < end:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                pos = _STRING_BODY.match(text, pos).end()
+                if pos == end:
+                    break
+                if text[pos] == '\\':
+                    # the escaped character is in the next part
+                    self._escape = True
+                else:
+                    self._in_string = False
+                pos += 1
+                continue
+            match = _OBJECT_SPECIAL.search(text, pos)
+            if match is None:
+                pos = end
+                break
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    break
+        self._parts.append(text[start:pos])
+        self._size += pos - start
+        if self._size > self.max_object_size:
+            raise ValueError(f'item {self.parsed} is bigger than {self.max_object_size} characters')
+        if not self._depth:
+            object_text = ''.join(self._parts)
+            self._parts = []
+            try:
+                obj = json.loads(object_text)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'invalid json at item {self.parsed}: {e}') from None
+            self._add(obj, objects)
+        return pos
+
+    def _add(self, obj: dict, objects: list[dict]):
+        objects.append(obj)
+        self.parsed += 1
+        self._expect_comma = bool(self.is_array)
+        self._after_comma = False
+        self._separated = False
+
+
+async def iter_json_objects(chunks: AsyncIterator[bytes], max_object_size: int) -> AsyncIterator[list[dict]]:
+    """Yield the objects (see `JsonObjectParser`) completed by every chunk of utf-8 text (skipped if none)"""
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    parser = JsonObjectParser(max_object_size)
+    async for chunk in chunks:
+        try:
+            text = text_decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise ValueError(f'invalid utf-8: {e}') from None
+        if objects := parser.feed(text):
+            yield objects
+    if objects := parser.feed(text_decoder.decode(b'', final=True), final=True):
+        yield objects
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from pathlib import Path
+from time import monotonic
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class RotatingJsonlWriter:
+    """
+    Append-only jsonl files `{name}-{tag}-{seq}.jsonl` in `directory`.
+    The file is rotated when it is bigger than `max_file_size` bytes, and then the oldest `{name}-*.jsonl` files
+    (of all writers in the directory) are removed until they are at most `max_total_size` bytes in total.
+    Every process should use its own `tag`.
+    """
+    def __init__(self, directory: str, name: str, tag: str, max_file_size: int, max_total_size: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.tag = tag
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.seq = 0
+        self.file = None
+        self.path = None
+
+    def _open(self):
+        self.seq += 1
+        self.path = self.directory / f'{self.name}-{self.tag}-{self.seq:06d}.jsonl'
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def _remove_old_files(self):
+        files = []
+        for path in self.directory.glob(f'{self.name}-*.jsonl'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another writer
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total_size <= self.max_total_size:
+                break
+            if path == self.path:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def write(self, record: dict):
+        if self.file is None:
+            self._open()
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if self.file.tell() >= self.max_file_size:
+            self.file.close()
+            self._open()
+            self._remove_old_files()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SampledRecorder:
+    """
+    Write records in a background thread, so the caller is never blocked by the disk.
+    A record is dropped (instead of waiting) when
+    - it is not sampled (`sample_rate`),
+    - its key has used up its quota (`quotas[key]` or `default_quota` records per `quota_window` seconds),
+    - or the queue is full.
+    Records are built lazily, so dropped ones cost almost nothing.
+    """
+    def __init__(
+        self,
+        writer: RotatingJsonlWriter,
+        *,
+        sample_rate: float = 1.0,
+        quotas: dict[str, int] | None = None,
+        default_quota: int | None = None,
+        quota_window: float = 3600,
+        max_queue_size: int = 1000,
+    ):
+        self.writer = writer
+        self.sample_rate = sample_rate
+        self.quotas = quotas or {}
+        self.default_quota = default_quota
+        self.quota_window = quota_window
+        self.pid = os.getpid()
+        self.recorded = 0
+        self.dropped = 0
+        self._window_start = monotonic()
+        self._used: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_queue_size)
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+
+    def _take_quota(self, key: str) -> bool:
+        quota = self.quotas.get(key, self.default_quota)
+        with self._lock:
+            now = monotonic()
+            if now - self._window_start >= self.quota_window:
+                self._window_start = now
+                self._used.clear()
+            if quota is not None and self._used.get(key, 0) >= quota:
+                return False
+            self._used[key] = self._used.get(key, 0) + 1
+            return True
+
+    def record(self, key: str, make_record: Callable[[], dict]) -> bool:
+        """Returns whether the record is queued"""
+        if random.random() >= self.sample_rate or not self._take_quota(key):
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(make_record())
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        stop = False
+        while not stop:
+            # write all queued records together, and flush once
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for record in records:
+                    if record is None:
+                        stop = True
+                        break
+                    self.writer.write(record)
+                    self.recorded += 1
+                self.writer.flush()
+            except Exception:
+                logger.exception('Failed to write records')
+
+    def close(self, timeout: float = 5):
+        """Write the queued records and stop the thread"""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self.writer.close()
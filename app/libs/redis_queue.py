@@ -8,6 +8,31 @@ import socket
 logger = logging.getLogger(__name__)
 
 
+# LPOP the first non-empty list of KEYS. Returns [key, value] or nil.
+POP_FIRST_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local value = redis.call('LPOP', key)
+    if value then
+        return {key, value}
+    end
+end
+return false
+"""
+
+# HSET a field of KEYS[1] and refresh its expiration. When it has more than ARGV[3] fields,
+# it is renamed to KEYS[2] (replacing the older generation), so at most two generations are kept.
+HSET_ROTATING_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if redis.call('HLEN', KEYS[1]) > tonumber(ARGV[3]) then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+"""
+
+# seconds, shorter remainders of a block pop timeout are not waited for
+MIN_BLOCK_TIMEOUT = 0.001
+
+
 class RedisQueue:
     def __init__(self, redis_uri, queue_name, *, socket_timeout: int = None, is_async: bool = False):
         self.redis_uri = redis_uri
@@ -16,7 +41,10 @@ class RedisQueue:
         self.socket_timeout = socket_timeout
         if self.socket_timeout is not None and self.socket_timeout < 10:
             raise ValueError('socket_timeout must be at least 10 seconds')
+        self.time_offset = 0.0  # redis server time - local time, see `sync_time`
         self.redis: redis.Redis | redis.asyncio.Redis = self._init_redis(socket_timeout)
+        self._pop_first_script = self.redis.register_script(POP_FIRST_SCRIPT)
+        self._hset_rotating_script = self.redis.register_script(HSET_ROTATING_SCRIPT)
 
     def _init_redis(self, socket_timeout) -> redis.Redis | redis.asyncio.Redis:
         if '+cluster://' in self.redis_uri:
@@ -44,6 +72,20 @@ class RedisQueue:
     def get(self, key):
         return self.redis.get(key)
 
+    def get_multi(self, *keys):
+        if not keys:
+            return []
+        pp = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pp.get(key)
+        return pp.execute()
+
+    def set_multi(self, mapping: dict, expire=None):
+        pp = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pp.set(key, value, ex=expire)
+        return pp.execute()
+
     def _peak_sync(self, queue_name):
         result = self.redis.lrange(queue_name, 0, 0)
         if result:
@@ -76,12 +118,21 @@ class RedisQueue:
             pp.lpop(queue_name)
         return pp.execute()
 
+    def pop_first(self, *queue_names):
+        """
+        Pop from the first non-empty queue, in the given order and atomically.
+        Returns (queue name, value) like `block_pop`, or None if all queues are empty.
+        In redis cluster all queues must be in the same slot.
+        """
+        return self._pop_first_script(keys=queue_names)
+
     def _block_pop_sync(self, *queue_names, timeout=0) -> tuple[str, bytes] | None:
         start = time()
         while True:
             if timeout > 0:
-                effective_timeout = timeout - int(time() - start)
-                if effective_timeout <= 0:
+                effective_timeout = timeout - (time() - start)
+                # redis rounds timeouts under 1ms down to 0, which means blocking forever
+                if effective_timeout < MIN_BLOCK_TIMEOUT:
                     break
             else:
                 effective_timeout = self.socket_timeout
@@ -95,13 +146,14 @@ class RedisQueue:
         start = time()
         while True:
             if timeout > 0:
-                effective_timeout = timeout - int(time() - start)
-                if effective_timeout <= 0:
+                effective_timeout = timeout - (time() - start)
+                # redis rounds timeouts under 1ms down to 0, which means blocking forever
+                if effective_timeout < MIN_BLOCK_TIMEOUT:
                     break
             else:
                 effective_timeout = self.socket_timeout
-            result = await self.redis.blpop(queue_names, timeout=effective_timeout)
             effective_timeout = min(effective_timeout, self.socket_timeout - 2)  # 2 seconds for communication overhead
+            result = await self.redis.blpop(queue_names, timeout=effective_timeout)
             if result:
                 return result
         return None
@@ -133,12 +185,87 @@ class RedisQueue:
         else:
             return self._time_sync()
 
+    def _update_time_offset(self, samples: list[tuple[float, float, float]]) -> float:
+        # use the sample with the smallest round trip time
+        start, server_time, end = min(samples, key=lambda s: s[2] - s[0])
+        self.time_offset = server_time - (start + end) / 2
+        return self.time_offset
+
+    def _sync_time_sync(self, rounds) -> float:
+        samples = []
+        for _ in range(rounds):
+            start = time()
+            server_time = self._time_sync()
+            samples.append((start, server_time, time()))
+        return self._update_time_offset(samples)
+
+    async def _sync_time_async(self, rounds) -> float:
+        samples = []
+        for _ in range(rounds):
+            start = time()
+            server_time = await self._time_async()
+            samples.append((start, server_time, time()))
+        return self._update_time_offset(samples)
+
+    def sync_time(self, rounds=10) -> float | Awaitable[float]:
+        """Estimate the offset between the redis server clock and the local clock. Returns the offset."""
+        if self.is_async:
+            return self._sync_time_async(rounds)
+        else:
+            return self._sync_time_sync(rounds)
+
+    def now(self) -> float:
+        """Current time in the redis server clock (estimated by `sync_time`)"""
+        return time() + self.time_offset
+
+    def push_capped(self, key, value, max_len):
+        """Push to the head of the list, and keep only its first max_len items"""
+        pp = self.redis.pipeline(transaction=False)
+        pp.lpush(key, value)
+        pp.ltrim(key, 0, max_len - 1)
+        return pp.execute()
+
+    def lrange(self, key, start, end):
+        return self.redis.lrange(key, start, end)
+
     def llen(self, queue_name):
         return self.redis.llen(queue_name)
 
-    async def count_keys(self, pattern):
-        assert self.is_async, "count_keys is only available in async mode"
-        count = 0
-        async for _ in self.redis.scan_iter(pattern, count=100):
-            count += 1
-        return count
+    def llen_multi(self, *queue_names):
+        pp = self.redis.pipeline(transaction=False)
+        for queue_name in queue_names:
+            pp.llen(queue_name)
+        return pp.execute()
+
+    def hset(self, key, field, value):
+        return self.redis.hset(key, field, value)
+
+    def hmget_multi(self, key_fields: list[tuple[str, list[str]]]):
+        """The values of the fields of every (key, fields), a list per key"""
+        pp = self.redis.pipeline(transaction=False)
+        for key, fields in key_fields:
+            pp.hmget(key, fields)
+        return pp.execute()
+
+    def hset_rotating(self, key, old_key, field, value, max_len, expire):
+        """
+        Set a field of the hash `key`, which is moved to `old_key` when it has more than max_len fields (see
+        HSET_ROTATING_SCRIPT). Both expire `expire` seconds after their last write.
+        In redis cluster both keys must be in the same slot.
+        """
+        return self._hset_rotating_script(keys=[key, old_key], args=[field, value, max_len, expire])
+
+    def hgetall(self, key):
+        return self.redis.hgetall(key)
+
+    def hdel(self, key, *fields):
+        return self.redis.hdel(key, *fields)
+
+    def zadd(self, key, member, score):
+        return self.redis.zadd(key, {member: score})
+
+    def zrem(self, key, *members):
+        return self.redis.zrem(key, *members)
+
+    def zcount(self, key, min_score, max_score):
+        return self.redis.zcount(key, min_score, max_score)
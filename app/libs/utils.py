@@ -2,3 +2,15 @@ def chunkify(iterable, size):
     """Yield successive chunks from iterable."""
     for i in range(0, len(iterable), size):
         yield iterable[i:i + size]
+
+
+def parse_key_values(spec: str, value_type=int) -> dict:
+    """Parse `key:value` lists like `wrong_answer:100,internal_error:1000`"""
+    values = {}
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, value = part.rpartition(':')
+        values[key] = value_type(value)
+    return values
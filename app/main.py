@@ -1,20 +1,33 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 import logging
-from time import time
 
 import fastapi
 import uvicorn.logging
+from starlette.requests import ClientDisconnect
 
 from app.model import (
     Submission,
     BatchSubmission,
     JudgeResult,
     BatchJudgeResult,
+    ServerStatus,
+    ExtendedServerStatus,
+    CancelRequest,
+    SlowLogEntry,
+    TENANT_PATTERN,
+)
+from app.judge import (
+    judge as _judge, judge_batch as _judge_batch, judge_batch_stream as _judge_batch_stream, InvalidBatchError
 )
-from app.judge import judge as _judge, judge_batch as _judge_batch
 from app.worker_manager import WorkerManager
 from app.work_queue import connect_queue
+from app.worker_registry import list_workers
+from app.tenants import queue_lengths
+from app.cancellation import cancel
+import app.slowlog as slowlog
 import app.config as app_config
+import app.metrics as metrics
 
 
 logger = logging.getLogger(__name__)
@@ -49,12 +62,11 @@ async def _set_access_log(_: fastapi.FastAPI):
     logger.addHandler(handler)
 
     # warm up the connection
-    for _ in range(10):
-        time_offset = await redis_queue.time() - time()
+    time_offset = await redis_queue.sync_time()
     if abs(time_offset) > 1:
         logger.warning(f'Clock skew detected: {time_offset:.2f} seconds. '
-                       f'This may cause issues with timeouts.'
-                       f'Please make sure MAX_QUEUE_WORK_LIFE_TIME{app_config.MAX_QUEUE_WORK_LIFE_TIME} is large enough.')
+                       f'Timestamps of work use the redis server time, so it is compensated. '
+                       f'But please check the clock of this machine.')
     yield
     logger.handlers[0].setFormatter(old)
 
@@ -67,38 +79,143 @@ def ping():
     return 'pong'
 
 
+async def _cancel_on_disconnect(request: fastapi.Request, coro, body_read: asyncio.Event | None = None):
+    """
+    Run the judge coroutine, and cancel it when the client disconnects.
+    The judge functions then cancel their work in workers.
+    body_read: for the coroutine reading the body itself, it is only checked after the body is read
+    (reading the body fails if the client disconnects before).
+    """
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=app_config.CANCEL_CHECK_INTERVAL)
+        if done:
+            return task.result()
+        if (body_read is None or body_read.is_set()) and await request.is_disconnected():
+            logger.info(f'Client of {request.url.path} disconnected. Work cancelled.')
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            # nobody reads it
+            raise fastapi.HTTPException(status_code=499, detail='Client disconnected')
+
+
 @app.post('/run')
-async def run(submission: Submission):
-    return await _judge(redis_queue, submission)
+async def run(submission: Submission, request: fastapi.Request):
+    return await _cancel_on_disconnect(request, _judge(redis_queue, submission, endpoint='/run'))
 
 
 @app.post('/run/batch')
-async def run_batch(batch_sub: BatchSubmission):
-    return await _judge_batch(redis_queue, batch_sub)
+async def run_batch(batch_sub: BatchSubmission, request: fastapi.Request):
+    return await _cancel_on_disconnect(request, _judge_batch(redis_queue, batch_sub, endpoint='/run/batch'))
 
 
 @app.post('/run/long-batch')
-async def run_long_batch(batch_sub: BatchSubmission):
-    return await _judge_batch(redis_queue, batch_sub, long_batch=True)
+async def run_long_batch(batch_sub: BatchSubmission, request: fastapi.Request):
+    return await _cancel_on_disconnect(
+        request, _judge_batch(redis_queue, batch_sub, long_batch=True, endpoint='/run/long-batch')
+    )
+
+
+async def _read_body(request: fastapi.Request, body_read: asyncio.Event):
+    async for chunk in request.stream():
+        yield chunk
+    body_read.set()
+
+
+async def _stream_batch(
+    request: fastapi.Request, endpoint: str, verdict_only: bool, sub_id: str | None, tenant: str | None,
+    kill_failed_groups: bool,
+):
+    body_read = asyncio.Event()
+    try:
+        return await _cancel_on_disconnect(request, _judge_batch_stream(
+            redis_queue, _read_body(request, body_read), sub_id, tenant, kill_failed_groups, endpoint, verdict_only
+        ), body_read)
+    except InvalidBatchError as e:
+        raise fastapi.HTTPException(status_code=e.status_code, detail=str(e))
+    except ClientDisconnect:
+        logger.info(f'Client of {endpoint} disconnected while uploading. Work cancelled.')
+        raise fastapi.HTTPException(status_code=499, detail='Client disconnected')
+
+
+@app.post('/run/long-batch/stream')
+async def run_long_batch_stream(
+    request: fastapi.Request,
+    sub_id: str | None = None,
+    tenant: str | None = fastapi.Query(None, pattern=TENANT_PATTERN),
+    kill_failed_groups: bool = False,
+):
+    """
+    Like /run/long-batch, but the body is only the submissions, as a json array or ndjson,
+    and they are judged while the body is uploaded. The other fields of the batch are query parameters.
+    """
+    return await _stream_batch(request, '/run/long-batch/stream', False, sub_id, tenant, kill_failed_groups)
 
 
 @app.post('/judge')
-async def judge(submission: Submission):
-    return JudgeResult.from_submission_result(await _judge(redis_queue, submission))
+async def judge(submission: Submission, request: fastapi.Request):
+    return JudgeResult.from_submission_result(
+        await _cancel_on_disconnect(request, _judge(redis_queue, submission, endpoint='/judge', verdict_only=True))
+    )
 
 
 @app.post('/judge/batch')
-async def judge_batch(batch_sub: BatchSubmission):
-    return BatchJudgeResult.from_submission_result(await _judge_batch(redis_queue, batch_sub))
+async def judge_batch(batch_sub: BatchSubmission, request: fastapi.Request):
+    return BatchJudgeResult.from_submission_result(await _cancel_on_disconnect(
+        request, _judge_batch(redis_queue, batch_sub, endpoint='/judge/batch', verdict_only=True)
+    ))
 
 
 @app.post('/judge/long-batch')
-async def judge_batch(batch_sub: BatchSubmission):
-    return BatchJudgeResult.from_submission_result(await _judge_batch(redis_queue, batch_sub, long_batch=True))
+async def judge_long_batch(batch_sub: BatchSubmission, request: fastapi.Request):
+    return BatchJudgeResult.from_submission_result(await _cancel_on_disconnect(
+        request, _judge_batch(redis_queue, batch_sub, long_batch=True, endpoint='/judge/long-batch', verdict_only=True)
+    ))
+
+
+@app.post('/judge/long-batch/stream')
+async def judge_long_batch_stream(
+    request: fastapi.Request,
+    sub_id: str | None = None,
+    tenant: str | None = fastapi.Query(None, pattern=TENANT_PATTERN),
+    kill_failed_groups: bool = False,
+):
+    """Like /run/long-batch/stream, but only returns the verdicts"""
+    return BatchJudgeResult.from_submission_result(
+        await _stream_batch(request, '/judge/long-batch/stream', True, sub_id, tenant, kill_failed_groups)
+    )
+
+
+@app.post('/cancel')
+async def cancel_work(cancel_request: CancelRequest):
+    """
+    Cancel batches or submissions by sub_id.
+    Queued work is skipped and running work is killed. Their results are `cancelled`.
+    """
+    await cancel(redis_queue, *cancel_request.sub_ids)
+    return {'cancelled': len(cancel_request.sub_ids)}
+
 
 @app.get('/status')
-async def status():
-    return {
-        'queue': await redis_queue.llen(app_config.REDIS_WORK_QUEUE_NAME),
-        'num_workers': await redis_queue.count_keys(f'{app_config.REDIS_WORKER_ID_PREFIX}*')
-    }
\ No newline at end of file
+async def status() -> ServerStatus:
+    return ServerStatus.from_workers(await queue_lengths(redis_queue), await list_workers(redis_queue))
+
+
+@app.get('/status/workers')
+async def status_workers() -> ExtendedServerStatus:
+    workers = await list_workers(redis_queue)
+    status = ServerStatus.from_workers(await queue_lengths(redis_queue), workers)
+    return ExtendedServerStatus(**status.model_dump(), workers=workers)
+
+
+@app.get('/slowlog')
+async def get_slowlog(count: int = fastapi.Query(100, ge=1, le=app_config.SLOWLOG_MAX_LEN)) -> list[SlowLogEntry]:
+    """The newest `count` slow submissions, newest first"""
+    return await slowlog.recent(redis_queue, count)
+
+
+@app.get('/metrics')
+def get_metrics():
+    content, content_type = metrics.generate_metrics()
+    return fastapi.Response(content=content, media_type=content_type)
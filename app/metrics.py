@@ -0,0 +1,91 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+
+# Metrics of all processes (uvicorn workers, judge workers) are collected
+# only if PROMETHEUS_MULTIPROC_DIR is set (see prometheus_client multiprocess mode).
+# Otherwise only the metrics of the current process are exported.
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600, float('inf')
+)
+REDIS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, float('inf')
+)
+
+
+# worker manager
+WORKERS = Gauge('judge_workers', 'Number of workers', multiprocess_mode='livesum')
+WORKERS_DESIRED = Gauge('judge_workers_desired', 'Number of workers wanted by the autoscaler', multiprocess_mode='livesum')
+WORKERS_BUSY_SAMPLED = Gauge('judge_workers_busy_sampled', 'Number of busy workers seen by the worker manager', multiprocess_mode='livesum')
+HOST_CPU_PERCENT = Gauge('judge_host_cpu_percent', 'Host cpu usage seen by the worker manager', multiprocess_mode='livemax')
+HOST_MEMORY_PERCENT = Gauge('judge_host_memory_percent', 'Host memory usage seen by the worker manager', multiprocess_mode='livemax')
+AUTOSCALE_EVENTS = Counter('judge_autoscale_events', 'Number of autoscaling changes', ['direction', 'reason'])
+
+# workers
+WORKERS_BUSY = Gauge('judge_workers_busy', 'Number of workers judging a submission', multiprocess_mode='livesum')
+WORKERS_IDLE = Gauge('judge_workers_idle', 'Number of workers waiting for work', multiprocess_mode='livesum')
+SPEED_FACTOR = Gauge('judge_worker_speed_factor', 'Speed of the worker compared with the reference node', multiprocess_mode='liveall')
+QUEUE_WAIT_TIME = Histogram('judge_queue_wait_seconds', 'Time from enqueue to dequeue', ['language'], buckets=LATENCY_BUCKETS)
+SETUP_TIME = Histogram('judge_setup_seconds', 'Time to prepare the submission (compiling for cpp)', ['language'], buckets=LATENCY_BUCKETS)
+EXECUTION_TIME = Histogram('judge_execution_seconds', 'Time to run the submission', ['language'], buckets=LATENCY_BUCKETS)
+WORKER_RESULTS = Counter('judge_worker_results', 'Number of submissions judged by workers', ['language', 'reason', 'success'])
+ERROR_CASES = Counter('judge_error_cases', 'Number of failed submissions seen by the error case recorder', ['reason', 'saved'])
+TENANT_WORK = Counter('judge_tenant_work', 'Number of work items judged by workers by tenant', ['tenant'])
+TENANT_WORK_TIME = Counter('judge_tenant_work_seconds', 'Worker time used by tenant', ['tenant'])
+STRAGGLERS_KILLED = Counter('judge_stragglers_killed', 'Number of processes left by submissions and killed by workers')
+MISMATCH_KILLS = Counter('judge_mismatch_kills', 'Number of submissions killed at the first mismatch with the expected output', ['type'])
+DROPPED_WORK = Counter('judge_dropped_work', 'Number of work items dropped by workers without judging', ['reason'])
+
+# api
+REQUEST_TIME = Histogram('judge_request_seconds', 'Time to handle a judge request', ['endpoint'], buckets=LATENCY_BUCKETS)
+RESULT_WAIT_TIME = Histogram(
+    'judge_result_wait_seconds', 'Time from enqueue to getting the result in api', ['endpoint', 'language'], buckets=LATENCY_BUCKETS
+)
+RESULT_PICKUP_TIME = Histogram(
+    'judge_result_pickup_seconds', 'Time from publishing the result in worker to getting it in api', ['endpoint', 'language'],
+    buckets=LATENCY_BUCKETS
+)
+RESULTS = Counter('judge_results', 'Number of submission results returned by api', ['endpoint', 'language', 'reason', 'success'])
+
+# both
+REDIS_TIME = Histogram('judge_redis_seconds', 'Round trip time of non-blocking redis commands', ['op'], buckets=REDIS_BUCKETS)
+SLOWLOG_ENTRIES = Counter('judge_slowlog_entries', 'Number of slow submissions recorded in the slow log', ['source'])
+
+
+def reason_label(reason) -> str:
+    return reason.value or 'none'
+
+
+def _registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def start_metrics_server(port: int):
+    start_http_server(port, registry=_registry())
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """Returns the metrics and the content type"""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
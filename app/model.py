@@ -1,22 +1,96 @@
 from enum import Enum
-from typing import Literal
+from typing import Any, Literal
 import uuid
 from time import time
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field, field_validator, model_validator
+
+import app.config as app_config
+from app.libs.comparators import COMPARE_MODES
+
+
+TENANT_PATTERN = r'^[A-Za-z0-9_.-]{1,64}$'
+
+
+class TestCase(BaseModel):
+    # json values
+    args: list[Any] = []
+    kwargs: dict[str, Any] | None = None
+    expected: Any = None
+
+
+class TestCaseResult(BaseModel):
+    passed: bool
+    cost: float                   # seconds of the call
+    error: str | None = None      # the exception raised by the call
+    output: str | None = None     # repr of the return value when it is wrong
 
 
 class Submission(BaseModel):
     sub_id: str | None = None
     type: Literal['python', 'cpp', 'math']
+    # the job/client the submission belongs to. Workers share their time between tenants by weight
+    tenant: str | None = Field(None, pattern=TENANT_PATTERN)
+    # supported options:
+    #   time_limit: time limit in seconds, capped by MAX_EXECUTION_TIME
+    #   memory_limit: memory limit in MB, capped by MAX_MEMORY
+    #   problem_id: used to estimate the cost from the history of the problem
+    #   compare: `exact` or `tokens` comparison with expected_output (see app/libs/comparators.py),
+    #     which is done while the program runs, so it is killed at the first mismatch
     options: dict[str, str] | None = None
     solution: str
     input: str | None = None
     expected_output: str | None = None
+    # function-call mode (python only): call `entry_point` (a function or `Class.method`) with every test case,
+    # instead of running the script with input
+    entry_point: str | None = Field(None, pattern=r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)?$')
+    test_cases: list[TestCase] | None = None
+    # fail-fast group in a batch: once a member fails, the left members are skipped
+    group: str | None = None
 
     def model_post_init(self, __context):
         self.sub_id = self.sub_id or str(uuid.uuid4())
 
+    @model_validator(mode='after')
+    def _check_function_call(self):
+        if (self.entry_point is None) != (self.test_cases is None):
+            raise ValueError('entry_point and test_cases must be given together')
+        if self.entry_point is not None and self.type != 'python':
+            raise ValueError('entry_point is only supported for python')
+        return self
+
+    @field_validator('options')
+    @classmethod
+    def _check_options(cls, options: dict[str, str] | None):
+        if not options:
+            return options
+        if 'time_limit' in options and not float(options['time_limit']) > 0:
+            raise ValueError('time_limit must be positive')
+        if 'memory_limit' in options and not int(options['memory_limit']) > 0:
+            raise ValueError('memory_limit must be positive')
+        if 'compare' in options and options['compare'] not in COMPARE_MODES:
+            raise ValueError(f'compare must be one of {", ".join(COMPARE_MODES)}')
+        return options
+
+    @property
+    def time_limit(self) -> float:
+        """Time limit in seconds"""
+        if self.options and 'time_limit' in self.options:
+            return min(float(self.options['time_limit']), app_config.MAX_EXECUTION_TIME)
+        return app_config.MAX_EXECUTION_TIME
+
+    @property
+    def memory_limit(self) -> int:
+        """Memory limit in MB"""
+        if self.options and 'memory_limit' in self.options:
+            return min(int(self.options['memory_limit']), app_config.MAX_MEMORY)
+        return app_config.MAX_MEMORY
+
+    @property
+    def compare_mode(self) -> str | None:
+        """None means comparing as python values"""
+        return self.options.get('compare') if self.options else None
+
 
 class ResultReason(Enum):
     UNSPECIFIED = ''
@@ -24,6 +98,43 @@ class ResultReason(Enum):
     WORKER_TIMEOUT = 'worker_timeout'
     QUEUE_TIMEOUT = 'queue_timeout'
     INVALID_INPUT = 'invalid_input'
+    CANCELLED = 'cancelled'
+    SKIPPED = 'skipped'   # another member of the fail-fast group failed
+
+
+class SubmissionTiming(BaseModel):
+    # timestamps in seconds since epoch, based on the redis server clock
+    enqueue_time: float | None = None     # pushed to the work queue by api
+    dequeue_time: float | None = None     # popped from the work queue by worker
+    publish_time: float | None = None     # result pushed by worker
+    pickup_time: float | None = None      # result popped by api
+    # durations in seconds
+    setup: float | None = None            # writing files and compiling (for cpp)
+    execution_wall: float | None = None   # wall time of running the submission
+    execution_cpu: float | None = None    # user + system cpu time of running the submission
+    compare: float | None = None          # comparing the output with expected_output
+    worker_id: str | None = None          # the worker which judged it
+
+    @computed_field
+    @property
+    def queue_wait(self) -> float | None:
+        if self.enqueue_time is None or self.dequeue_time is None:
+            return None
+        return self.dequeue_time - self.enqueue_time
+
+    @computed_field
+    @property
+    def result_pickup(self) -> float | None:
+        if self.publish_time is None or self.pickup_time is None:
+            return None
+        return self.pickup_time - self.publish_time
+
+    @computed_field
+    @property
+    def total(self) -> float | None:
+        if self.enqueue_time is None or self.pickup_time is None:
+            return None
+        return self.pickup_time - self.enqueue_time
 
 
 class SubmissionResult(BaseModel):
@@ -31,23 +142,78 @@ class SubmissionResult(BaseModel):
     success: bool         # Indicates if the submission was successful (run_success is True and output matches)
     run_success: bool     # Indicates if the submission ran successfully (no internal error and exit code 0)
     cost: float
+    normalized_cost: float | None = None    # cost in seconds of the reference node (see app/calibration.py)
     stdout: str | None = None
     stderr: str | None = None
     reason: ResultReason = ResultReason.UNSPECIFIED
+    timing: SubmissionTiming | None = None
+    # function-call mode, one per test case (missing ones didn't finish in time)
+    test_results: list[TestCaseResult] | None = None
 
 
 class BatchSubmission(BaseModel):
     sub_id: str | None = None
     type: Literal['batch'] = 'batch'
+    # default tenant of the submissions
+    tenant: str | None = Field(None, pattern=TENANT_PATTERN)
+    # also kill the running members of a failed group (otherwise only the queued ones are skipped)
+    kill_failed_groups: bool = False
     submissions: list[Submission] = Field(..., min_length=1)
 
     def model_post_init(self, __context):
         self.sub_id = self.sub_id or str(uuid.uuid4())
+        if self.tenant:
+            for sub in self.submissions:
+                sub.tenant = sub.tenant or self.tenant
+
+
+class TimingStats(BaseModel):
+    count: int
+    mean: float
+    p50: float
+    p99: float
+    max: float
+
+    @classmethod
+    def from_values(cls, values: list[float]):
+        if not values:
+            return None
+        values = sorted(values)
+        return cls(
+            count=len(values),
+            mean=sum(values) / len(values),
+            p50=values[len(values) // 2],
+            p99=values[min(len(values) - 1, int(len(values) * 0.99))],
+            max=values[-1],
+        )
+
+
+class BatchTiming(BaseModel):
+    queue_wait: TimingStats | None = None
+    setup: TimingStats | None = None
+    execution_wall: TimingStats | None = None
+    execution_cpu: TimingStats | None = None
+    compare: TimingStats | None = None
+    result_pickup: TimingStats | None = None
+    total: TimingStats | None = None
+
+    @classmethod
+    def from_results(cls, results: list[SubmissionResult]):
+        timings = [r.timing for r in results if r.timing is not None]
+        if not timings:
+            return None
+        return cls(**{
+            phase: TimingStats.from_values([
+                value for t in timings if (value := getattr(t, phase)) is not None
+            ])
+            for phase in cls.model_fields
+        })
 
 
 class BatchSubmissionResult(BaseModel):
     sub_id: str
     results: list[SubmissionResult]
+    timing: BatchTiming | None = None
 
 
 class JudgeResult(BaseModel):
@@ -56,6 +222,7 @@ class JudgeResult(BaseModel):
     run_success: bool
     cost: float
     reason: ResultReason = ResultReason.UNSPECIFIED
+    test_results: list[TestCaseResult] | None = None
 
     @classmethod
     def from_submission_result(cls, result: SubmissionResult):
@@ -64,26 +231,128 @@ class JudgeResult(BaseModel):
             success=result.success,
             run_success=result.run_success,
             cost=result.cost,
-            reason=result.reason
+            reason=result.reason,
+            test_results=result.test_results,
         )
 
 
 class BatchJudgeResult(BaseModel):
     sub_id: str
     results: list[JudgeResult]
+    timing: BatchTiming | None = None
 
     @classmethod
     def from_submission_result(cls, result: BatchSubmissionResult):
         return cls(
             sub_id=result.sub_id,
-            results=[JudgeResult.from_submission_result(r) for r in result.results]
+            results=[JudgeResult.from_submission_result(r) for r in result.results],
+            timing=result.timing,
+        )
+
+
+class CancelRequest(BaseModel):
+    # sub_id of batches or submissions
+    sub_ids: list[str] = Field(..., min_length=1)
+
+
+class WorkerInfo(BaseModel):
+    worker_id: str
+    node: str             # hostname of the worker
+    pid: int
+    state: Literal['idle', 'busy']
+    work_id: str | None = None      # the work item being judged when busy
+    tenant: str | None = None       # the tenant of the work item when busy
+    last_seen: float      # seconds since epoch, based on the redis server clock
+    max_workers: int      # max number of workers of the node
+    speed_factor: float = 1.0       # speed compared with the reference node (see app/calibration.py)
+
+
+class SlowLogEntry(BaseModel):
+    time: float                   # seconds since epoch, based on the redis server clock
+    source: Literal['api', 'worker']
+    work_id: str | None = None
+    sub_id: str | None = None
+    tenant: str | None = None
+    type: str
+    solution_size: int | None = None    # characters, None if unknown (not kept by the api for streamed batches)
+    input_size: int | None = None       # characters of input (or test cases in json)
+    success: bool
+    reason: ResultReason
+    timing: SubmissionTiming | None = None
+    slow_phases: dict[str, float]       # phase -> seconds, of the phases over their thresholds
+    host: str
+    load: list[float]                   # 1, 5 and 15 minutes load average of the host
+    cpus: int | None = None             # cpus of the host
+
+
+class NodeStatus(BaseModel):
+    workers: int
+    busy_workers: int
+    idle_workers: int
+    max_workers: int
+    speed_factor: float = 1.0   # mean of the workers
+
+
+class TenantStatus(BaseModel):
+    queue: int
+    busy_workers: int
+
+
+class ServerStatus(BaseModel):
+    queue: int
+    num_workers: int
+    busy_workers: int
+    idle_workers: int
+    nodes: dict[str, NodeStatus]
+    tenants: dict[str, TenantStatus]
+
+    @classmethod
+    def from_workers(cls, queues: dict[str, int], workers: list[WorkerInfo]):
+        """queues: queue length by tenant"""
+        nodes = {}
+        tenants = {tenant: TenantStatus(queue=queue, busy_workers=0) for tenant, queue in queues.items()}
+        for worker in workers:
+            node = nodes.setdefault(
+                worker.node, NodeStatus(workers=0, busy_workers=0, idle_workers=0, max_workers=worker.max_workers)
+            )
+            node.workers += 1
+            node.busy_workers += worker.state == 'busy'
+            node.idle_workers += worker.state == 'idle'
+            node.max_workers = max(node.max_workers, worker.max_workers)
+            # running mean
+            node.speed_factor += (worker.speed_factor - node.speed_factor) / node.workers
+            if worker.state == 'busy' and worker.tenant:
+                tenants.setdefault(worker.tenant, TenantStatus(queue=0, busy_workers=0)).busy_workers += 1
+        busy_workers = sum(node.busy_workers for node in nodes.values())
+        return cls(
+            queue=sum(queues.values()),
+            num_workers=len(workers),
+            busy_workers=busy_workers,
+            idle_workers=len(workers) - busy_workers,
+            nodes=nodes,
+            tenants=tenants,
         )
 
 
+class ExtendedServerStatus(ServerStatus):
+    workers: list[WorkerInfo]
+
+
 class WorkPayload(BaseModel):
     work_id: str | None = None
     timestamp: float | None = None
+    # absolute time (seconds since epoch) after which nobody is waiting for the result
+    deadline: float | None = None
     long_running: bool = False
+    # only success/reason/cost are needed (the /judge endpoints), so stdout/stderr are not returned
+    verdict_only: bool = False
+    # the work is cancelled if any of them is cancelled (see app/cancellation.py)
+    cancel_ids: list[str] | None = None
+    # when the request arrived (redis clock), cancellations before it are of earlier requests with the same sub_id
+    request_time: float | None = None
+    # fail-fast group (unique in all batches), and whether to kill the work when the group fails while it runs
+    group_id: str | None = None
+    kill_on_group_failure: bool = False
     submission: Submission | BatchSubmission = Field(..., discriminator='type')
 
     def model_post_init(self, __context):
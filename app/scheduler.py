@@ -0,0 +1,89 @@
+import hashlib
+
+import app.config as app_config
+from app.libs.redis_queue import RedisQueue
+from app.model import Submission
+
+
+# used when there is no history for the submission.
+# cpp is more expensive because of compiling.
+DEFAULT_COSTS = {
+    'python': 0.1,
+    'cpp': 1.0,
+}
+
+
+def _hash(*parts: str | None) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update((part or '').encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def cost_history_keys(type: str) -> tuple[str, str]:
+    """The hash of the cost history of the language, and its previous generation (see `RedisQueue.hset_rotating`)"""
+    # the same hash tag, so both are in the same slot of redis cluster
+    key = f'{app_config.REDIS_COST_HISTORY_PREFIX}{{{type}}}'
+    return key, f'{key}:old'
+
+
+def cost_history_field(sub: Submission) -> str | None:
+    """
+    The field of the submission in the history: its problem (options.problem_id if given, otherwise its input).
+    None if it has neither, then it has no history.
+    Solutions of a problem are not told apart, so the history stays as small as the set of problems.
+    """
+    problem_id = sub.options.get('problem_id') if sub.options else None
+    if problem_id:
+        return f'p:{_hash(problem_id)}'
+    if sub.input:
+        return f'i:{_hash(sub.input)}'
+    return None
+
+
+def record_cost(redis_queue: RedisQueue, sub: Submission, cost: float):
+    """Record the observed cost (in seconds) of the submission. Only for sync queue."""
+    field = cost_history_field(sub)
+    if field is None:
+        return
+    redis_queue.hset_rotating(
+        *cost_history_keys(sub.type), field, f'{cost:.4f}',
+        app_config.COST_HISTORY_MAX_SIZE, app_config.REDIS_COST_HISTORY_EXPIRE
+    )
+
+
+async def estimate_costs(redis_queue: RedisQueue, subs: list[Submission]) -> list[float]:
+    """Estimate the costs (in seconds) of the submissions from history. Only for async queue."""
+    fields = [cost_history_field(sub) for sub in subs]
+    # the distinct fields of every language
+    type_fields: dict[str, dict[str, None]] = {}
+    for sub, field in zip(subs, fields):
+        if field is not None:
+            type_fields.setdefault(sub.type, {})[field] = None
+    history: dict[tuple[str, str], float] = {}
+    if type_fields:
+        lookups = [
+            (type, key, list(type_fields[type]))
+            # the previous generation first, so the current one overrides it
+            for type in type_fields for key in reversed(cost_history_keys(type))
+        ]
+        values = await redis_queue.hmget_multi([(key, names) for _, key, names in lookups])
+        for (type, _, names), key_values in zip(lookups, values):
+            for name, value in zip(names, key_values):
+                if value is not None:
+                    history[type, name] = float(value)
+    costs = []
+    for sub, field in zip(subs, fields):
+        cost = history.get((sub.type, field))
+        costs.append(cost if cost is not None else DEFAULT_COSTS.get(sub.type, 0))
+    return costs
+
+
+def longest_first(costs: list[float]) -> list[int]:
+    """
+    Indices ordered by descending cost (LPT).
+    Workers pop the queue in order, so this minimizes the makespan of the batch.
+    The order of submissions with the same cost is kept.
+    """
+    return sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import socket
+
+import app.config as app_config
+from app.libs.redis_queue import RedisQueue
+from app.libs.utils import parse_key_values
+from app.model import SlowLogEntry, Submission, SubmissionResult
+import app.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Like SLOWLOG of redis: one capped redis list of the newest slow submissions (SLOWLOG_MAX_LEN).
+# Checking a result is a few comparisons, and only slow ones cost a redis round trip,
+# so it is cheap enough to leave on.
+
+WORKER_PHASES = ('queue_wait', 'setup', 'execution_wall', 'execution_cpu', 'compare')
+API_PHASES = ('result_pickup', 'total')
+# waiting in the queue is expected for long batches
+LONG_BATCH_SKIPPED_PHASES = ('queue_wait', 'total')
+
+THRESHOLDS: dict[str, float] = parse_key_values(app_config.SLOWLOG_THRESHOLDS, float)
+if unknown := set(THRESHOLDS) - set(WORKER_PHASES) - set(API_PHASES):
+    raise ValueError(f'Unknown phases in SLOWLOG_THRESHOLDS: {", ".join(sorted(unknown))}')
+
+_HOST = socket.gethostname()
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _slow_phases(result: SubmissionResult, phases: tuple[str, ...], long_running: bool) -> dict[str, float]:
+    if result.timing is None:
+        return {}
+    slow_phases = {}
+    for phase in phases:
+        if phase not in THRESHOLDS or (long_running and phase in LONG_BATCH_SKIPPED_PHASES):
+            continue
+        value = getattr(result.timing, phase)
+        if value is not None and value > THRESHOLDS[phase]:
+            slow_phases[phase] = value
+    return slow_phases
+
+
+def _input_size(sub: Submission) -> int | None:
+    if not sub.solution:
+        return None
+    if sub.test_cases is not None:
+        return sum(len(case.model_dump_json()) for case in sub.test_cases)
+    return len(sub.input or '')
+
+
+def _entry(
+    redis_queue: RedisQueue, source: str, work_id: str | None, sub: Submission, result: SubmissionResult,
+    slow_phases: dict[str, float],
+) -> str:
+    return SlowLogEntry(
+        time=redis_queue.now(), source=source, work_id=work_id, sub_id=sub.sub_id, tenant=sub.tenant, type=sub.type,
+        solution_size=len(sub.solution) or None, input_size=_input_size(sub),
+        success=result.success, reason=result.reason, timing=result.timing, slow_phases=slow_phases,
+        host=_HOST, load=list(os.getloadavg()), cpus=os.cpu_count(),
+    ).model_dump_json()
+
+
+def record_sync(
+    redis_queue: RedisQueue, work_id: str | None, sub: Submission, result: SubmissionResult, long_running: bool = False
+):
+    """Record the result if a worker phase is slow. Only for sync queue."""
+    if slow_phases := _slow_phases(result, WORKER_PHASES, long_running):
+        metrics.SLOWLOG_ENTRIES.labels('worker').inc()
+        redis_queue.push_capped(
+            app_config.REDIS_SLOWLOG_KEY, _entry(redis_queue, 'worker', work_id, sub, result, slow_phases),
+            app_config.SLOWLOG_MAX_LEN,
+        )
+
+
+async def _push(redis_queue: RedisQueue, entry_json: str):
+    try:
+        await redis_queue.push_capped(app_config.REDIS_SLOWLOG_KEY, entry_json, app_config.SLOWLOG_MAX_LEN)
+    except Exception:
+        logger.exception('Failed to record a slow submission')
+
+
+def record(
+    redis_queue: RedisQueue, work_id: str | None, sub: Submission, result: SubmissionResult, long_running: bool = False
+):
+    """
+    Record the result if an api phase is slow. Only for async queue.
+    It is pushed in the background, so the response is not delayed.
+    """
+    if slow_phases := _slow_phases(result, API_PHASES, long_running):
+        metrics.SLOWLOG_ENTRIES.labels('api').inc()
+        task = asyncio.ensure_future(_push(redis_queue, _entry(redis_queue, 'api', work_id, sub, result, slow_phases)))
+        # keep a reference until it is done
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def recent(redis_queue: RedisQueue, count: int) -> list[SlowLogEntry]:
+    """The newest entries first. Only for async queue."""
+    entries = await redis_queue.lrange(app_config.REDIS_SLOWLOG_KEY, 0, count - 1)
+    return [SlowLogEntry.model_validate_json(entry) for entry in entries]
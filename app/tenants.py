@@ -0,0 +1,250 @@
+import itertools
+import logging
+import math
+import random
+from time import monotonic, sleep
+
+import app.config as app_config
+from app.libs.redis_queue import RedisQueue
+from app.libs.utils import parse_key_values
+import app.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Every tenant has its own work queue. Work without tenant goes to the original work queue (tenant `default`),
+# so a deployment without tenants works as before.
+# Active tenants are in one redis hash (tenant -> time of the last push), which workers read
+# every TENANT_REFRESH_INTERVAL seconds to know which queues to serve.
+# With WORK_QUEUE_SHARDS > 1 every tenant has a queue in every shard. The queues of a shard share a hash tag
+# (one slot in redis cluster, so they can be popped together), and the shards have different ones.
+
+DEFAULT_TENANT = 'default'
+TENANTS_KEY = f'{app_config.REDIS_TENANT_KEY_PREFIX}s'
+WEIGHTS: dict[str, float] = parse_key_values(app_config.TENANT_WEIGHTS, float)
+MAX_WORKERS: dict[str, int] = parse_key_values(app_config.TENANT_MAX_WORKERS, int)
+
+
+SHARDS = list(range(app_config.WORK_QUEUE_SHARDS))
+
+
+def work_queue_name(tenant: str | None, shard: int = 0) -> str:
+    is_default = not tenant or tenant == DEFAULT_TENANT
+    if shard == 0:
+        return app_config.REDIS_WORK_QUEUE_NAME if is_default else f'{app_config.REDIS_TENANT_KEY_PREFIX}-queue:{tenant}'
+    shard_tag = '{' + f'{app_config.REDIS_WORK_QUEUE_NAME}:shard-{shard}' + '}'
+    return shard_tag if is_default else f'{shard_tag}:tenant-queue:{tenant}'
+
+
+def tenant_of_queue(queue_name: str) -> str:
+    if queue_name == app_config.REDIS_WORK_QUEUE_NAME or queue_name.endswith('}'):
+        return DEFAULT_TENANT
+    return queue_name.rpartition(':')[2]
+
+
+def worker_shards() -> list[int]:
+    """The shards a new worker pops from: WORK_QUEUE_SHARDS_PER_WORKER consecutive shards from a random one"""
+    count = app_config.WORK_QUEUE_SHARDS_PER_WORKER
+    if not count or count >= len(SHARDS):
+        return SHARDS
+    start = random.randrange(len(SHARDS))
+    return [(start + i) % len(SHARDS) for i in range(count)]
+
+
+def _busy_key(tenant: str) -> str:
+    # sorted set of busy worker id -> start time, only for tenants in TENANT_MAX_WORKERS
+    return f'{app_config.REDIS_TENANT_KEY_PREFIX}-busy:{tenant}'
+
+
+# the shards are used in turn by every process, from a random one
+_next_shard = itertools.count(random.randrange(len(SHARDS)))
+# tenant -> last time it is written to the tenants hash by this process
+_tenant_push_times: dict[str, float] = {}
+
+
+async def push_work(redis_queue: RedisQueue, tenant: str | None, *payload_jsons: str) -> str:
+    """Push to the next shard, returns the queue name. Only for async queue."""
+    queue_name = work_queue_name(tenant, SHARDS[next(_next_shard) % len(SHARDS)])
+    if tenant and tenant != DEFAULT_TENANT:
+        # the tenants hash is only refreshed every TENANT_REFRESH_INTERVAL seconds, it is one key for all producers
+        now = redis_queue.now()
+        if now - _tenant_push_times.get(tenant, -math.inf) >= app_config.TENANT_REFRESH_INTERVAL:
+            await redis_queue.hset(TENANTS_KEY, tenant, f'{now:.3f}')
+            _tenant_push_times[tenant] = now
+    await redis_queue.push(queue_name, *payload_jsons)
+    return queue_name
+
+
+def _split_tenants(redis_queue: RedisQueue, entries: dict) -> tuple[list[str], list[str]]:
+    """Returns (active tenants, expired tenants)"""
+    min_last_push = redis_queue.now() - app_config.TENANT_EXPIRE
+    active, expired = [], []
+    for tenant, last_push in entries.items():
+        tenant = tenant.decode() if isinstance(tenant, bytes) else tenant
+        (active if float(last_push) >= min_last_push else expired).append(tenant)
+    return sorted(active), expired
+
+
+def _expired_keys(expired: list[str]) -> list[str]:
+    return [work_queue_name(tenant, shard) for tenant in expired for shard in SHARDS] + [_busy_key(tenant) for tenant in expired]
+
+
+def list_tenants_sync(redis_queue: RedisQueue) -> list[str]:
+    """Tenants (without `default`) with work in TENANT_EXPIRE seconds. Expired ones are removed. Only for sync queue."""
+    active, expired = _split_tenants(redis_queue, redis_queue.hgetall(TENANTS_KEY))
+    if expired:
+        redis_queue.hdel(TENANTS_KEY, *expired)
+        redis_queue.delete(*_expired_keys(expired))
+    return active
+
+
+async def list_tenants(redis_queue: RedisQueue) -> list[str]:
+    """Async version of `list_tenants_sync`. Only for async queue."""
+    active, expired = _split_tenants(redis_queue, await redis_queue.hgetall(TENANTS_KEY))
+    if expired:
+        await redis_queue.hdel(TENANTS_KEY, *expired)
+        await redis_queue.delete(*_expired_keys(expired))
+    return active
+
+
+def _all_queue_names(tenants: list[str]) -> list[str]:
+    return [work_queue_name(tenant, shard) for tenant in tenants for shard in SHARDS]
+
+
+def _sum_shards(tenants: list[str], lengths: list[int]) -> dict[str, int]:
+    return {tenant: sum(lengths[i * len(SHARDS):(i + 1) * len(SHARDS)]) for i, tenant in enumerate(tenants)}
+
+
+def queue_lengths_sync(redis_queue: RedisQueue) -> dict[str, int]:
+    """Work queue length (of all shards) by tenant. Only for sync queue."""
+    tenants = [DEFAULT_TENANT, *list_tenants_sync(redis_queue)]
+    return _sum_shards(tenants, redis_queue.llen_multi(*_all_queue_names(tenants)))
+
+
+async def queue_lengths(redis_queue: RedisQueue) -> dict[str, int]:
+    """Work queue length (of all shards) by tenant. Only for async queue."""
+    tenants = [DEFAULT_TENANT, *await list_tenants(redis_queue)]
+    return _sum_shards(tenants, await redis_queue.llen_multi(*_all_queue_names(tenants)))
+
+
+class FairShareScheduler:
+    """
+    Weighted fair share of worker time between tenants.
+    Every tenant has a virtual time, which grows by cost / weight when a work item of the tenant is done,
+    and the next item is taken from the tenant with the smallest virtual time.
+    A tenant coming back from idle starts from the current virtual time, so it can't save up credit while idle.
+    Every worker schedules on its own. As all workers follow the same rule,
+    the whole cluster shares its time in proportion to the weights.
+    """
+    def __init__(self, weights: dict[str, float], default_weight: float = 1.0):
+        if any(weight <= 0 for weight in [*weights.values(), default_weight]):
+            raise ValueError('tenant weights must be positive')
+        self.weights = weights
+        self.default_weight = default_weight
+        self.virtual_time = 0.0
+        self.tenant_times: dict[str, float] = {}
+
+    def weight(self, tenant: str) -> float:
+        return self.weights.get(tenant, self.default_weight)
+
+    def order(self, tenants: list[str]) -> list[str]:
+        """Tenants in the order to serve them"""
+        for tenant in tenants:
+            self.tenant_times[tenant] = max(self.tenant_times.get(tenant, 0.0), self.virtual_time)
+        for tenant in list(self.tenant_times):
+            if tenant not in tenants:
+                del self.tenant_times[tenant]
+        return sorted(tenants, key=lambda t: self.tenant_times[t])
+
+    def start(self, tenant: str):
+        self.virtual_time = max(self.virtual_time, self.tenant_times.get(tenant, 0.0))
+
+    def finish(self, tenant: str, cost: float):
+        self.tenant_times[tenant] = self.tenant_times.get(tenant, self.virtual_time) + cost / self.weight(tenant)
+
+
+class TenantQueues:
+    """
+    The work queues of all tenants, seen by one worker. Only for sync queue.
+    `pop` returns the next work item by fair share (`FairShareScheduler`) between the tenants
+    that are below their TENANT_MAX_WORKERS.
+    The max workers are checked before popping, so they may be exceeded by a few workers for a moment.
+    With sharded queues, the shards of the worker (`worker_shards`) are tried in turn, starting from the next one
+    every time. The fair share is kept within every shard.
+    """
+    def __init__(self, redis_queue: RedisQueue, worker_id: str, shards: list[int] | None = None):
+        self.redis_queue = redis_queue
+        self.worker_id = worker_id
+        self.shards = shards or worker_shards()
+        self.shard_offset = random.randrange(len(self.shards))
+        self.scheduler = FairShareScheduler(WEIGHTS, app_config.TENANT_DEFAULT_WEIGHT)
+        self.tenants: list[str] = []
+        self.refresh_time = -math.inf
+        self.current: str | None = None  # the tenant of the work item being judged
+
+    def _refresh(self):
+        if monotonic() - self.refresh_time < app_config.TENANT_REFRESH_INTERVAL:
+            return
+        self.tenants = list_tenants_sync(self.redis_queue)
+        self.refresh_time = monotonic()
+
+    def _is_full(self, tenant: str) -> bool:
+        if tenant not in MAX_WORKERS:
+            return False
+        min_start_time = self.redis_queue.now() - app_config.REDIS_WORKER_REGISTER_EXPIRE
+        return self.redis_queue.zcount(_busy_key(tenant), min_start_time, '+inf') >= MAX_WORKERS[tenant]
+
+    def pop(self, timeout: int) -> tuple[str, bytes] | None:
+        """
+        Returns (tenant, payload json), or None if there is no work in `timeout` seconds.
+        The work item must be finished (`finish`) before the next pop.
+        """
+        self._refresh()
+        tenants = [
+            tenant for tenant in self.scheduler.order([DEFAULT_TENANT, *self.tenants])
+            if not self._is_full(tenant)
+        ]
+        if not tenants:
+            sleep(min(timeout, app_config.TENANT_REFRESH_INTERVAL))
+            return None
+        self.shard_offset = (self.shard_offset + 1) % len(self.shards)
+        shards = self.shards[self.shard_offset:] + self.shards[:self.shard_offset]
+        for shard in shards:
+            # the queues of one shard are in one slot, so they can be popped together
+            work_item = self.redis_queue.pop_first(*[work_queue_name(tenant, shard) for tenant in tenants])
+            if work_item:
+                break
+        else:
+            # wait for new work. Check new tenants every TENANT_REFRESH_INTERVAL seconds,
+            # and the other shards every WORK_QUEUE_SHARD_BLOCK_TIMEOUT seconds
+            block_timeout = min(timeout, app_config.TENANT_REFRESH_INTERVAL)
+            if len(shards) > 1:
+                block_timeout = min(block_timeout, app_config.WORK_QUEUE_SHARD_BLOCK_TIMEOUT)
+            work_item = self.redis_queue.block_pop(
+                *[work_queue_name(tenant, shards[0]) for tenant in tenants], timeout=block_timeout
+            )
+            if not work_item:
+                return None
+        queue_name, payload_json = work_item
+        tenant = tenant_of_queue(queue_name.decode() if isinstance(queue_name, bytes) else queue_name)
+        self.start(tenant)
+        return tenant, payload_json
+
+    def start(self, tenant: str):
+        self.scheduler.start(tenant)
+        self.current = tenant
+        if tenant in MAX_WORKERS:
+            self.redis_queue.zadd(_busy_key(tenant), self.worker_id, self.redis_queue.now())
+
+    def finish(self, cost: float):
+        """The current work item is done, and it took `cost` seconds of the worker. No-op if there is none."""
+        if self.current is None:
+            return
+        tenant = self.current
+        self.current = None
+        self.scheduler.finish(tenant, cost)
+        metrics.TENANT_WORK.labels(tenant).inc()
+        metrics.TENANT_WORK_TIME.labels(tenant).inc(cost)
+        if tenant in MAX_WORKERS:
+            self.redis_queue.zrem(_busy_key(tenant), self.worker_id)
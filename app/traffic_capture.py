@@ -0,0 +1,60 @@
+import logging
+import os
+import socket
+
+import app.config as app_config
+from app.libs.recorder import RotatingJsonlWriter, SampledRecorder
+from app.model import Submission, BatchSubmission, SubmissionResult
+
+
+logger = logging.getLogger(__name__)
+
+
+_recorder: SampledRecorder | None = None
+
+
+def _get_recorder() -> SampledRecorder:
+    # one recorder (and its writer thread) per api process
+    global _recorder
+    if _recorder is None or _recorder.pid != os.getpid():
+        writer = RotatingJsonlWriter(
+            app_config.TRAFFIC_CAPTURE_PATH,
+            'traffic',
+            f'{socket.gethostname()}-{os.getpid()}',
+            max_file_size=app_config.TRAFFIC_CAPTURE_MAX_FILE_SIZE * 1024 * 1024,
+            max_total_size=app_config.TRAFFIC_CAPTURE_MAX_TOTAL_SIZE * 1024 * 1024,
+        )
+        _recorder = SampledRecorder(
+            writer,
+            sample_rate=app_config.TRAFFIC_CAPTURE_SAMPLE_RATE,
+            max_queue_size=app_config.TRAFFIC_CAPTURE_QUEUE_SIZE,
+        )
+    return _recorder
+
+
+def capture(
+    endpoint: str,
+    arrival_time: float,
+    request: Submission | BatchSubmission,
+    results: list[SubmissionResult],
+    latency: float,
+):
+    """
+    Sample the request with its results. The whole batch is kept, so the batch shapes can be replayed.
+    Only the verdicts of the results are saved.
+    """
+    if not app_config.TRAFFIC_CAPTURE_PATH:
+        return
+    try:
+        _get_recorder().record(endpoint, lambda: {
+            'time': arrival_time,
+            'endpoint': endpoint,
+            'latency': latency,
+            'request': request.model_dump(exclude_none=True),
+            'results': [
+                {'success': r.success, 'run_success': r.run_success, 'reason': r.reason.value, 'cost': r.cost}
+                for r in results
+            ],
+        })
+    except Exception:
+        logger.exception(f'Failed to capture request to {endpoint}')
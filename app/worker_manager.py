@@ -1,8 +1,11 @@
-from multiprocessing import Process
+from multiprocessing import Process, Event
+from ast import literal_eval
 import logging
+import os
+from math import isclose
+import socket
 import threading
-from time import sleep, time
-from pathlib import Path
+from time import sleep, time, perf_counter
 import json
 from dataclasses import asdict
 import traceback
@@ -10,54 +13,143 @@ import uuid
 import json
 
 import psutil
+import redis
 from pydantic import ValidationError
 
 from app.libs.executors.executor import ProcessExecuteResult
-from app.model import Submission, SubmissionResult, WorkPayload, ResultReason
-from app.libs.executors.python_executor import PythonExecutor, ScriptExecutor
+from app.model import (
+    Submission, SubmissionResult, SubmissionTiming, TestCaseResult, WorkPayload, WorkerInfo, ResultReason
+)
+from app.libs.executors.python_executor import PythonExecutor, PythonFunctionExecutor, ScriptExecutor
 from app.libs.executors.cpp_executor import CppExecutor
-from app.libs.executors.executor import TIMEOUT_EXIT_CODE
+from app.libs.executors.executor import (
+    TIMEOUT_EXIT_CODE, COMPILE_ERROR_EXIT_CODE, OUTPUT_LIMIT_EXIT_CODE, MISMATCH_EXIT_CODE,
+    become_subreaper, kill_stragglers
+)
+from app.libs.comparators import StreamingComparator, compare_text
+from app.libs.recorder import RotatingJsonlWriter, SampledRecorder
+from app.libs.utils import parse_key_values
+from app.libs.cpu_affinity import parse_cpu_list, plan_cpu_sets
 import app.config as app_config
 from app.work_queue import connect_queue
+from app.scheduler import record_cost
+from app.worker_registry import register_worker, unregister_worker
+from app.tenants import TenantQueues, queue_lengths_sync
+from app.cancellation import CancelWatcher, cancel_reason, fail_group
+from app.autoscaler import AutoscaleStats, load_policy
+import app.slowlog as slowlog
+from app.calibration import SpeedCalibrator
+import app.metrics as metrics
 
 
 logger = logging.getLogger(__name__)
 
+# The submission kills itself at its timeout, and the worker kills its whole process group a bit later
+# (if it ignores or blocks the alarm, or a child outlives it).
+HOST_TIMEOUT_MARGIN = 1
+
+
+_error_recorder: SampledRecorder | None = None
+
+
+def _get_error_recorder() -> SampledRecorder:
+    # one recorder (and its writer thread) per worker process
+    global _error_recorder
+    if _error_recorder is None or _error_recorder.pid != os.getpid():
+        writer = RotatingJsonlWriter(
+            app_config.ERROR_CASE_SAVE_PATH,
+            'error-cases',
+            f'{socket.gethostname()}-{os.getpid()}',
+            max_file_size=app_config.ERROR_CASE_MAX_FILE_SIZE * 1024 * 1024,
+            max_total_size=app_config.ERROR_CASE_MAX_TOTAL_SIZE * 1024 * 1024,
+        )
+        _error_recorder = SampledRecorder(
+            writer,
+            sample_rate=app_config.ERROR_CASE_SAMPLE_RATE,
+            quotas=parse_key_values(app_config.ERROR_CASE_QUOTAS),
+            default_quota=app_config.ERROR_CASE_QUOTA or None,
+            quota_window=app_config.ERROR_CASE_QUOTA_WINDOW,
+            max_queue_size=app_config.ERROR_CASE_QUEUE_SIZE,
+        )
+    return _error_recorder
+
+
+def close_error_recorder():
+    if _error_recorder is not None and _error_recorder.pid == os.getpid():
+        _error_recorder.close()
+
+
+def _error_reason(result: ProcessExecuteResult | None, exception: Exception | None) -> str:
+    if exception is not None or result is None:
+        return 'internal_error'
+    if result.exit_code == TIMEOUT_EXIT_CODE:
+        return 'worker_timeout'
+    if result.exit_code == COMPILE_ERROR_EXIT_CODE:
+        return 'compile_error'
+    if result.exit_code == OUTPUT_LIMIT_EXIT_CODE:
+        return 'output_limit'
+    if not result.success and result.exit_code != MISMATCH_EXIT_CODE:
+        return 'runtime_error'
+    return 'wrong_answer'
+
 
 def save_error_case(sub: Submission, result: ProcessExecuteResult | None = None, exception: Exception | None = None):
+    """Queue the error case for the background recorder. Never blocks on the disk."""
     if not app_config.ERROR_CASE_SAVE_PATH:
         return
 
     try:
-        save_path = Path(app_config.ERROR_CASE_SAVE_PATH) / sub.sub_id
-        save_path.mkdir(parents=True, exist_ok=True)
-        with open(save_path / 'submission.json', 'w') as f:
-            f.write(sub.model_dump_json(indent=True))
-        with open(save_path / 'solution.txt', 'w') as f:
-            f.write(sub.solution)
-        if result:
-            with open(save_path / 'result.json', 'w') as f:
-                json.dump(asdict(result), f, indent=True)
-        if exception:
-            with open(save_path / 'exception.txt', 'w') as f:
-                for line in traceback.format_exception(exception):
-                    f.write(line)
+        reason = _error_reason(result, exception)
+        saved = _get_error_recorder().record(reason, lambda: {
+            'time': time(),
+            'reason': reason,
+            'submission': sub.model_dump(),
+            'result': asdict(result) if result else None,
+            'exception': ''.join(traceback.format_exception(exception)) if exception else None,
+        })
+        metrics.ERROR_CASES.labels(reason, str(saved).lower()).inc()
     except Exception:
         logger.exception(f'Failed to save error case for submission {sub.sub_id}')
 
 
-def executor_factory(type: str) -> ScriptExecutor:
-    if type == 'python':
+def executor_factory(
+    type: str, timeout: float, memory_limit: int, entry_point: str | None = None, line_buffered: bool = False
+) -> ScriptExecutor:
+    """
+    timeout is in seconds and memory_limit is in MB. entry_point is for the function-call mode of python.
+    line_buffered: flush stdout at every line, for comparing it while the program runs
+    """
+    if type == 'python' and entry_point:
+        return PythonFunctionExecutor(
+            python_path=app_config.PYTHON_EXECUTOR_PATH,
+            entry_point=entry_point,
+            max_output_length=app_config.MAX_STDOUT_ERROR_LENGTH,
+            timeout=timeout,
+            memory_limit=memory_limit * 1024 * 1024,
+            max_processes=app_config.MAX_PROCESSES,
+            max_output_size=app_config.MAX_OUTPUT_SIZE * 1024 * 1024,
+            spawn_method=app_config.SPAWN_METHOD,
+        )
+    elif type == 'python':
         return PythonExecutor(
             python_path=app_config.PYTHON_EXECUTOR_PATH,
-            timeout=app_config.MAX_EXECUTION_TIME,
-            memory_limit=app_config.MAX_MEMORY * 1024 * 1024,
+            timeout=timeout,
+            memory_limit=memory_limit * 1024 * 1024,
+            max_processes=app_config.MAX_PROCESSES,
+            max_output_size=app_config.MAX_OUTPUT_SIZE * 1024 * 1024,
+            spawn_method=app_config.SPAWN_METHOD,
+            line_buffered=line_buffered,
         )
     elif type == 'cpp':
         return CppExecutor(
             compiler_path=app_config.CPP_COMPILER_PATH,
-            timeout=app_config.MAX_EXECUTION_TIME,
-            memory_limit=app_config.MAX_MEMORY * 1024 * 1024,
+            timeout=timeout,
+            memory_limit=memory_limit * 1024 * 1024,
+            compile_timeout=app_config.MAX_EXECUTION_TIME,
+            max_processes=app_config.MAX_PROCESSES,
+            max_output_size=app_config.MAX_OUTPUT_SIZE * 1024 * 1024,
+            spawn_method=app_config.SPAWN_METHOD,
+            line_buffered=line_buffered,
         )
     else:
         raise ValueError(f'Unsupported type: {type}')
@@ -103,77 +195,213 @@ def compare_output(actual_output, expected_output):
     return False
 
 
-def judge(sub: Submission):
+def judge(sub: Submission, time_budget: float | None = None, verdict_only: bool = False, speed_factor: float = 1.0):
+    """
+    time_budget is the time left before the deadline of the work (None means no deadline)
+    verdict_only: stderr is discarded and stdout/stderr are not returned
+    speed_factor: of this worker (see app/calibration.py), the time limit is scaled by it
+    """
     try:
-        executor = executor_factory(sub.type)
-        result = executor.execute_script(sub.solution, sub.input)
+        time_limit = sub.time_limit / speed_factor
+        timeout = time_limit
+        if time_budget is not None:
+            timeout = min(timeout, time_budget)
+        # compare stdout while the program runs, and kill it at the first mismatch
+        streaming_compare = bool(sub.compare_mode) and sub.expected_output is not None and not sub.entry_point
+        executor = executor_factory(sub.type, timeout, sub.memory_limit, sub.entry_point, line_buffered=streaming_compare)
+        if sub.entry_point:
+            stdin = [case.model_dump(exclude_none=True) for case in sub.test_cases]
+        else:
+            stdin = sub.input
+        stdout_checker = None
+        if streaming_compare:
+            stdout_checker = StreamingComparator(sub.expected_output, sub.compare_mode, executor.stdout_end_mark).feed
+        result = executor.execute_script(
+            sub.solution, stdin, timeout + HOST_TIMEOUT_MARGIN, discard_stderr=verdict_only, stdout_checker=stdout_checker
+        )
+        metrics.SETUP_TIME.labels(sub.type).observe(result.setup_cost)
+        metrics.EXECUTION_TIME.labels(sub.type).observe(result.cost)
 
         success = result.success
         run_success = result.success
-        if sub.expected_output is not None:
+        if result.exit_code == MISMATCH_EXIT_CODE:
+            # a wrong answer, not a failed run
+            run_success = True
+            metrics.MISMATCH_KILLS.labels(sub.type).inc()
+        compare_start = perf_counter()
+        test_results = None
+        if result.test_results is not None:
+            # compared in the submission process
+            test_results = [TestCaseResult(**r) for r in result.test_results]
+            if verdict_only:
+                for test_result in test_results:
+                    test_result.output = None
+            success = success and len(test_results) == len(sub.test_cases) and all(r.passed for r in test_results)
+        elif sub.compare_mode and sub.expected_output is not None:
+            success = success and compare_text(result.stdout, sub.expected_output, sub.compare_mode)
+        elif sub.expected_output is not None:
             actual_output = safe_eval_output(normalize_output(result.stdout))
             expected_output = safe_eval_output(normalize_output(sub.expected_output))
             judge_result = compare_output(actual_output, expected_output)
             success = success and judge_result
+        compare_cost = perf_counter() - compare_start
         if not success:
             save_error_case(sub, result)
         sub_result = SubmissionResult(
-            sub_id=sub.sub_id, success=success, cost=result.cost,
+            sub_id=sub.sub_id, success=success, cost=result.cost, normalized_cost=result.cost * speed_factor,
             run_success=run_success,
             # only save stdout and stderr if expected_output is None
             stdout=result.stdout[:app_config.MAX_STDOUT_ERROR_LENGTH]
-                if result.stdout is not None else None,
+                if result.stdout is not None and not verdict_only else None,
             stderr=result.stderr[:app_config.MAX_STDOUT_ERROR_LENGTH]
-                if result.stdout is not None else None,
+                if result.stdout is not None and not verdict_only else None,
             reason=ResultReason.WORKER_TIMEOUT
                 if result.exit_code == TIMEOUT_EXIT_CODE
-                else ResultReason.UNSPECIFIED
+                else ResultReason.UNSPECIFIED,
+            timing=SubmissionTiming(
+                setup=result.setup_cost,
+                execution_wall=result.wall_cost,
+                execution_cpu=result.cpu_cost,
+                compare=compare_cost,
+            ),
+            test_results=test_results,
         )
+        if not success and timeout < time_limit and result.cost >= timeout:
+            # killed by the deadline of the work, not by the time limit of the submission
+            sub_result.reason = ResultReason.QUEUE_TIMEOUT
     except Exception as e:
         logger.exception(f'Worker failed to judge submission {sub.sub_id}')
         save_error_case(sub, None, e)
         sub_result = SubmissionResult(
             sub_id=sub.sub_id, run_success=False, success=False, cost=0, reason=ResultReason.INTERNAL_ERROR
         )
+    metrics.WORKER_RESULTS.labels(sub.type, metrics.reason_label(sub_result.reason), str(sub_result.success).lower()).inc()
     return sub_result
 
 
+def _bookkeeping(label: str, fn, *args):
+    """Redis bookkeeping after judging. A failure is only logged, so it can't change the result."""
+    try:
+        with metrics.REDIS_TIME.labels(label).time():
+            fn(*args)
+    except Exception as e:
+        logger.warning(f'Failed to {label}: {e}')
+
+
 class Worker(Process):
-    def _run_loop(self):
+    def __init__(self, cpus: set[int] | None = None):
+        """cpus: the cpus the worker and its children are pinned to. None means no pinning."""
+        super().__init__()
+        self.cpus = cpus
+        self.stop_event = Event()
+        self.retire_time = None
+
+    def stop(self):
+        """Stop the worker after the current work item is done"""
+        self.retire_time = time()
+        self.stop_event.set()
+
+    def _run_loop(self, cancel_watcher: CancelWatcher):
         worker_id = str(uuid.uuid4())
+        info = WorkerInfo(
+            worker_id=worker_id, node=socket.gethostname(), pid=os.getpid(),
+            state='idle', last_seen=0, max_workers=app_config.MAX_WORKERS,
+        )
         redis_queue = connect_queue(False)
+        tenant_queues = TenantQueues(redis_queue, worker_id)
+        calibrator = SpeedCalibrator()
         # warm up the connection
-        for _ in range(10):
-            time_offset = redis_queue.time() - time()
+        time_offset = redis_queue.sync_time()
         if abs(time_offset) > 1:
             logger.warning(f'Clock skew detected: {time_offset:.2f} seconds. '
-                           f'This may cause issues with timeouts.'
-                           f'Please make sure MAX_QUEUE_WORK_LIFE_TIME{app_config.MAX_QUEUE_WORK_LIFE_TIME} is large enough.')
-        while True:
-            # register worker id
-            redis_queue.set(
-                f'{app_config.REDIS_WORKER_ID_PREFIX}{worker_id}',
-                1,
-                app_config.REDIS_WORKER_REGISTER_EXPIRE
-            )
-            work_item = redis_queue.block_pop(app_config.REDIS_WORK_QUEUE_NAME, timeout=app_config.REDIS_WORK_QUEUE_BLOCK_TIMEOUT)
+                           f'Timestamps of work use the redis server time, so it is compensated. '
+                           f'But please check the clock of this machine.')
+        while not self.stop_event.is_set():
+            metrics.WORKERS_BUSY.set(0)
+            metrics.WORKERS_IDLE.set(1)
+            # between work items, so it doesn't slow down a submission
+            if calibrator.calibrate_if_due():
+                info.speed_factor = calibrator.speed_factor
+                metrics.SPEED_FACTOR.set(calibrator.speed_factor)
+            # heartbeat
+            info.state, info.work_id, info.tenant = 'idle', None, None
+            with metrics.REDIS_TIME.labels('register_worker').time():
+                register_worker(redis_queue, info)
+            try:
+                work_item = tenant_queues.pop(app_config.REDIS_WORK_QUEUE_BLOCK_TIMEOUT)
+            except redis.exceptions.TimeoutError:
+                logger.warning('Timed out waiting for work. Will retry.')
+                continue
             if not work_item:
                 continue
-            _, payload_json = work_item
+            tenant, payload_json = work_item
+            dequeue_time = redis_queue.now()
+            metrics.WORKERS_BUSY.set(1)
+            metrics.WORKERS_IDLE.set(0)
 
             payload = None
             result = None
             result_queue_name = None
             long_running = False
+            occupied_time = None
             try:
                 payload = WorkPayload.model_validate_json(payload_json)
                 long_running = payload.long_running
+                info.state, info.work_id, info.tenant = 'busy', payload.work_id, tenant
+                with metrics.REDIS_TIME.labels('register_worker').time():
+                    register_worker(redis_queue, info)
                 result_queue_name = f'{app_config.REDIS_RESULT_PREFIX}{payload.work_id}'
-                if not long_running and (lifetime := time() - payload.timestamp) >= app_config.MAX_QUEUE_WORK_LIFE_TIME:
+                lifetime = dequeue_time - payload.timestamp
+                metrics.QUEUE_WAIT_TIME.labels(payload.submission.type).observe(lifetime)
+                if not long_running and lifetime >= app_config.MAX_QUEUE_WORK_LIFE_TIME:
                     logger.warning(f'Work {payload.work_id} lifetime ({lifetime:.2f}>{app_config.MAX_QUEUE_WORK_LIFE_TIME}) timed out. '
                                 f'Ignored. Concurrency is too hight?')
+                    metrics.DROPPED_WORK.labels('lifetime').inc()
+                    continue
+                time_budget = None
+                if payload.deadline is not None and (time_budget := payload.deadline - redis_queue.now()) <= 0:
+                    logger.warning(f'Work {payload.work_id} missed its deadline by {-time_budget:.2f} seconds. '
+                                   f'Ignored. Concurrency is too high?')
+                    metrics.DROPPED_WORK.labels('deadline').inc()
                     continue
-                result = judge(payload.submission)
+                with metrics.REDIS_TIME.labels('check_cancelled').time():
+                    dropped_reason = cancel_reason(
+                        redis_queue, payload.cancel_ids, payload.group_id, payload.request_time or payload.timestamp
+                    )
+                judge_start_time = time()
+                if dropped_reason is None:
+                    cancel_watcher.watch(
+                        payload.cancel_ids, payload.group_id if payload.kill_on_group_failure else None,
+                        payload.request_time or payload.timestamp,
+                    )
+                    try:
+                        result = judge(payload.submission, time_budget, payload.verdict_only, calibrator.speed_factor)
+                    finally:
+                        # charged to the tenant now, not when the next work item is popped (after idle time)
+                        tenant_queues.finish(time() - judge_start_time)
+                        killed_reason = cancel_watcher.unwatch()
+                        # processes which left the process group of the submission
+                        if killed := kill_stragglers():
+                            logger.warning(f'Killed {killed} processes left by work {payload.work_id}.')
+                            metrics.STRAGGLERS_KILLED.inc(killed)
+                    # killed by the watcher. A kill only makes a run fail, so a successful one finished before it
+                    if not result.success:
+                        dropped_reason = killed_reason
+                if dropped_reason is not None:
+                    logger.info(f'Work {payload.work_id} is {dropped_reason.value}.')
+                    metrics.DROPPED_WORK.labels(dropped_reason.value).inc()
+                    # still published, the caller of POST /cancel may be waiting for it
+                    result = SubmissionResult(
+                        sub_id=payload.submission.sub_id, run_success=False, success=False,
+                        cost=time() - judge_start_time, reason=dropped_reason
+                    )
+                elif result.reason not in (ResultReason.INTERNAL_ERROR, ResultReason.QUEUE_TIMEOUT):
+                    # the whole time the worker is occupied (including compiling)
+                    occupied_time = time() - judge_start_time
+                if result.timing is not None:
+                    result.timing.enqueue_time = payload.timestamp
+                    result.timing.dequeue_time = dequeue_time
+                    result.timing.worker_id = worker_id
             except ValidationError:
                 logger.exception(f'Failed to parse payload {payload_json}')
                 try:
@@ -199,6 +427,7 @@ class Worker(Process):
                     continue
             except Exception:
                 logger.exception(f'Worker failed to process work item {payload_json}')
+                occupied_time = None
                 if payload is not None and result_queue_name is not None:
                     long_running = payload.long_running
                     result = SubmissionResult(
@@ -211,49 +440,187 @@ class Worker(Process):
                 else:
                     logger.error(f'Failed to process work item {payload_json}')
                     continue
-
-            redis_queue.push(result_queue_name, result.model_dump_json())
-            redis_queue.expire(
-                result_queue_name,
-                app_config.REDIS_RESULT_EXPIRE
-                    if not long_running
-                    else app_config.REDIS_RESULT_LONG_BATCH_EXPIRE
-            )
+            finally:
+                # work items which are dropped without judging cost the tenant nothing
+                tenant_queues.finish(0)
+
+            if occupied_time is not None:
+                _bookkeeping('record_cost', record_cost, redis_queue, payload.submission, occupied_time)
+                if payload.group_id and not result.success:
+                    _bookkeeping('fail_group', fail_group, redis_queue, payload.group_id)
+            if payload is not None and result.timing is not None:
+                _bookkeeping(
+                    'slowlog', slowlog.record_sync, redis_queue, payload.work_id, payload.submission, result, long_running
+                )
+            if result.timing is not None:
+                result.timing.publish_time = redis_queue.now()
+            with metrics.REDIS_TIME.labels('publish_result').time():
+                redis_queue.push(result_queue_name, result.model_dump_json(exclude_none=True))
+                redis_queue.expire(
+                    result_queue_name,
+                    app_config.REDIS_RESULT_EXPIRE
+                        if not long_running
+                        else app_config.REDIS_RESULT_LONG_BATCH_EXPIRE
+                )
+        unregister_worker(redis_queue, worker_id)
 
     def run(self):
-        while True:
+        if self.cpus:
+            # inherited by the compiler and the submissions
+            os.sched_setaffinity(0, self.cpus)
+        if not become_subreaper():
+            logger.warning('Failed to become the subreaper of submissions. Processes they leave may run until the next check.')
+        # one per process (its thread never stops), kept when the loop is restarted after a failure
+        cancel_watcher = CancelWatcher(connect_queue(False))
+        while not self.stop_event.is_set():
             try:
-                self._run_loop()
+                self._run_loop(cancel_watcher)
             except Exception:
                 logger.exception(f'Worker failed. Will retry in 60 seconds...')
                 sleep(60)
+        close_error_recorder()
 
 
 class WorkerManager:
     def __init__(self):
-        max_workers = app_config.MAX_WORKERS
+        self.min_workers = app_config.MIN_WORKERS
+        self.max_workers = app_config.MAX_WORKERS
         self.workers: list[Worker] = []
-        logger.info(f'Starting {max_workers} workers...')
-        for _ in range(max_workers):
-            worker = Worker()
+        # workers that are stopped by autoscaling, but still finishing their work
+        self.retiring_workers: list[Worker] = []
+        self.cpu_sets: list[set[int]] = []
+        if app_config.CPU_PINNING:
+            self._setup_cpu_pinning()
+        self.policy = load_policy(self.min_workers, self.max_workers) \
+            if self.min_workers < self.max_workers else None
+        self.redis_queue = connect_queue(False) if self.policy else None
+
+        logger.info(f'Starting {self.min_workers} workers...')
+        self._start_workers(self.min_workers)
+        logger.info(f'Started {self.min_workers} workers')
+        if self.policy:
+            logger.info(f'Autoscaling between {self.min_workers} and {self.max_workers} workers')
+            psutil.cpu_percent()  # the first call is meaningless
+        metrics.WORKERS.set(len(self.workers))
+        metrics.WORKERS_DESIRED.set(len(self.workers))
+
+    def _setup_cpu_pinning(self):
+        reserved_cpus = parse_cpu_list(app_config.CPU_PINNING_RESERVED_CPUS)
+        self.cpu_sets = plan_cpu_sets(
+            app_config.CPU_PINNING_CPUS_PER_WORKER,
+            reserved_cpus,
+            bool(app_config.CPU_PINNING_SKIP_SMT),
+        )
+        if not self.cpu_sets:
+            raise ValueError('No cpus left for workers. Please check CPU_PINNING_RESERVED_CPUS.')
+        if len(self.cpu_sets) < self.max_workers:
+            logger.warning(f'Only {len(self.cpu_sets)} cpu sets are available. '
+                           f'Limiting the number of workers to {len(self.cpu_sets)}.')
+            self.max_workers = len(self.cpu_sets)
+            self.min_workers = min(self.min_workers, self.max_workers)
+        allowed_cpus = os.sched_getaffinity(0)
+        if reserved_cpus and set(reserved_cpus) <= allowed_cpus:
+            # keep the worker manager (and the api in debug mode) away from the workers
+            os.sched_setaffinity(0, reserved_cpus)
+        logger.info(f'Pinning workers to cpus: {self.cpu_sets}')
+
+    def _free_cpu_set(self) -> set[int] | None:
+        if not self.cpu_sets:
+            return None
+        used = [worker.cpus for worker in self.workers + self.retiring_workers]
+        # a retiring worker may still be running, so it is possible that no cpu set is free.
+        # Then share the cpu set with the least used one.
+        return min(self.cpu_sets, key=used.count)
+
+    def _start_workers(self, n: int):
+        for _ in range(n):
+            worker = Worker(self._free_cpu_set())
             worker.start()
             self.workers.append(worker)
-        logger.info(f'Started {max_workers} workers')
 
     def run(self):
+        if app_config.METRICS_PORT:
+            metrics.start_metrics_server(app_config.METRICS_PORT)
+        check_interval = 30
+        interval = app_config.AUTOSCALE_INTERVAL if self.policy else check_interval
+        last_check_time = 0
         while True:
-            try:
-                logger.info('Checking workers...')
-                self._check_workers()
-            except Exception as e:
-                logger.exception(f'Check worker failed. Will retry in 60 seconds...')
-            sleep(30)
+            if time() - last_check_time >= check_interval:
+                last_check_time = time()
+                try:
+                    logger.info('Checking workers...')
+                    self._check_workers()
+                except Exception as e:
+                    logger.exception(f'Check worker failed. Will retry in {check_interval} seconds...')
+            if self.policy:
+                try:
+                    self._autoscale()
+                except Exception:
+                    logger.exception(f'Autoscale failed. Will retry in {interval} seconds...')
+            sleep(interval)
 
     def run_background(self):
         self._check_thread = threading.Thread(target=self.run, name='worker-checker')
         self._check_thread.daemon = True
         self._check_thread.start()
 
+    @staticmethod
+    def _is_busy(worker: Worker) -> bool:
+        try:
+            return bool(psutil.Process(worker.pid).children())
+        except psutil.NoSuchProcess:
+            return False
+
+    def _autoscale(self):
+        self._reap_retiring_workers()
+        busy_workers = [worker for worker in self.workers if self._is_busy(worker)]
+        stats = AutoscaleStats(
+            workers=len(self.workers),
+            busy_workers=len(busy_workers),
+            queue_length=sum(queue_lengths_sync(self.redis_queue).values()),
+            cpu_count=psutil.cpu_count(),
+            cpu_percent=psutil.cpu_percent(),
+            memory_percent=psutil.virtual_memory().percent,
+        )
+        metrics.WORKERS_BUSY_SAMPLED.set(stats.busy_workers)
+        metrics.HOST_CPU_PERCENT.set(stats.cpu_percent)
+        metrics.HOST_MEMORY_PERCENT.set(stats.memory_percent)
+
+        desired, reason = self.policy.decide(stats, time())
+        metrics.WORKERS_DESIRED.set(desired)
+        if desired == stats.workers:
+            return
+
+        logger.info(f'Autoscaling from {stats.workers} to {desired} workers ({reason}). '
+                    f'queue: {stats.queue_length}, busy: {stats.busy_workers}, '
+                    f'cpu: {stats.cpu_percent:.1f}%, memory: {stats.memory_percent:.1f}%')
+        if desired > stats.workers:
+            metrics.AUTOSCALE_EVENTS.labels('up', reason).inc()
+            self._start_workers(desired - stats.workers)
+        else:
+            metrics.AUTOSCALE_EVENTS.labels('down', reason).inc()
+            # prefer stopping idle workers
+            busy_pids = {worker.pid for worker in busy_workers}
+            candidates = sorted(self.workers, key=lambda w: w.pid in busy_pids)
+            for worker in candidates[:stats.workers - desired]:
+                worker.stop()
+                self.workers.remove(worker)
+                self.retiring_workers.append(worker)
+        metrics.WORKERS.set(len(self.workers))
+
+    def _reap_retiring_workers(self):
+        # a retiring worker may wait for the work queue for REDIS_WORK_QUEUE_BLOCK_TIMEOUT,
+        # and then finish its current work in MAX_QUEUE_WAIT_TIME
+        max_retiring_time = app_config.REDIS_WORK_QUEUE_BLOCK_TIMEOUT + app_config.MAX_QUEUE_WAIT_TIME
+        for worker in list(self.retiring_workers):
+            if not worker.is_alive():
+                worker.join()
+                metrics.mark_process_dead(worker.pid)
+                self.retiring_workers.remove(worker)
+            elif time() - worker.retire_time > max_retiring_time:
+                logger.warning(f'Worker {worker.pid} is not stopped in {max_retiring_time} seconds. Killing...')
+                worker.kill()
+
     def _check_workers(self):
         failed_workers = 0
         busy_workers = 0
@@ -261,7 +628,8 @@ class WorkerManager:
         for i, worker in enumerate(self.workers):
             if not worker.is_alive():
                 logger.error('Worker dead. Restarting...')
-                worker = Worker()
+                metrics.mark_process_dead(worker.pid)
+                worker = Worker(worker.cpus)
                 worker.start()
                 self.workers[i] = worker
                 failed_workers += 1
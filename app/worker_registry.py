@@ -0,0 +1,50 @@
+import logging
+
+from pydantic import ValidationError
+
+import app.config as app_config
+from app.libs.redis_queue import RedisQueue
+from app.model import WorkerInfo
+
+
+logger = logging.getLogger(__name__)
+
+
+# All workers are in one redis hash, so the status is one HGETALL (O(workers))
+# instead of a SCAN over the whole keyspace.
+
+
+def register_worker(redis_queue: RedisQueue, info: WorkerInfo):
+    """Add or refresh the worker (heartbeat). Only for sync queue."""
+    info.last_seen = redis_queue.now()
+    redis_queue.hset(app_config.REDIS_WORKER_REGISTRY_KEY, info.worker_id, info.model_dump_json())
+
+
+def unregister_worker(redis_queue: RedisQueue, worker_id: str):
+    """Only for sync queue."""
+    redis_queue.hdel(app_config.REDIS_WORKER_REGISTRY_KEY, worker_id)
+
+
+async def list_workers(redis_queue: RedisQueue) -> list[WorkerInfo]:
+    """
+    Alive workers. Workers without heartbeat in REDIS_WORKER_REGISTER_EXPIRE seconds
+    (for example killed ones) are removed from the registry. Only for async queue.
+    """
+    entries = await redis_queue.hgetall(app_config.REDIS_WORKER_REGISTRY_KEY)
+    min_last_seen = redis_queue.now() - app_config.REDIS_WORKER_REGISTER_EXPIRE
+    workers = []
+    stale = []
+    for worker_id, info_json in entries.items():
+        try:
+            info = WorkerInfo.model_validate_json(info_json)
+        except ValidationError:
+            logger.warning(f'Invalid worker info {info_json}. Removed.')
+            stale.append(worker_id)
+            continue
+        if info.last_seen < min_last_seen:
+            stale.append(worker_id)
+        else:
+            workers.append(info)
+    if stale:
+        await redis_queue.hdel(app_config.REDIS_WORKER_REGISTRY_KEY, *stale)
+    return workers
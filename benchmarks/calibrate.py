@@ -0,0 +1,45 @@
+# The speed calibration benchmark of workers (app/calibration.py), to set SPEED_CALIBRATION_REFERENCE.
+#
+#   python benchmarks/calibrate.py                      # on the reference node: prints its cpu time of the benchmark
+#   python benchmarks/calibrate.py --reference 0.0612   # on another node: prints its speed factor
+#
+# Run it on an idle node, and pinned like the workers if they are pinned (taskset -c 3 python ...).
+# Workers take the fastest of BENCHMARK_ROUNDS runs, this takes the median of `--runs` such measurements
+# to show how stable it is.
+
+import os
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.calibration import benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--reference', type=float, default=0, help='SPEED_CALIBRATION_REFERENCE, to print the speed factor')
+    args = parser.parse_args()
+
+    costs = [benchmark() for _ in range(args.runs)]
+    report = {
+        'host': platform.node(),
+        'cpu': platform.processor() or platform.machine(),
+        'median': statistics.median(costs),
+        'min': min(costs),
+        'max': max(costs),
+    }
+    if args.reference:
+        report['speed_factor'] = args.reference / report['median']
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
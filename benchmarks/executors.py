@@ -0,0 +1,161 @@
+# Fixed per-submission cost of the executors and of the output comparison, without redis.
+#
+#   python benchmarks/executors.py --runs 30
+#   python benchmarks/executors.py --only python,compare -o executors.json
+#
+# python: writing the script, interpreter start-up, PRE/POST template and the submission itself
+#   (`overhead` = wall time - the time reported by the template, `template` = wall time - bare interpreter)
+# cpp: writing the files + g++ (setup), running the binary
+# compare: normalize_output / safe_eval_output / compare_output for several output sizes
+#
+# Every stage is repeated `--runs` times and reported as mean/stdev/min/p50/p99/max in seconds.
+
+import os
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.config as app_config
+from app.libs.executors.executor import ProcessExecutor
+from app.libs.executors.python_executor import PythonExecutor
+from app.libs.executors.cpp_executor import CppExecutor
+from app.worker_manager import normalize_output, safe_eval_output, compare_output
+
+
+PYTHON_EMPTY = 'pass'
+
+CPP_EMPTY = 'int main() { return 0; }'
+
+CPP_IOSTREAM = """
+#include <iostream>
+int main() { std::cout << 1; return 0; }
+"""
+
+COMPARE_SIZES = (10, 1_000, 100_000, 1_000_000)
+
+
+def _summary(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        'runs': len(values),
+        'mean': statistics.fmean(values),
+        'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+        'min': values[0],
+        'p50': values[len(values) // 2],
+        'p99': values[min(len(values) - 1, int(len(values) * 0.99))],
+        'max': values[-1],
+    }
+
+
+def bench_python(args) -> dict:
+    executor = PythonExecutor(app_config.PYTHON_EXECUTOR_PATH, timeout=app_config.MAX_EXECUTION_TIME, memory_limit=app_config.MAX_MEMORY * 1024 * 1024)
+    bare = ProcessExecutor()
+    stages = {'bare_interpreter': [], 'setup': [], 'wall': [], 'cpu': [], 'script': [], 'overhead': [], 'template': []}
+    for _ in range(args.warmup + args.runs):
+        bare_result = bare.execute({'args': [app_config.PYTHON_EXECUTOR_PATH, '-c', 'pass']})
+        result = executor.execute_script(PYTHON_EMPTY)
+        assert result.success, result.stderr
+        stages['bare_interpreter'].append(bare_result.wall_cost)
+        stages['setup'].append(result.setup_cost)
+        stages['wall'].append(result.wall_cost)
+        stages['cpu'].append(result.cpu_cost)
+        stages['script'].append(result.cost)
+        stages['overhead'].append(result.wall_cost - result.cost)
+        stages['template'].append(result.wall_cost - bare_result.wall_cost)
+    return {stage: _summary(values[args.warmup:]) for stage, values in stages.items()}
+
+
+def bench_cpp(args) -> dict:
+    executor = CppExecutor(app_config.CPP_COMPILER_PATH, timeout=app_config.MAX_EXECUTION_TIME, memory_limit=app_config.MAX_MEMORY * 1024 * 1024)
+    report = {}
+    for name, solution in (('empty', CPP_EMPTY), ('iostream', CPP_IOSTREAM)):
+        stages = {'setup': [], 'wall': [], 'cpu': []}
+        for _ in range(args.warmup + args.runs):
+            result = executor.execute_script(solution)
+            assert result.success, result.stderr
+            stages['setup'].append(result.setup_cost)
+            stages['wall'].append(result.wall_cost)
+            stages['cpu'].append(result.cpu_cost)
+        report[name] = {stage: _summary(values[args.warmup:]) for stage, values in stages.items()}
+    return report
+
+
+def _outputs(size: int) -> dict[str, str]:
+    """Typical outputs of `size` characters"""
+    number_list = repr(list(range(size // 7 + 1)))[:size].rsplit(',', 1)[0] + ']'
+    return {
+        'scalar': '9' * min(size, 4000),  # int() refuses longer numbers
+        'float_list': repr([i / 3 for i in range(size // 20 + 1)]),
+        'int_list': number_list,
+        'lines': '\n'.join(f'line {i}  ' for i in range(size // 10 + 1)),
+    }
+
+
+def _time(func, runs: int) -> list[float]:
+    costs = []
+    for _ in range(runs):
+        start = perf_counter()
+        func()
+        costs.append(perf_counter() - start)
+    return costs
+
+
+def bench_compare(args) -> dict:
+    report = {}
+    for size in COMPARE_SIZES:
+        for kind, output in _outputs(size).items():
+            normalized = normalize_output(output)
+            evaluated = safe_eval_output(normalized)
+            expected = safe_eval_output(normalize_output(output + '\n'))
+            report[f'{kind}_{size}'] = {
+                'chars': len(output),
+                'normalize_output': _summary(_time(lambda: normalize_output(output), args.runs)),
+                'safe_eval_output': _summary(_time(lambda: safe_eval_output(normalized), args.runs)),
+                'compare_output': _summary(_time(lambda: compare_output(evaluated, expected), args.runs)),
+            }
+    return report
+
+
+BENCHMARKS = {
+    'python': bench_python,
+    'cpp': bench_cpp,
+    'compare': bench_compare,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage cost of the executors and the output comparison')
+    parser.add_argument('--runs', type=int, default=20, help='repetitions of every stage')
+    parser.add_argument('--warmup', type=int, default=2, help='runs not reported (page cache, compiler start-up)')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f'comma separated, available: {",".join(BENCHMARKS)}')
+    parser.add_argument('-o', '--output', help='also save the report to this file')
+    args = parser.parse_args()
+
+    names = args.only.split(',')
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+
+    report = {
+        'python_version': platform.python_version(),
+        'python_executor': app_config.PYTHON_EXECUTOR_PATH,
+        'cpp_compiler': app_config.CPP_COMPILER_PATH,
+        'runs': args.runs,
+        **{name: BENCHMARKS[name](args) for name in names},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
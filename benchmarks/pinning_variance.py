@@ -0,0 +1,141 @@
+# Variance of the reported cost with and without cpu pinning.
+#
+# Runs the same cpu bound submission in parallel "workers" (with an optional background load),
+# once with free migrating processes and once with every worker pinned to its own cpu set,
+# and prints a json report with the spread of the costs for both modes.
+#
+#   python benchmarks/pinning_variance.py --workers 8 --runs 20 --noise 4 --reserved 0
+#
+# No redis is needed.
+
+import os
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.config as app_config
+from app.libs.cpu_affinity import parse_cpu_list, plan_cpu_sets
+from app.libs.executors.python_executor import PythonExecutor
+from app.libs.executors.cpp_executor import CppExecutor
+
+
+PYTHON_SOLUTION = """
+s = 0
+for i in range({loops}):
+    s += i * i % 7
+print(s)
+"""
+
+CPP_SOLUTION = """
+#include <cstdio>
+int main() {{
+    volatile long long s = 0;
+    for (long long i = 0; i < {loops}LL; i++) s += i * i % 7;
+    printf("%lld", (long long)s);
+    return 0;
+}}
+"""
+
+
+def _busy_loop():
+    while True:
+        pass
+
+
+def _run_worker(language: str, loops: int, runs: int, cpus: set[int] | None, results):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    if language == 'python':
+        executor = PythonExecutor(app_config.PYTHON_EXECUTOR_PATH, timeout=60, memory_limit=app_config.MAX_MEMORY * 1024 * 1024)
+        solution = PYTHON_SOLUTION.format(loops=loops)
+    else:
+        executor = CppExecutor(app_config.CPP_COMPILER_PATH, timeout=60, memory_limit=app_config.MAX_MEMORY * 1024 * 1024)
+        solution = CPP_SOLUTION.format(loops=loops)
+    costs = []
+    for _ in range(runs):
+        result = executor.execute_script(solution)
+        if result.success:
+            costs.append(result.cost)
+    results.put(costs)
+
+
+def _summary(costs: list[float]) -> dict:
+    costs = sorted(costs)
+    mean = statistics.fmean(costs)
+    stdev = statistics.stdev(costs) if len(costs) > 1 else 0.0
+    return {
+        'runs': len(costs),
+        'mean': mean,
+        'stdev': stdev,
+        'cv': stdev / mean if mean else 0.0,
+        'min': costs[0],
+        'p50': costs[len(costs) // 2],
+        'p99': costs[min(len(costs) - 1, int(len(costs) * 0.99))],
+        'max': costs[-1],
+    }
+
+
+def measure(args, cpu_sets: list[set[int]] | None) -> dict:
+    noise = [multiprocessing.Process(target=_busy_loop, daemon=True) for _ in range(args.noise)]
+    for p in noise:
+        p.start()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_run_worker,
+            args=(args.language, args.loops, args.runs, cpu_sets[i] if cpu_sets else None, results),
+        )
+        for i in range(args.workers)
+    ]
+    try:
+        for p in workers:
+            p.start()
+        costs = [cost for _ in workers for cost in results.get()]
+        for p in workers:
+            p.join()
+    finally:
+        for p in noise:
+            p.kill()
+    return _summary(costs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Variance of the cost with and without cpu pinning')
+    parser.add_argument('--language', choices=['python', 'cpp'], default='python')
+    parser.add_argument('--loops', type=int, default=2_000_000, help='size of the cpu bound loop')
+    parser.add_argument('--workers', type=int, default=0, help='default: one per cpu set')
+    parser.add_argument('--runs', type=int, default=20, help='runs per worker')
+    parser.add_argument('--noise', type=int, default=0, help='number of unpinned busy loop processes')
+    parser.add_argument('--cpus-per-worker', type=int, default=app_config.CPU_PINNING_CPUS_PER_WORKER)
+    parser.add_argument('--reserved', default=app_config.CPU_PINNING_RESERVED_CPUS, help='reserved cpus, like 0-1')
+    parser.add_argument('--keep-smt', action='store_true', help='use SMT siblings too')
+    args = parser.parse_args()
+
+    cpu_sets = plan_cpu_sets(args.cpus_per_worker, parse_cpu_list(args.reserved), not args.keep_smt)
+    if not cpu_sets:
+        parser.error('no cpus left for workers')
+    args.workers = args.workers or len(cpu_sets)
+    if args.workers > len(cpu_sets):
+        parser.error(f'only {len(cpu_sets)} cpu sets are available')
+
+    report = {
+        'language': args.language,
+        'loops': args.loops,
+        'workers': args.workers,
+        'noise': args.noise,
+        'cpu_sets': [sorted(s) for s in cpu_sets[:args.workers]],
+        'unpinned': measure(args, None),
+        'pinned': measure(args, cpu_sets),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# Replay traffic captured by the api (TRAFFIC_CAPTURE_PATH) against a deployment.
+#
+#   python benchmarks/replay.py /data/traffic -H http://localhost:8000               # the original pace
+#   python benchmarks/replay.py /data/traffic -H http://localhost:8000 --speed 4     # 4 times faster
+#   python benchmarks/replay.py /data/traffic -H http://localhost:8000 --speed 0     # as fast as possible
+#
+# Requests are sent with the same endpoints, bodies and relative arrival times (divided by --speed),
+# and a json report compares the replay with the capture:
+# throughput, latency per endpoint, and the submissions whose verdict (success/run_success/reason) changed.
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import sleep, perf_counter
+
+import requests
+
+
+def load_traffic(paths: list[str], limit: int) -> list[dict]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('traffic-*.jsonl')) if path.is_dir() else [path])
+    records = []
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:  # the last line of a file being written
+                    pass
+    records.sort(key=lambda r: r['time'])
+    return records[:limit] if limit else records
+
+
+def _stats(values: list[float]) -> dict | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': statistics.fmean(values),
+        'p50': values[len(values) // 2],
+        'p99': values[min(len(values) - 1, int(len(values) * 0.99))],
+        'max': values[-1],
+    }
+
+
+def _verdict(result: dict) -> tuple:
+    return result['success'], result['run_success'], result['reason'] or ''
+
+
+def replay(records: list[dict], args) -> list[tuple[float, list[dict] | None]]:
+    """Returns (latency, results) of every record. results is None if the request failed."""
+    local = threading.local()
+
+    def _send(record):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = perf_counter()
+        try:
+            response = local.session.post(f'{args.host}{record["endpoint"]}', json=record['request'], timeout=args.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f'Request to {record["endpoint"]} failed: {e!r}', file=sys.stderr)
+            return perf_counter() - start, None
+        return perf_counter() - start, data['results'] if 'results' in data else [data]
+
+    with ThreadPoolExecutor(args.max_in_flight) as pool:
+        futures = []
+        start = perf_counter()
+        t0 = records[0]['time']
+        for record in records:
+            if args.speed > 0:
+                delay = (record['time'] - t0) / args.speed - (perf_counter() - start)
+                if delay > 0:
+                    sleep(delay)
+            futures.append(pool.submit(_send, record))
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured traffic and compare with the capture')
+    parser.add_argument('paths', nargs='+', help='traffic-*.jsonl files or directories of them')
+    parser.add_argument('-H', '--host', required=True)
+    parser.add_argument('--speed', type=float, default=1, help='1: the original pace, N: N times faster, 0: as fast as possible')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='max concurrent requests')
+    parser.add_argument('--limit', type=int, default=0, help='replay only the first N requests')
+    parser.add_argument('--timeout', type=float, default=3600, help='timeout of every request')
+    parser.add_argument('--examples', type=int, default=10, help='number of mismatches to show')
+    parser.add_argument('-o', '--output', help='also save the report to this file')
+    args = parser.parse_args()
+
+    records = load_traffic(args.paths, args.limit)
+    if not records:
+        parser.error('no traffic found')
+
+    start = perf_counter()
+    replayed = replay(records, args)
+    duration = perf_counter() - start
+
+    captured_duration = records[-1]['time'] + records[-1]['latency'] - records[0]['time']
+    latency = {}
+    mismatches = Counter()
+    examples = []
+    submissions = 0
+    failed = 0
+    for record, (replay_latency, results) in zip(records, replayed):
+        submissions += len(record['results'])
+        endpoint = latency.setdefault(record['endpoint'], {'captured': [], 'replayed': []})
+        endpoint['captured'].append(record['latency'])
+        if results is None:
+            failed += 1
+            continue
+        endpoint['replayed'].append(replay_latency)
+        subs = record['request'].get('submissions') or [record['request']]
+        for sub, expected, actual in zip(subs, record['results'], results):
+            if _verdict(expected) != _verdict(actual):
+                kind = f'{expected["reason"] or "none"}->{actual["reason"] or "none"}' \
+                    if expected['reason'] != actual['reason'] else f'success:{expected["success"]}->{actual["success"]}'
+                mismatches[kind] += 1
+                if len(examples) < args.examples:
+                    examples.append({
+                        'endpoint': record['endpoint'],
+                        'sub_id': sub.get('sub_id'),
+                        'captured': expected,
+                        'replayed': {k: actual.get(k) for k in ('success', 'run_success', 'reason', 'cost')},
+                    })
+
+    report = {
+        'requests': len(records),
+        'submissions': submissions,
+        'failed_requests': failed,
+        'speed': args.speed,
+        'captured': {
+            'duration': captured_duration,
+            'submissions_per_second': submissions / captured_duration if captured_duration > 0 else None,
+        },
+        'replayed': {
+            'duration': duration,
+            'submissions_per_second': submissions / duration,
+        },
+        'latency': {
+            endpoint: {kind: _stats(values) for kind, values in values_by_kind.items()}
+            for endpoint, values_by_kind in latency.items()
+        },
+        'mismatches': sum(mismatches.values()),
+        'mismatches_by_kind': dict(mismatches),
+        'mismatch_examples': examples,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
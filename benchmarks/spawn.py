@@ -0,0 +1,108 @@
+# Spawns per second of the executors' spawn methods (SPAWN_METHOD), from a process with a big heap like a worker.
+#
+#   python benchmarks/spawn.py --runs 500
+#   python benchmarks/spawn.py --heap-mb 0,512,2048 -o spawn.json
+#
+# fork: Popen forced to fork (with a preexec_fn), what a worker pays when vfork can't be used
+# subprocess: Popen (vfork + exec in CPython >= 3.10)
+# posix_spawn: os.posix_spawn (see SpawnedProcess in app/libs/executors/executor.py)
+#
+# Every run is a full ProcessExecutor.execute of `--command` (default /bin/true), including pipes and killing its process group.
+# spawns_per_second is by wall time, spawns_per_cpu_second by the cpu time of this process and its children.
+
+import os
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.libs.executors.executor import ProcessExecutor
+
+
+class ForkExecutor(ProcessExecutor):
+    def _spawn(self, args, pipe_stdin, discard_stderr):
+        return subprocess.Popen(
+            args, shell=False, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL if discard_stderr else subprocess.PIPE,
+            stdin=subprocess.PIPE if pipe_stdin else subprocess.DEVNULL, start_new_session=True,
+            preexec_fn=lambda: None,  # CPython doesn't use vfork with a preexec_fn
+        )
+
+
+def _executor(method: str) -> ProcessExecutor:
+    if method == 'fork':
+        return ForkExecutor()
+    executor = ProcessExecutor()
+    executor.spawn_method = method
+    return executor
+
+
+METHODS = ('fork', 'subprocess', 'posix_spawn')
+
+
+def _cpu_time() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def bench(method: str, args) -> dict:
+    executor = _executor(method)
+    config = {'args': args.command.split()}
+    for _ in range(args.warmup):
+        executor.execute(config)
+    cpu_start = _cpu_time()
+    start = perf_counter()
+    for _ in range(args.runs):
+        result = executor.execute(config)
+        assert result.success, result.stderr
+    wall = perf_counter() - start
+    cpu = _cpu_time() - cpu_start
+    return {
+        'spawns_per_second': args.runs / wall,
+        'spawns_per_cpu_second': args.runs / cpu if cpu > 0 else None,
+        'mean_wall': wall / args.runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spawns per second of the spawn methods')
+    parser.add_argument('--runs', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--heap-mb', default='0,1024', help='comma separated sizes of the heap (touched) before spawning')
+    parser.add_argument('--methods', default=','.join(METHODS), help=f'comma separated, available: {",".join(METHODS)}')
+    parser.add_argument('--command', default='/bin/true')
+    parser.add_argument('-o', '--output', help='also save the report to this file')
+    args = parser.parse_args()
+
+    methods = args.methods.split(',')
+    for method in methods:
+        if method not in METHODS:
+            parser.error(f'unknown method {method}')
+
+    report = {
+        'python_version': platform.python_version(),
+        'command': args.command,
+        'runs': args.runs,
+        'heap': {},
+    }
+    heap = []
+    for heap_mb in map(int, args.heap_mb.split(',')):
+        # the pages are written, so they are really in the rss
+        heap.append(b'\x01' * max(0, heap_mb * 1024 * 1024 - sum(map(len, heap))))
+        report['heap'][f'{heap_mb}MB'] = {method: bench(method, args) for method in methods}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+# Throughput and latency of the whole stack (api + redis + workers) with fixed workload profiles.
+#
+# Starts a private redis (the redis-server shipped with redislite by default), the api and N workers,
+# replays the profiles and prints a json report (or saves it with -o):
+#   python benchmarks/throughput.py run --workers 4 -o before.json
+#   python benchmarks/throughput.py run --workers 4 --profiles tiny_python,cpp_compile --requests 100
+# Against an already running stack (the workers are not started then):
+#   python benchmarks/throughput.py run -H http://localhost:8000
+# Compare two reports (for example of two commits):
+#   python benchmarks/throughput.py compare before.json after.json
+#
+# Latency is measured by the client. The per-phase breakdown comes from `SubmissionResult.timing`,
+# so the /run endpoints are used.
+
+import os
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import sleep, time, perf_counter
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.model import BatchTiming, SubmissionResult, TimingStats
+
+
+TINY_PYTHON = 'print(input())'
+
+CPP_COMPILE = """
+#include <algorithm>
+#include <iostream>
+#include <map>
+#include <string>
+#include <vector>
+using namespace std;
+int main() {{
+    map<string, vector<int>> m;
+    m["a"].push_back({i});
+    cout << m["a"][0];
+    return 0;
+}}
+"""
+
+LARGE_IO = """
+import sys
+data = sys.stdin.read()
+sys.stdout.write(data)
+"""
+
+TIMEOUT = 'while True: pass'
+
+
+def tiny_python(i: int, rng: random.Random, args) -> dict:
+    return {'type': 'python', 'solution': TINY_PYTHON, 'input': str(i), 'expected_output': str(i)}
+
+
+def cpp_compile(i: int, rng: random.Random, args) -> dict:
+    return {'type': 'cpp', 'solution': CPP_COMPILE.format(i=i), 'expected_output': str(i)}
+
+
+def large_io(i: int, rng: random.Random, args) -> dict:
+    line = f'{i} ' * 16 + '\n'
+    data = line * max(1, args.io_size // len(line))
+    return {'type': 'python', 'solution': LARGE_IO, 'input': data, 'expected_output': data}
+
+
+def timeout(i: int, rng: random.Random, args) -> dict:
+    return {
+        'type': 'python', 'solution': TIMEOUT, 'expected_output': '',
+        'options': {'time_limit': str(args.time_limit)},
+    }
+
+
+def mixed(i: int, rng: random.Random, args) -> dict:
+    make = rng.choices([tiny_python, cpp_compile, large_io, timeout], weights=[70, 20, 8, 2])[0]
+    return make(i, rng, args)
+
+
+@dataclass
+class Profile:
+    make_submission: Callable[[int, random.Random, argparse.Namespace], dict]
+    batch_sizes: tuple[int, ...] = ()   # empty: single submissions to /run
+
+
+PROFILES = {
+    'tiny_python': Profile(tiny_python),
+    'cpp_compile': Profile(cpp_compile),
+    'large_io': Profile(large_io),
+    'timeout': Profile(timeout),
+    'mixed_batch': Profile(mixed, batch_sizes=(1, 4, 16, 64)),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _default_redis_server() -> str | None:
+    try:
+        import redislite
+        return redislite.__redis_executable__
+    except ImportError:
+        return shutil.which('redis-server')
+
+
+class Stack:
+    """redis + api + workers in their own process groups, logs go to `log_dir`"""
+    def __init__(self, workers: int, redis_server: str, log_dir: str):
+        self.workers = workers
+        self.redis_server = redis_server
+        self.log_dir = log_dir
+        self.processes: list[subprocess.Popen] = []
+        self.host = None
+
+    def _start(self, name: str, cmd: list[str], env: dict):
+        log = open(os.path.join(self.log_dir, f'{name}.log'), 'wb')
+        self.processes.append(subprocess.Popen(
+            cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+        ))
+
+    def _wait(self, check: Callable[[], bool], what: str, timeout: float = 60):
+        deadline = time() + timeout
+        while time() < deadline:
+            try:
+                if check():
+                    return
+            except Exception:
+                pass
+            sleep(0.2)
+        raise RuntimeError(f'{what} is not ready in {timeout} seconds. See logs in {self.log_dir}')
+
+    def __enter__(self):
+        import redis
+        import requests
+
+        redis_port, api_port = _free_port(), _free_port()
+        self._start('redis', [self.redis_server, '--port', str(redis_port), '--save', '', '--appendonly', 'no'], os.environ.copy())
+        self._wait(lambda: redis.Redis(port=redis_port).ping(), 'redis')
+
+        env = {
+            **os.environ,
+            'REDIS_URI': f'redis://127.0.0.1:{redis_port}/0',
+            'RUN_WORKERS': '0',
+            'MAX_WORKERS': str(self.workers),
+            'MIN_WORKERS': str(self.workers),
+        }
+        self._start('workers', [sys.executable, 'run_workers.py'], env)
+        self._start('api', [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(api_port), '--log-level', 'warning'], env)
+        self.host = f'http://127.0.0.1:{api_port}'
+        self._wait(lambda: requests.get(f'{self.host}/status').json()['num_workers'] >= self.workers, 'workers')
+        return self
+
+    def __exit__(self, *_):
+        for p in reversed(self.processes):
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for p in reversed(self.processes):
+            try:
+                p.wait(10)
+            except subprocess.TimeoutExpired:
+                os.killpg(p.pid, signal.SIGKILL)
+                p.wait()
+
+
+def _stats(values: list[float]) -> dict | None:
+    stats = TimingStats.from_values(values)
+    return stats.model_dump() if stats else None
+
+
+def run_profile(host: str, name: str, args) -> dict:
+    import requests
+
+    profile = PROFILES[name]
+    rng = random.Random(args.seed)
+    jobs = []
+    sub_idx = 0
+    for _ in range(args.requests):
+        if profile.batch_sizes:
+            size = rng.choice(profile.batch_sizes)
+            subs = [profile.make_submission(sub_idx + k, rng, args) for k in range(size)]
+            endpoint = '/run/long-batch' if args.long_batch else '/run/batch'
+            jobs.append((endpoint, {'type': 'batch', 'submissions': subs}))
+        else:
+            size = 1
+            jobs.append(('/run', profile.make_submission(sub_idx, rng, args)))
+        sub_idx += size
+
+    local = threading.local()
+
+    def _send(job):
+        endpoint, body = job
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = perf_counter()
+        try:
+            response = local.session.post(f'{host}{endpoint}', json=body, timeout=args.request_timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception:
+            return endpoint, perf_counter() - start, None
+        results = data['results'] if 'results' in data else [data]
+        return endpoint, perf_counter() - start, [SubmissionResult.model_validate(r) for r in results]
+
+    start = perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        responses = list(pool.map(_send, jobs))
+    duration = perf_counter() - start
+
+    latencies: dict[str, list[float]] = {}
+    results: list[SubmissionResult] = []
+    errors = 0
+    for endpoint, latency, sub_results in responses:
+        if sub_results is None:
+            errors += 1
+            continue
+        latencies.setdefault(endpoint, []).append(latency)
+        results.extend(sub_results)
+
+    timing = BatchTiming.from_results(results)
+    return {
+        'requests': len(jobs),
+        'submissions': sub_idx,
+        'errors': errors,
+        'duration': duration,
+        'requests_per_second': len(jobs) / duration,
+        'submissions_per_second': len(results) / duration,
+        'success_rate': sum(r.success for r in results) / len(results) if results else 0.0,
+        'reasons': dict(Counter(r.reason.value or 'none' for r in results)),
+        'latency': {endpoint: _stats(values) for endpoint, values in latencies.items()},
+        'phases': timing.model_dump() if timing else None,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT).returncode != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    names = args.profiles.split(',')
+    for name in names:
+        if name not in PROFILES:
+            raise SystemExit(f'unknown profile {name}, available: {",".join(PROFILES)}')
+    args.concurrency = args.concurrency or args.workers * 2
+
+    report = {
+        'commit': _commit(),
+        'time': time(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k != 'func'},
+        'profiles': {},
+    }
+
+    def _run_all(host: str):
+        for name in names:
+            # warm up (imports, compiler caches), not reported
+            run_profile(host, name, argparse.Namespace(**{**vars(args), 'requests': min(args.requests, args.concurrency)}))
+            report['profiles'][name] = run_profile(host, name, args)
+
+    if args.host:
+        _run_all(args.host)
+    else:
+        if not args.redis_server:
+            raise SystemExit('redis-server is not found, install redislite or use --redis-server')
+        log_dir = tempfile.mkdtemp(prefix='judge-bench-')
+        with Stack(args.workers, args.redis_server, log_dir) as stack:
+            _run_all(stack.host)
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+def _change(old, new) -> float | None:
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old
+
+
+def compare(args):
+    old, new = json.loads(Path(args.old).read_text()), json.loads(Path(args.new).read_text())
+    diff = {'old': old['commit'], 'new': new['commit'], 'profiles': {}}
+    for name in old['profiles'].keys() & new['profiles'].keys():
+        a, b = old['profiles'][name], new['profiles'][name]
+        profile_diff = {
+            'submissions_per_second': _change(a['submissions_per_second'], b['submissions_per_second']),
+            'success_rate': b['success_rate'] - a['success_rate'],
+            'latency': {},
+            'phases': {},
+        }
+        for endpoint in a['latency'].keys() & b['latency'].keys():
+            profile_diff['latency'][endpoint] = {
+                q: _change(a['latency'][endpoint][q], b['latency'][endpoint][q]) for q in ('p50', 'p99')
+            }
+        for phase in (a['phases'] or {}).keys() & (b['phases'] or {}).keys():
+            if a['phases'][phase] and b['phases'][phase]:
+                profile_diff['phases'][phase] = {
+                    q: _change(a['phases'][phase][q], b['phases'][phase][q]) for q in ('p50', 'p99')
+                }
+        diff['profiles'][name] = profile_diff
+    print(json.dumps(diff, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency of the judge with fixed workload profiles')
+    subparsers = parser.add_subparsers(required=True)
+
+    p = subparsers.add_parser('run', help='run the profiles and print a json report')
+    p.add_argument('--profiles', default=','.join(PROFILES), help=f'comma separated, available: {",".join(PROFILES)}')
+    p.add_argument('--workers', type=int, default=4, help='number of workers to start')
+    p.add_argument('--requests', type=int, default=50, help='requests per profile')
+    p.add_argument('--concurrency', type=int, default=0, help='concurrent requests, default: 2 * workers')
+    p.add_argument('--io-size', type=int, default=1024 * 1024, help='input/output size of large_io in bytes')
+    p.add_argument('--time-limit', type=float, default=1, help='time limit of the timeout profile')
+    p.add_argument('--long-batch', action='store_true', help='send the batches to /run/long-batch')
+    p.add_argument('--request-timeout', type=float, default=600)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('-H', '--host', help='use a running api instead of starting one')
+    p.add_argument('--redis-server', default=_default_redis_server(), help='redis-server binary')
+    p.add_argument('-o', '--output', help='also save the report to this file')
+    p.set_defaults(func=run)
+
+    p = subparsers.add_parser('compare', help='relative change from the old report to the new one')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
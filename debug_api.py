@@ -6,6 +6,10 @@ if os.environ.get('REDIS_URI') is None:
     os.environ['REDIS_URI'] = 'redis://localhost:6379/10'
 if os.environ.get('ERROR_CASE_SAVE_PATH') is None:
     os.environ['ERROR_CASE_SAVE_PATH'] = './error_cases'
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR') is None:
+    # collect the metrics of workers in /metrics
+    import tempfile
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='judge-metrics-')
 
 import logging
 logging.basicConfig(
@@ -1,8 +1,13 @@
-import requests
+import asyncio
+from collections import deque
+import heapq
 import math
-from typing import Literal
-from dataclasses import dataclass, asdict
-from concurrent.futures import ProcessPoolExecutor
+import random
+from typing import AsyncIterator, Literal
+from dataclasses import dataclass, asdict, fields
+
+import httpx
+import requests
 
 
 def chunkify(iterable, size):
@@ -17,6 +22,9 @@ class Submission:
     solution: str
     input: str | None = None
     expected_output: str | None = None
+    # function-call mode of python: test_cases are dicts with args/kwargs/expected
+    entry_point: str | None = None
+    test_cases: list[dict] | None = None
 
 
 @dataclass
@@ -28,12 +36,20 @@ class SubmissionResult:
     stdout: str | None = None
     stderr: str | None = None
     reason: str = ''
+    test_results: list[dict] | None = None
+
+    @classmethod
+    def from_response(cls, response: dict):
+        # ignore the fields added by newer servers
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in response.items() if k in names})
 
 
 @dataclass
 class BatchSubmission:
     type: Literal['batch']
     submissions: list[Submission]
+    tenant: str | None = None
 
 
 @dataclass
@@ -45,7 +61,7 @@ class BatchSubmissionResult:
     def from_response(cls, response: dict):
         return cls(
             sub_id=response['sub_id'],
-            results=[SubmissionResult(**result) for result in response['results']]
+            results=[SubmissionResult.from_response(result) for result in response['results']]
         )
 
 
@@ -53,29 +69,92 @@ class BatchSubmissionResult:
 class ServerStatus:
     queue: int
     num_workers: int
+    busy_workers: int | None = None
+    idle_workers: int | None = None
 
+    @classmethod
+    def from_response(cls, response: dict):
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in response.items() if k in names})
+
+
+class FlowControl:
+    """
+    AIMD window of submissions in flight.
+    The goal is to keep every worker busy with about `queue_factor` queued items per worker,
+    so that work doesn't wait in the queue long enough to expire.
+    - `/status` gives the upper bound (num_workers * (1 + queue_factor)) and a longer queue than the target
+      (caused by us or by other clients) shrinks the window.
+    - a batch with `queue_timeout` results shrinks the window by `decrease_factor`,
+      at most once per round trip (only batches sent after the last decrease count).
+    - a batch without timeouts grows the window, by about `num_workers / 4` per round trip.
+    """
+    def __init__(self, min_window: int = 1, queue_factor: float = 1.0, decrease_factor: float = 0.5, cooldown: float = 5):
+        self.min_window = min_window
+        self.queue_factor = queue_factor
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.window = float(min_window)
+        self.max_window = math.inf
+        self.increase = 1.0
+        self.num_workers = 0
+        self.last_decrease_time = -math.inf
 
-def _judge_batch(url: str, submissions: list[Submission], timeout: int = 3600) -> list[SubmissionResult]:
-    if not submissions:
-        return []
+    def _clamp(self, window: float) -> float:
+        return max(self.min_window, min(self.max_window, window))
 
-    batch_submission = BatchSubmission(submissions=submissions, type='batch')
-    response = requests.post(
-        f'{url}/judge/long-batch',
-        json=asdict(batch_submission),
-        timeout=timeout,
-    )
-    response.raise_for_status()
-    result = BatchSubmissionResult.from_response(response.json())
-    return result.results
+    def _decrease(self, now: float):
+        self.window = self._clamp(self.window * self.decrease_factor)
+        self.last_decrease_time = now
+
+    def on_status(self, status: 'ServerStatus', now: float):
+        if status.num_workers <= 0:
+            return
+        target_queue = status.num_workers * self.queue_factor
+        self.max_window = max(self.min_window, status.num_workers + target_queue)
+        self.increase = max(1.0, status.num_workers / 4)
+        if not self.num_workers:
+            # start with filling the idle workers and the target queue
+            self.window = self._clamp(status.num_workers + target_queue - status.queue)
+        elif status.queue > target_queue and now - self.last_decrease_time >= self.cooldown:
+            self._decrease(now)
+        else:
+            self.window = self._clamp(self.window)
+        self.num_workers = status.num_workers
+
+    def on_batch(self, send_time: float, size: int, queue_timeouts: int, now: float):
+        if queue_timeouts:
+            if send_time >= self.last_decrease_time:
+                self._decrease(now)
+        else:
+            self.window = self._clamp(self.window + self.increase * size / self.window)
 
 
 class JudgeClient:
-    def __init__(self, url, *, max_batch_size=1000, max_workers=4):
+    """
+    max_workers is the max number of batch requests in flight.
+    All requests of a `judge` call share one keep-alive connection pool.
+    The number of submissions in flight is adapted to the load of the cluster (see `FlowControl`),
+    and `queue_timeout` results are retried with jittered exponential backoff.
+    """
+    def __init__(
+            self,
+            url,
+            *,
+            max_batch_size=1000,
+            max_workers=4,
+            timeout: float = 3600,
+            status_interval: float = 5,
+            max_backoff: float = 60,
+            tenant: str | None = None,
+    ):
         self.url = url
         self.max_batch_size = max_batch_size
         self.max_workers = max_workers
-        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.timeout = timeout
+        self.status_interval = status_interval
+        self.max_backoff = max_backoff
+        self.tenant = tenant  # the server shares the workers between tenants
 
     def get_status(self, timeout: int = 10) -> ServerStatus:
         response = requests.get(
@@ -83,52 +162,108 @@ class JudgeClient:
             timeout=timeout,
         )
         response.raise_for_status()
-        return ServerStatus(**response.json())
+        return ServerStatus.from_response(response.json())
 
-    def judge(self, submissions: list[Submission]) -> list[SubmissionResult]:
-        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
-            return self._judge(executor, submissions)
+    def _session(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_workers + 1, max_keepalive_connections=self.max_workers + 1),
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        """full jitter, so that the retries of many clients don't come back at the same time"""
+        return random.uniform(0, min(self.max_backoff, 2 ** (attempt - 1)))
+
+    async def _update_status(self, session: httpx.AsyncClient, flow: FlowControl):
+        try:
+            response = await session.get('/status', timeout=10)
+            response.raise_for_status()
+            flow.on_status(ServerStatus.from_response(response.json()), asyncio.get_running_loop().time())
+        except (httpx.HTTPError, TypeError, ValueError) as e:
+            print(f'Failed to get status: {e!r}')
 
-    def _judge(
+    async def _poll_status(self, session: httpx.AsyncClient, flow: FlowControl):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            await self._update_status(session, flow)
+
+    async def _judge_batch(
             self,
-            executor: ProcessPoolExecutor,
-            submissions: list[Submission],
-    ) -> list[SubmissionResult]:
-        if not submissions:
-            return []
+            session: httpx.AsyncClient,
+            chunk: list[tuple[int, Submission]],
+    ) -> tuple[list[tuple[int, Submission]], float, list[SubmissionResult]]:
+        send_time = asyncio.get_running_loop().time()
+        batch_submission = BatchSubmission(submissions=[sub for _, sub in chunk], type='batch', tenant=self.tenant)
+        response = await session.post('/judge/long-batch', json=asdict(batch_submission))
+        response.raise_for_status()
+        return chunk, send_time, BatchSubmissionResult.from_response(response.json()).results
+
+    async def iter_judge(self, submissions: list[Submission]) -> AsyncIterator[tuple[int, SubmissionResult]]:
+        """
+        Yield (index in `submissions`, result) as soon as the batch of the submission is finished.
+        Submissions with `queue_timeout` are retried, so every index is yielded exactly once.
+        """
+        loop = asyncio.get_running_loop()
+        flow = FlowControl()
+        ready = deque(enumerate(submissions))
+        retries: list[tuple[float, int, Submission]] = []  # heap of (retry time, index, submission)
+        attempts: dict[int, int] = {}
+        tasks = set()
+        in_flight = 0
+        async with self._session() as session:
+            await self._update_status(session, flow)
+            status_task = asyncio.create_task(self._poll_status(session, flow))
+            try:
+                while ready or retries or tasks:
+                    now = loop.time()
+                    while retries and retries[0][0] <= now:
+                        _, sub_id, sub = heapq.heappop(retries)
+                        ready.append((sub_id, sub))
+                    # split the window evenly between the connections
+                    batch_size = min(self.max_batch_size, math.ceil(flow.window / self.max_workers))
+                    while ready and len(tasks) < self.max_workers and in_flight < flow.window:
+                        size = min(batch_size, len(ready), max(1, math.floor(flow.window - in_flight)))
+                        chunk = [ready.popleft() for _ in range(size)]
+                        in_flight += size
+                        tasks.add(asyncio.create_task(self._judge_batch(session, chunk)))
+
+                    wait_time = max(0, retries[0][0] - now) if retries else None
+                    if not tasks:
+                        await asyncio.sleep(wait_time)
+                        continue
+                    done, _ = await asyncio.wait(tasks, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        tasks.remove(task)
+                        chunk, send_time, results = task.result()
+                        in_flight -= len(chunk)
+                        queue_timeouts = 0
+                        for (sub_id, sub), sub_result in zip(chunk, results):
+                            if sub_result.reason == 'queue_timeout':
+                                # Retry the submission later
+                                queue_timeouts += 1
+                                attempts[sub_id] = attempts.get(sub_id, 0) + 1
+                                heapq.heappush(retries, (loop.time() + self._backoff(attempts[sub_id]), sub_id, sub))
+                            else:
+                                yield sub_id, sub_result
+                        flow.on_batch(send_time, len(chunk), queue_timeouts, loop.time())
+                        if queue_timeouts:
+                            print(f'Got {queue_timeouts} timeouts, {len(retries)} submissions to retry. '
+                                  f'Window: {flow.window:.0f} submissions.')
+            finally:
+                # the caller stopped early or a request failed
+                status_task.cancel()
+                for task in tasks:
+                    task.cancel()
 
-        n_sumissions = len(submissions)
-        sub_ids = list(range(len(submissions)))
+    async def judge_async(self, submissions: list[Submission]) -> list[SubmissionResult]:
         results = {}
+        async for sub_id, sub_result in self.iter_judge(submissions):
+            results[sub_id] = sub_result
+        return [results[i] for i in range(len(submissions))]
 
-        while submissions:
-            num_batches = max(math.ceil(len(submissions) / self.max_batch_size), self.max_workers)
-            batch_size = math.ceil(len(submissions) / num_batches)
-
-            print(f'Judging {len(submissions)} submissions in {num_batches} batches of {batch_size}.')
-
-            pending_chunks = list(
-                chunkify(
-                    [(sub, id) for sub, id in zip(submissions, sub_ids)],
-                    batch_size)
-            )
-            futures = [
-                executor.submit(_judge_batch, self.url, [c[0] for c in chunk])
-                for chunk in pending_chunks
-            ]
-            queue_timeouts = []
-            for i, future in enumerate(futures):
-                pending_chunk = pending_chunks[i]
-                result = future.result()
-                for (sub, sub_id), sub_result in zip(pending_chunk, result):
-                    if sub_result.reason == 'queue_timeout':
-                        # Retry the submission later
-                        queue_timeouts.append((sub_id, sub))
-                    else:
-                        results[sub_id] = sub_result
-                print(f'Processed {len(results)} submissions, Got {len(queue_timeouts)} timeouts in total.')
-
-            submissions = [sub for _, sub in queue_timeouts]
-            sub_ids = [sub_id for sub_id, _ in queue_timeouts]
-
-        return [results[i] for i in range(n_sumissions)]
+    def judge(self, submissions: list[Submission]) -> list[SubmissionResult]:
+        """Blocking version of `judge_async`. Use `judge_async` inside a running event loop."""
+        if not submissions:
+            return []
+        return asyncio.run(self.judge_async(submissions))
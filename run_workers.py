@@ -1,4 +1,15 @@
 import logging
+import os
+import glob
+import tempfile
+
+if int(os.environ.get('METRICS_PORT', 0)):
+    # collect the metrics of all worker processes.
+    # It must be set before prometheus_client is imported.
+    metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='judge-metrics-'))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(path)
 
 from app.worker_manager import WorkerManager
 
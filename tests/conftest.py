@@ -0,0 +1,4 @@
+import os
+
+# app.config needs it, but the tests don't connect to redis
+os.environ.setdefault('REDIS_URI', 'redis://localhost:6379')
@@ -0,0 +1,85 @@
+import pytest
+
+from app.autoscaler import AutoscalePolicy, AutoscaleStats
+
+
+def stats(workers=4, busy_workers=4, queue_length=0, cpu_count=16, cpu_percent=30.0, memory_percent=30.0):
+    return AutoscaleStats(workers, busy_workers, queue_length, cpu_count, cpu_percent, memory_percent)
+
+
+def policy(**kwargs):
+    options = dict(
+        scale_up_busy_ratio=0.9, scale_down_busy_ratio=0.3, max_cpu_percent=90, max_memory_percent=90,
+        cooldown=10, scale_down_delay=30,
+    )
+    options.update(kwargs)
+    return AutoscalePolicy(1, 16, **options)
+
+
+def test_scale_up_on_backlog():
+    desired, reason = policy().decide(stats(queue_length=100), now=100)
+    assert reason == 'backlog'
+    assert 4 < desired <= 16
+
+
+def test_no_scale_up_without_idle_cpus():
+    # 11% of 4 cpus rounds to no idle cpu
+    assert policy().decide(stats(cpu_count=4, queue_length=100, cpu_percent=89), now=100) == (4, '')
+
+
+def test_no_scale_up_when_workers_are_not_busy():
+    assert policy().decide(stats(queue_length=100, busy_workers=2), now=100) == (4, '')
+
+
+def test_scale_up_is_capped_by_max_workers():
+    assert policy().decide(stats(workers=15, busy_workers=15, queue_length=100), now=100)[0] == 16
+
+
+def test_cooldown_after_a_change():
+    scaler = policy()
+    assert scaler.decide(stats(queue_length=100), now=100)[1] == 'backlog'
+    assert scaler.decide(stats(workers=8, busy_workers=8, queue_length=100), now=105) == (8, '')
+    assert scaler.decide(stats(workers=8, busy_workers=8, queue_length=100), now=111)[1] == 'backlog'
+
+
+def test_scale_down_on_memory_pressure():
+    desired, reason = policy().decide(stats(workers=8, memory_percent=95), now=100)
+    assert reason == 'memory_pressure'
+    assert desired == 6
+
+
+def test_scale_down_on_cpu_pressure_leaves_cpus_to_other_processes():
+    # 8 busy workers, and other processes use 15.2 - 8 = 7.2 of the 16 cpus, so 90% leaves 14.4 - 7.2 to workers
+    desired, reason = policy().decide(stats(workers=8, busy_workers=8, cpu_percent=95), now=100)
+    assert reason == 'cpu_pressure'
+    assert desired == 7
+    # but at most a quarter at a time
+    desired, reason = policy().decide(stats(workers=8, busy_workers=8, cpu_percent=100), now=100)
+    assert reason == 'cpu_pressure'
+    assert desired == 6
+
+
+def test_scale_down_when_idle_for_the_delay():
+    scaler = policy()
+    idle = stats(workers=8, busy_workers=1)
+    assert scaler.decide(idle, now=100) == (8, '')
+    assert scaler.decide(idle, now=120) == (8, '')
+    desired, reason = scaler.decide(idle, now=131)
+    assert reason == 'idle'
+    assert desired == 6
+
+
+def test_backlog_resets_the_idle_time():
+    scaler = policy()
+    assert scaler.decide(stats(workers=8, busy_workers=1), now=100) == (8, '')
+    assert scaler.decide(stats(workers=8, busy_workers=1, queue_length=1), now=120) == (8, '')
+    assert scaler.decide(stats(workers=8, busy_workers=1), now=131) == (8, '')
+
+
+def test_out_of_bounds_is_fixed_first():
+    assert policy().decide(stats(workers=20, busy_workers=20), now=100) == (16, 'bounds')
+
+
+def test_busy_ratios_must_be_ordered():
+    with pytest.raises(ValueError):
+        policy(scale_up_busy_ratio=0.3, scale_down_busy_ratio=0.5)
@@ -0,0 +1,128 @@
+import random
+import time
+
+import pytest
+
+from app.libs.comparators import StreamingComparator, compare_text
+from app.libs.executors.executor import MISMATCH_EXIT_CODE
+from app.libs.executors.python_executor import PythonExecutor, SCRIPT_ENDING_MARK
+
+
+def stream(expected: str, mode: str, chunks: list[bytes], end_mark: str | None = None) -> bool:
+    comparator = StreamingComparator(expected, mode, end_mark)
+    return all(comparator.feed(chunk) for chunk in chunks)
+
+
+def splits(data: bytes):
+    """data in one chunk, and split in two at every position"""
+    yield [data]
+    for i in range(1, len(data)):
+        yield [data[:i], data[i:]]
+
+
+@pytest.mark.parametrize('actual, expected, mode, result', [
+    ('1\n2\n', '1\n2', 'exact', True),
+    ('1  \n2\t\n\n\n', '1\n2', 'exact', True),
+    ('\n\n1\n2', '1\n2\n', 'exact', True),
+    ('1\n\n2', '1\n2', 'exact', False),
+    ('1 2', '1  2', 'exact', False),
+    ('1 2\n3', '1\n2 3', 'tokens', True),
+    ('1 2', '1 2 3', 'tokens', False),
+    ('', '', 'exact', True),
+    ('', '1', 'tokens', False),
+])
+def test_compare_text(actual, expected, mode, result):
+    assert compare_text(actual, expected, mode) is result
+
+
+@pytest.mark.parametrize('actual, expected, mode', [
+    ('1  \n2\t\n\n\n', '1\n2', 'exact'),
+    ('\n\n1\n\n2\n', '1\n\n2', 'exact'),
+    ('1\n\n2', '1\n2', 'exact'),
+    ('1 2\n3', '1\n2 3', 'tokens'),
+    ('12 3', '123', 'tokens'),
+    ('123', '12 3', 'tokens'),
+    ('é ü\n', 'é ü', 'exact'),
+    ('1\n2\n3', '1\n2', 'exact'),
+    ('1\n', '1\n2', 'exact'),
+])
+def test_streaming_agrees_at_every_chunk_boundary(actual, expected, mode):
+    for chunks in splits(actual.encode()):
+        # a definitive mismatch may be found early, but never for output compare_text accepts
+        if compare_text(actual, expected, mode):
+            assert stream(expected, mode, chunks), chunks
+
+
+def test_streaming_never_rejects_accepted_output():
+    rng = random.Random(0)
+    alphabet = ['1', '2', ' ', '\t', '\n', '\n', 'a']
+    for _ in range(3000):
+        expected = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+        actual = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+        data = actual.encode()
+        cuts = sorted(rng.sample(range(1, len(data)), min(3, len(data) - 1))) if len(data) > 1 else []
+        chunks = [data[i:j] for i, j in zip([0, *cuts], [*cuts, len(data)])]
+        for mode in ('exact', 'tokens'):
+            if compare_text(actual, expected, mode):
+                assert stream(expected, mode, chunks), (actual, expected, mode)
+
+
+def test_streaming_finds_the_first_mismatch_early():
+    comparator = StreamingComparator('1\n2\n3', 'exact')
+    assert comparator.feed(b'1\n')
+    assert not comparator.feed(b'5\n')
+
+    comparator = StreamingComparator('1 2 3', 'tokens')
+    assert comparator.feed(b'1 2')     # `2` may still become `23`
+    assert not comparator.feed(b'3 ')
+
+
+def test_streaming_waits_for_complete_lines_and_tokens():
+    # an incomplete line/token is not compared until it ends
+    assert StreamingComparator('12', 'exact').feed(b'1')
+    assert StreamingComparator('12', 'tokens').feed(b'1')
+    # extra output is only a mismatch once it is complete
+    comparator = StreamingComparator('1', 'exact')
+    assert comparator.feed(b'1\n')
+    assert comparator.feed(b'\n \n')   # trailing blank lines are ignored
+    assert not comparator.feed(b'2\n')
+
+
+def test_streaming_utf8_split_in_a_character():
+    data = 'é\n'.encode()
+    assert stream('é', 'exact', [data[:1], data[1:]])
+
+
+def test_streaming_ignores_everything_after_the_end_mark():
+    data = b'1\n2\n' + SCRIPT_ENDING_MARK.encode() + b'\nTraceback ...\n'
+    for chunks in splits(data):
+        assert stream('1\n2', 'exact', chunks, SCRIPT_ENDING_MARK), chunks
+        assert stream('1 2', 'tokens', chunks, SCRIPT_ENDING_MARK), chunks
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        StreamingComparator('1', 'fuzzy')
+
+
+def _execute(script: str, expected: str):
+    executor = PythonExecutor(python_path='python3', timeout=10, line_buffered=True)
+    comparator = StreamingComparator(expected, 'exact', executor.stdout_end_mark)
+    start = time.perf_counter()
+    result = executor.execute_script(script, stdout_checker=comparator.feed)
+    return result, time.perf_counter() - start
+
+
+def test_executor_kills_at_the_first_mismatch():
+    result, elapsed = _execute('import time\nprint(1)\ntime.sleep(10)\nprint(2)', '2\n2')
+    assert result.exit_code == MISMATCH_EXIT_CODE
+    assert not result.success
+    assert elapsed < 5
+    assert 'first mismatch' in result.stderr
+
+
+def test_executor_runs_matching_output_to_the_end():
+    result, _ = _execute('for i in range(3):\n    print(i, "  ")', '0\n1\n2')
+    assert result.exit_code == 0
+    assert result.success
+    assert compare_text(result.stdout, '0\n1\n2', 'exact')
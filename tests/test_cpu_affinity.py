@@ -0,0 +1,48 @@
+import pytest
+
+import app.libs.cpu_affinity as cpu_affinity
+from app.libs.cpu_affinity import parse_cpu_list, plan_cpu_sets
+
+
+@pytest.mark.parametrize('cpu_list, cpus', [
+    ('0-3,8,10-11', [0, 1, 2, 3, 8, 10, 11]),
+    ('5', [5]),
+    (' 0-1 ,\n', [0, 1]),
+    ('', []),
+])
+def test_parse_cpu_list(cpu_list, cpus):
+    assert parse_cpu_list(cpu_list) == cpus
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """8 cpus on 4 cores with 2 SMT siblings each: (0, 4), (1, 5), (2, 6), (3, 7)"""
+    monkeypatch.setattr(cpu_affinity.os, 'sched_getaffinity', lambda pid: set(range(8)))
+    monkeypatch.setattr(cpu_affinity, 'cpu_siblings', lambda cpu: [cpu % 4, cpu % 4 + 4])
+
+
+def test_one_cpu_per_core_with_skip_smt(host):
+    # the core of the reserved cpu 0 (with its sibling 4) is not used at all
+    assert plan_cpu_sets(1, [0], skip_smt=True) == [{1}, {2}, {3}]
+
+
+def test_siblings_stay_together_without_skip_smt(host):
+    assert plan_cpu_sets(2, [0, 4], skip_smt=False) == [{1, 5}, {2, 6}, {3, 7}]
+
+
+def test_reserved_cpu_without_its_sibling(host):
+    sets = plan_cpu_sets(1, [0], skip_smt=False)
+    assert len(sets) == 7
+    assert set().union(*sets) == set(range(1, 8))
+
+
+def test_sets_are_disjoint_and_incomplete_sets_are_dropped(host):
+    sets = plan_cpu_sets(3, [], skip_smt=False)
+    assert len(sets) == 2
+    assert sets[0].isdisjoint(sets[1])
+    assert all(len(cpus) == 3 for cpus in sets)
+
+
+def test_only_allowed_cpus(monkeypatch, host):
+    monkeypatch.setattr(cpu_affinity.os, 'sched_getaffinity', lambda pid: {2, 3, 6, 7})
+    assert plan_cpu_sets(1, [], skip_smt=True) == [{2}, {3}]
@@ -0,0 +1,63 @@
+from app.model import Submission, TestCase
+from app.worker_manager import judge
+
+
+def function_call(solution: str, entry_point: str, cases: list[tuple[list, object]]) -> Submission:
+    return Submission(
+        type='python', solution=solution, entry_point=entry_point,
+        test_cases=[TestCase(args=args, expected=expected) for args, expected in cases],
+    )
+
+
+def test_passing_and_failing_cases():
+    sub = function_call('def add(a, b):\n    return a + b if a else 0', 'add', [([1, 2], 3), ([0, 5], 5), ([0.1, 0.2], 0.3)])
+    result = judge(sub)
+    assert not result.success
+    assert [r.passed for r in result.test_results] == [True, False, True]
+    assert result.test_results[1].output == '0'
+
+
+def test_method_of_a_class():
+    sub = function_call('class Solution:\n    def twice(self, x):\n        return [x, x]', 'Solution.twice', [([1], [1, 1])])
+    result = judge(sub)
+    assert result.success
+    assert len(result.test_results) == 1
+
+
+def test_exception_of_a_case():
+    sub = function_call('def f(x):\n    return 1 // x', 'f', [([1], 1), ([0], 0), ([2], 0)])
+    result = judge(sub)
+    assert [r.passed for r in result.test_results] == [True, False, True]
+    assert result.test_results[1].error.startswith('ZeroDivisionError')
+
+
+def test_chatty_function_keeps_its_results():
+    # output without a trailing newline must not hide the result line printed after it
+    solution = (
+        'import sys\n'
+        'def add(a, b):\n'
+        '    print("dbg", end="")\n'
+        '    sys.stdout.write("@")\n'
+        '    return a + b\n'
+    )
+    sub = function_call(solution, 'add', [([1, 2], 3), ([2, 2], 4)])
+    result = judge(sub)
+    assert result.success
+    assert [r.passed for r in result.test_results] == [True, True]
+    assert result.stdout == 'dbg@dbg@'
+
+
+def test_printed_lines_are_kept_as_stdout():
+    sub = function_call('def f(x):\n    print("x is", x)\n    return x', 'f', [([1], 1), ([2], 2)])
+    result = judge(sub)
+    assert result.success
+    assert result.stdout == 'x is 1\nx is 2\n'
+
+
+def test_timeout_keeps_the_finished_cases():
+    solution = 'def f(x):\n    while x:\n        pass\n    return x'
+    sub = function_call(solution, 'f', [([0], 0), ([1], 1)])
+    sub.options = {'time_limit': '1'}
+    result = judge(sub)
+    assert not result.success
+    assert [r.passed for r in result.test_results] == [True]
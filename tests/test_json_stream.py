@@ -0,0 +1,115 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from app.libs.json_stream import JsonObjectParser, iter_json_objects
+
+
+OBJECTS = [
+    {'type': 'python', 'solution': 'print("{}")\n', 'input': '1 2'},
+    {'s': 'a "quoted" } { string \\ with \\" escapes', 'n': {'x': [1, {'y': '}'}]}},
+    {'unicode': 'é ü 中文'},
+]
+
+
+def parse(text: str, sizes: list[int], max_object_size: int = 10 ** 9, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    parser = JsonObjectParser(max_object_size)
+    objects = []
+    pos = 0
+    while pos < len(text):
+        size = rng.choice(sizes)
+        objects += parser.feed(text[pos:pos + size])
+        pos += size
+    return objects + parser.feed('', final=True)
+
+
+BODIES = {
+    'array': json.dumps(OBJECTS),
+    'indented array': ' \n[\n' + ',\n'.join(json.dumps(o, indent=2) for o in OBJECTS) + '\n]\n',
+    'ndjson': '\n'.join(json.dumps(o) for o in OBJECTS) + '\n',
+    'ndjson without trailing newline': '\n'.join(json.dumps(o) for o in OBJECTS),
+}
+
+
+@pytest.mark.parametrize('name', BODIES)
+@pytest.mark.parametrize('sizes', [[10 ** 6], [1], [1, 2, 3, 7], [50]])
+def test_parse(name, sizes):
+    assert parse(BODIES[name], sizes) == OBJECTS
+
+
+def test_every_split_point():
+    for text in BODIES.values():
+        for i in range(1, len(text)):
+            parser = JsonObjectParser(10 ** 9)
+            assert parser.feed(text[:i]) + parser.feed(text[i:], final=True) == OBJECTS
+
+
+@pytest.mark.parametrize('text', ['', '  \n', '[]', ' [ ] '])
+def test_empty(text):
+    assert parse(text, [1]) == []
+
+
+@pytest.mark.parametrize('text, error', [
+    ('[{"a":1},]', 'trailing'),
+    ('[{"a":1},\n]', 'trailing'),
+    ('{"a":1}{"b":2}', 'whitespace'),
+    ('{"a":1},{"b":2}', 'whitespace'),
+    ('[{"a":1} {"b":2}]', 'expected `,`'),
+    ('[,{"a":1}]', 'not an object'),
+    ('[1]', 'not an object'),
+    ('{"a":1}\n2', 'not an object'),
+    ('[{"a":1}', 'not closed'),
+    ('{"a":1', 'incomplete'),
+    ('{"a":"}"', 'incomplete'),
+    ('{"a":1]}', 'invalid json'),
+    ('[{"a":1}]x', 'after the end'),
+])
+@pytest.mark.parametrize('sizes', [[1], [3], [100]])
+def test_malformed(text, error, sizes):
+    with pytest.raises(ValueError, match=error):
+        parse(text, sizes)
+
+
+@pytest.mark.parametrize('sizes', [[7], [1000]])
+def test_max_object_size(sizes):
+    text = json.dumps([{'a': 'x' * 100}, {'b': 1}])
+    with pytest.raises(ValueError, match='bigger than 50'):
+        parse(text, sizes, max_object_size=50)
+    assert len(parse(text, sizes, max_object_size=200)) == 2
+
+
+def test_big_object_is_scanned_once():
+    # the rest of the object is not re-parsed at every chunk, so this is fast even in small chunks
+    text = json.dumps([{'solution': 'a\\"b\n' * 200_000}])
+    parser = JsonObjectParser(10 ** 9)
+    objects = []
+    for i in range(0, len(text), 1024):
+        objects += parser.feed(text[i:i + 1024])
+    assert len(objects + parser.feed('', final=True)) == 1
+
+
+def test_iter_json_objects():
+    data = BODIES['ndjson'].encode()
+
+    async def chunks():
+        for i in range(0, len(data), 5):   # splits the multibyte characters too
+            yield data[i:i + 5]
+
+    async def collect():
+        return [obj async for objects in iter_json_objects(chunks(), 10 ** 6) for obj in objects]
+
+    assert asyncio.run(collect()) == OBJECTS
+
+
+def test_iter_json_objects_invalid_utf8():
+    async def chunks():
+        yield b'{"a": "\xff"}'
+
+    async def collect():
+        return [objects async for objects in iter_json_objects(chunks(), 10 ** 6)]
+
+    with pytest.raises(ValueError, match='utf-8'):
+        asyncio.run(collect())
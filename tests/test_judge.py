@@ -0,0 +1,17 @@
+from time import perf_counter
+
+from app.model import ResultReason, Submission
+from app.worker_manager import HOST_TIMEOUT_MARGIN, judge
+
+
+def submission(solution: str, time_limit: int = 1, **kwargs) -> Submission:
+    return Submission(type='python', solution=solution, options={'time_limit': str(time_limit)}, **kwargs)
+
+
+def test_script_ignoring_its_alarm_is_killed_by_the_worker():
+    solution = 'import signal, time\nsignal.signal(signal.SIGALRM, signal.SIG_IGN)\ntime.sleep(30)'
+    start = perf_counter()
+    result = judge(submission(solution))
+    assert perf_counter() - start < 1 + HOST_TIMEOUT_MARGIN + 2
+    assert not result.success
+    assert result.reason == ResultReason.WORKER_TIMEOUT
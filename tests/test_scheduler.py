@@ -0,0 +1,27 @@
+from app.model import Submission
+from app.scheduler import cost_history_field, cost_history_keys, longest_first
+
+
+def test_solutions_of_a_problem_share_their_history():
+    a = Submission(type='python', solution='a', input='1', options={'problem_id': 'p1'})
+    b = Submission(type='python', solution='b', input='2', options={'problem_id': 'p1'})
+    assert cost_history_field(a) == cost_history_field(b)
+    assert cost_history_field(a).startswith('p:')
+
+
+def test_input_is_the_problem_without_problem_id():
+    a = Submission(type='python', solution='a', input='1')
+    b = Submission(type='python', solution='b', input='1')
+    assert cost_history_field(a) == cost_history_field(b)
+    assert cost_history_field(a).startswith('i:')
+    assert cost_history_field(Submission(type='python', solution='a')) is None
+
+
+def test_generations_are_in_the_same_slot():
+    key, old_key = cost_history_keys('cpp')
+    assert key != old_key
+    assert old_key.startswith(key) and key.endswith('{cpp}')
+
+
+def test_longest_first_keeps_the_order_of_ties():
+    assert longest_first([1, 3, 1, 3]) == [1, 3, 0, 2]
@@ -0,0 +1,62 @@
+import collections
+
+import pytest
+
+from app.tenants import DEFAULT_TENANT, FairShareScheduler, tenant_of_queue, work_queue_name
+
+
+def serve(scheduler: FairShareScheduler, tenants: list[str], rounds: int, costs: dict[str, float] | None = None):
+    """Always backlogged tenants, served one work item at a time. Returns the worker time by tenant."""
+    used = collections.Counter()
+    for _ in range(rounds):
+        tenant = scheduler.order(tenants)[0]
+        cost = (costs or {}).get(tenant, 1.0)
+        scheduler.start(tenant)
+        scheduler.finish(tenant, cost)
+        used[tenant] += cost
+    return used
+
+
+def test_share_follows_the_weights():
+    used = serve(FairShareScheduler({'a': 3, 'b': 1}), ['a', 'b'], 400)
+    assert used['a'] == pytest.approx(300, abs=2)
+    assert used['b'] == pytest.approx(100, abs=2)
+
+
+def test_share_is_by_worker_time_not_by_items():
+    # b's items are 4 times as long, so it gets a quarter of the items for the same time
+    used = serve(FairShareScheduler({}), ['a', 'b'], 500, costs={'a': 1, 'b': 4})
+    assert used['a'] == pytest.approx(used['b'], abs=4)
+
+
+def test_default_weight():
+    used = serve(FairShareScheduler({'a': 1}, default_weight=2), ['a', 'b'], 300)
+    assert used['b'] == pytest.approx(2 * used['a'], abs=3)
+
+
+def test_idle_tenant_does_not_save_up_credit():
+    scheduler = FairShareScheduler({})
+    serve(scheduler, ['a'], 100)
+    # b was idle while a ran alone, so it doesn't get the next 100 items in a row
+    used = serve(scheduler, ['a', 'b'], 20)
+    assert used['a'] == pytest.approx(10, abs=1)
+    assert used['b'] == pytest.approx(10, abs=1)
+
+
+def test_forgets_gone_tenants():
+    scheduler = FairShareScheduler({})
+    serve(scheduler, ['a', 'b'], 10)
+    scheduler.order(['a'])
+    assert set(scheduler.tenant_times) == {'a'}
+
+
+@pytest.mark.parametrize('weights, default_weight', [({'a': 0}, 1), ({'a': -1}, 1), ({}, 0)])
+def test_weights_must_be_positive(weights, default_weight):
+    with pytest.raises(ValueError):
+        FairShareScheduler(weights, default_weight)
+
+
+@pytest.mark.parametrize('tenant', [None, DEFAULT_TENANT, 'rl-job', 'a.b_c'])
+@pytest.mark.parametrize('shard', [0, 1, 7])
+def test_queue_names(tenant, shard):
+    assert tenant_of_queue(work_queue_name(tenant, shard)) == (tenant or DEFAULT_TENANT)
@@ -0,0 +1,261 @@
+import threading
+from time import time
+
+import pytest
+
+import app.config as app_config
+import app.worker_manager as worker_manager
+from app.cancellation import CancelWatcher, _group_marker_key, _marker_key
+from app.model import ResultReason, Submission, SubmissionResult, WorkPayload
+from app.tenants import TenantQueues, work_queue_name
+
+
+class FakeQueue:
+    """In memory `RedisQueue` (sync) with the commands used by a worker. Every write is logged in `log`."""
+    def __init__(self):
+        self.on_empty = None  # called when a worker waits for work, and nothing is left
+        self.values: dict[str, object] = {}
+        self.lists: dict[str, list] = {}
+        self.hashes: dict[str, dict] = {}
+        self.zsets: dict[str, dict] = {}
+        self.log: list[tuple] = []
+
+    def now(self):
+        return time()
+
+    def sync_time(self, rounds=10):
+        return 0.0
+
+    def set(self, key, value, expire=None):
+        self.log.append(('set', key))
+        self.values[key] = value
+
+    def set_multi(self, mapping, expire=None):
+        for key, value in mapping.items():
+            self.set(key, value, expire)
+
+    def get_multi(self, *keys):
+        return [self.values.get(key) for key in keys]
+
+    def push(self, queue_name, *values):
+        self.log.append(('push', queue_name))
+        self.lists.setdefault(queue_name, []).extend(values)
+
+    def push_capped(self, key, value, max_len):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def pop_first(self, *queue_names):
+        for queue_name in queue_names:
+            if self.lists.get(queue_name):
+                return queue_name, self.lists[queue_name].pop(0)
+        return None
+
+    def block_pop(self, *queue_names, timeout=0):
+        if (item := self.pop_first(*queue_names)) is None:
+            self.on_empty()
+        return item
+
+    def expire(self, key, timeout):
+        pass
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    def hset_rotating(self, key, old_key, field, value, max_len, expire):
+        self.log.append(('hset_rotating', field))
+        self.hset(key, field, value)
+
+    def zadd(self, key, member, score):
+        self.zsets.setdefault(key, {})[member] = score
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.zsets.get(key, {}).pop(member, None)
+
+    def zcount(self, key, min_score, max_score):
+        return len(self.zsets.get(key, {}))
+
+
+class RecordingTenantQueues(TenantQueues):
+    """Logs the charged costs in the log of the queue"""
+    def finish(self, cost):
+        if self.current is not None:
+            self.redis_queue.log.append(('finish', self.current, cost))
+        super().finish(cost)
+
+
+@pytest.fixture
+def run_worker(monkeypatch):
+    """Run a worker on the payloads (pushed to `queue`, a new one by default) until it is empty, returns the queue"""
+    def run(*payloads: WorkPayload, queue: FakeQueue | None = None, cancel_watcher: CancelWatcher | None = None):
+        worker = worker_manager.Worker()
+        queue = queue or FakeQueue()
+        queue.on_empty = worker.stop_event.set
+        queue.lists[work_queue_name(None)] = [payload.model_dump_json() for payload in payloads]
+        monkeypatch.setattr(worker_manager, 'connect_queue', lambda is_async=False: queue)
+        monkeypatch.setattr(worker_manager, 'TenantQueues', RecordingTenantQueues)
+        worker._run_loop(cancel_watcher or CancelWatcher(queue))
+        return queue
+    return run
+
+
+def published(queue: FakeQueue, payload: WorkPayload) -> list[SubmissionResult]:
+    return [
+        SubmissionResult.model_validate_json(result_json)
+        for result_json in queue.lists.get(f'{app_config.REDIS_RESULT_PREFIX}{payload.work_id}', [])
+    ]
+
+
+def python(solution: str, **kwargs) -> Submission:
+    return Submission(type='python', solution=solution, **kwargs)
+
+
+def test_judge_cost_is_charged_before_the_result_is_published(run_worker):
+    payload = WorkPayload(submission=python('import time\ntime.sleep(0.2)\nprint(1)', input='x', expected_output='1'))
+    queue = run_worker(payload)
+    [result] = published(queue, payload)
+    assert result.success
+    finishes = [entry for entry in queue.log if entry[0] == 'finish']
+    assert len(finishes) == 1
+    _, tenant, cost = finishes[0]
+    assert tenant == 'default'
+    # the time of judging, without the idle time of the worker after it
+    assert 0.2 <= cost < result.cost + 0.5
+    assert queue.log.index(finishes[0]) < queue.log.index(('push', f'{app_config.REDIS_RESULT_PREFIX}{payload.work_id}'))
+
+
+def test_dropped_work_costs_the_tenant_nothing(run_worker):
+    payload = WorkPayload(submission=python('print(1)'), timestamp=time() - app_config.MAX_QUEUE_WORK_LIFE_TIME - 1)
+    queue = run_worker(payload)
+    assert published(queue, payload) == []
+    assert [entry for entry in queue.log if entry[0] == 'finish'] == [('finish', 'default', 0)]
+
+
+def test_cancelled_work_is_skipped(run_worker):
+    payload = WorkPayload(submission=python('print(1)'), cancel_ids=['c1'], request_time=time() - 10)
+    queue = FakeQueue()
+    queue.values[_marker_key('c1')] = time() - 1
+    run_worker(payload, queue=queue)
+    [result] = published(queue, payload)
+    assert result.reason == ResultReason.CANCELLED
+    assert not result.success
+
+
+def test_cancellation_before_the_request_is_ignored(run_worker):
+    payload = WorkPayload(submission=python('print(1)'), cancel_ids=['c1'], request_time=time())
+    queue = FakeQueue()
+    queue.values[_marker_key('c1')] = time() - 10
+    run_worker(payload, queue=queue)
+    [result] = published(queue, payload)
+    assert result.success
+
+
+def test_running_work_is_killed_when_cancelled(run_worker):
+    payload = WorkPayload(submission=python('import time\ntime.sleep(10)'), cancel_ids=['c1'])
+    queue = FakeQueue()
+    threading.Timer(0.5, lambda: queue.set(_marker_key('c1'), time())).start()
+    start = time()
+    run_worker(payload, queue=queue)
+    assert time() - start < 5
+    [result] = published(queue, payload)
+    assert result.reason == ResultReason.CANCELLED
+
+
+def test_restarted_loop_keeps_the_cancel_watcher(run_worker):
+    queue = FakeQueue()
+    cancel_watcher = CancelWatcher(queue)
+    threads = threading.active_count()
+    for _ in range(3):
+        run_worker(WorkPayload(submission=python('print(1)')), queue=queue, cancel_watcher=cancel_watcher)
+    assert threading.active_count() == threads
+
+
+def test_work_past_its_deadline_is_dropped(run_worker):
+    payload = WorkPayload(submission=python('print(1)'), deadline=time() - 1)
+    queue = run_worker(payload)
+    assert published(queue, payload) == []
+    assert not any(entry[0] == 'hset_rotating' for entry in queue.log)
+
+
+def test_deadline_cuts_the_time_limit(run_worker):
+    payload = WorkPayload(
+        submission=python('import time\ntime.sleep(5)', options={'time_limit': '5'}), deadline=time() + 1
+    )
+    start = time()
+    queue = run_worker(payload)
+    assert time() - start < 4
+    [result] = published(queue, payload)
+    assert result.reason == ResultReason.QUEUE_TIMEOUT
+    # not a cost of the submission
+    assert not any(entry[0] == 'hset_rotating' for entry in queue.log)
+
+
+def test_verdict_only_work_returns_no_output(run_worker):
+    solution = 'import sys\nprint(input())\nprint("noise", file=sys.stderr)'
+    payload = WorkPayload(submission=python(solution, input='1', expected_output='1'), verdict_only=True)
+    full = WorkPayload(submission=python(solution, input='1', expected_output='1'))
+    queue = run_worker(payload, full)
+    [result] = published(queue, payload)
+    assert result.success
+    assert result.stdout is None and result.stderr is None
+    [full_result] = published(queue, full)
+    assert full_result.stdout == '1\n' and full_result.stderr == 'noise\n'
+
+
+def test_verdict_only_keeps_the_verdicts_of_function_calls(run_worker):
+    sub = python('def f(x):\n    return x', entry_point='f', test_cases=[{'args': [1], 'expected': 2}])
+    payload = WorkPayload(submission=sub, verdict_only=True)
+    queue = run_worker(payload)
+    [result] = published(queue, payload)
+    assert not result.success
+    assert [r.passed for r in result.test_results] == [False]
+    assert result.test_results[0].output is None
+
+
+def test_function_call_work(run_worker):
+    solution = 'def add(a, b):\n    print("dbg", end="")\n    return a + b'
+    sub = python(solution, entry_point='add', test_cases=[
+        {'args': [1, 2], 'expected': 3}, {'args': [2, 2], 'expected': 5},
+    ])
+    payload = WorkPayload(submission=sub)
+    queue = run_worker(payload)
+    [result] = published(queue, payload)
+    assert not result.success and result.run_success
+    assert [r.passed for r in result.test_results] == [True, False]
+    assert result.test_results[1].output == '4'
+    assert result.stdout == 'dbgdbg'
+
+
+def test_failed_group_skips_its_other_members(run_worker):
+    payloads = [
+        WorkPayload(submission=python('print(input())', input=str(i), expected_output='1'), group_id='b:g')
+        for i in (0, 1, 2)
+    ]
+    other = WorkPayload(submission=python('print(1)', expected_output='1'), group_id='b:h')
+    queue = run_worker(*payloads, other)
+    results = [published(queue, payload)[0] for payload in payloads]
+    assert not results[0].success and results[0].reason == ResultReason.UNSPECIFIED
+    assert [r.reason for r in results[1:]] == [ResultReason.SKIPPED, ResultReason.SKIPPED]
+    assert published(queue, other)[0].success
+    assert ('set', _group_marker_key('b:g')) in queue.log
+    assert ('set', _group_marker_key('b:h')) not in queue.log
+
+
+def test_running_member_is_killed_when_its_group_fails(run_worker):
+    payload = WorkPayload(
+        submission=python('import time\ntime.sleep(10)'), group_id='b:g', kill_on_group_failure=True
+    )
+    queue = FakeQueue()
+    threading.Timer(0.5, lambda: queue.set(_group_marker_key('b:g'), 1)).start()
+    start = time()
+    run_worker(payload, queue=queue)
+    assert time() - start < 5
+    [result] = published(queue, payload)
+    assert result.reason == ResultReason.SKIPPED